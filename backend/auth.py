@@ -1,110 +1,50 @@
 import os
 import time
-import json
 from typing import Optional, List, Dict, Any, Annotated
 import httpx
 from fastapi import FastAPI, Request, HTTPException, Depends, Response
 from fastapi.responses import RedirectResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, BaseSettings, HttpUrl, validator, constr, Field
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-import logging
-import logging.handlers
-from functools import lru_cache
 import asyncio
-from itsdangerous import URLSafeTimedSerializer
-from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 import secrets
+import hashlib
+import random
+from config import Settings, get_settings
+from library import LibraryStore, LibrarySync
+from ratelimit import BudgetedLimiter
+from resilience import CircuitOpen
+from result_cache import ResultCache
+from sessions import SessionStore, build_backend
+import spotify_client
+from logs import setup_logging
+from metrics import REGISTRY, MetricsMiddleware, register_cache, timed
 
-# Configure structured logging
-class StructuredLogFormatter(logging.Formatter):
-    def format(self, record):
-        log_data = {
-            'timestamp': self.formatTime(record),
-            'level': record.levelname,
-            'message': record.getMessage(),
-            'module': record.module,
-            'function': record.funcName,
-            'line': record.lineno,
-        }
-        
-        if hasattr(record, 'extra'):
-            log_data.update(record.extra)
-            
-        return json.dumps(log_data)
-
-# Set up logging configuration
-def setup_logging():
-    logger = logging.getLogger('auth')
-    logger.setLevel(logging.INFO)
-    
-    # Console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(StructuredLogFormatter())
-    logger.addHandler(console_handler)
-    
-    # File handler
-    file_handler = logging.handlers.RotatingFileHandler(
-        'auth.log',
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5
-    )
-    file_handler.setFormatter(StructuredLogFormatter())
-    logger.addHandler(file_handler)
-    
-    return logger
-
-logger = setup_logging()
+settings = get_settings()
+logger = setup_logging(
+    'auth',
+    level=settings.LOG_LEVEL,
+    log_file=settings.LOG_FILE,
+    sample_rates=settings.LOG_SAMPLE_RATES,
+)
 
 # Load environment variables
 load_dotenv()
 
-class Settings(BaseSettings):
-    SPOTIFY_CLIENT_ID: str
-    SPOTIFY_CLIENT_SECRET: str
-    SPOTIFY_REDIRECT_URI: HttpUrl
-    SPOTIFY_SCOPES: str = "user-library-read"
-    SPOTIFY_AUTH_URL: str = "https://accounts.spotify.com/authorize"
-    SPOTIFY_TOKEN_URL: str = "https://accounts.spotify.com/api/token"
-    SPOTIFY_API_URL: str = "https://api.spotify.com/v1"
-    HTTP_TIMEOUT: int = 30
-    HTTP_RETRIES: int = 3
-    HTTP_BACKOFF_FACTOR: float = 0.5
-    CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://127.0.0.1:3000"]
-    CORS_METHODS: List[str] = ["GET", "POST", "OPTIONS"]
-    CORS_HEADERS: List[str] = ["*"]
-    LOG_LEVEL: str = "INFO"
-    SECRET_KEY: str = secrets.token_urlsafe(32)
-    SESSION_COOKIE_NAME: str = "session"
-    SESSION_MAX_AGE: int = 1800  # 30 minutes
-    RATE_LIMIT: str = "5/minute"
-
-    @validator('LOG_LEVEL')
-    def validate_log_level(cls, v):
-        valid_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
-        if v.upper() not in valid_levels:
-            raise ValueError(f'LOG_LEVEL must be one of {valid_levels}')
-        return v.upper()
-
-    class Config:
-        env_file = ".env"
-        case_sensitive = True
-
-@lru_cache()
-def get_settings() -> Settings:
-    return Settings()
-
 class TokenResponse(BaseModel):
     """Response model for Spotify OAuth token exchange"""
     access_token: str
     token_type: str
     expires_in: int
-    refresh_token: str
+    # Spotify only sends a new refresh token on refresh when it rotates it
+    refresh_token: Optional[str] = None
     scope: str
 
     class Config:
@@ -118,6 +58,7 @@ class TokenResponse(BaseModel):
             }
         }
 
+# Wire format of /saved-tracks items; library.py stores tracks pre-encoded in it
 class Track(BaseModel):
     """Spotify track model"""
     name: str
@@ -160,30 +101,55 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
         return response
 
+def upstream_unavailable(error: CircuitOpen) -> HTTPException:
+    """503 for a call refused by an open circuit, with when to try again."""
+    return HTTPException(
+        status_code=503,
+        detail="Spotify is unavailable, try again later",
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
 class AuthService:
-    def __init__(self, settings: Settings = Depends(get_settings)):
-        self.settings = settings
-        self.client = httpx.AsyncClient(timeout=settings.HTTP_TIMEOUT)
-        self.serializer = URLSafeTimedSerializer(settings.SECRET_KEY)
-        self.limiter = Limiter(key_func=get_remote_address)
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+        self.sessions = SessionStore(
+            build_backend(self.settings.SESSION_BACKEND, self.settings.SESSION_DB_PATH, self.settings.SESSION_REDIS_URL),
+            SessionData,
+            max_age=self.settings.SESSION_MAX_AGE,
+            cache_size=self.settings.SESSION_CACHE_SIZE,
+            cache_ttl=self.settings.SESSION_CACHE_TTL,
+        )
+        self.limiter = BudgetedLimiter(
+            key_func=get_remote_address,
+            storage_uri=self.settings.RATE_LIMIT_STORAGE_URI,
+            strategy=self.settings.RATE_LIMIT_STRATEGY,
+            budget_us=self.settings.RATE_LIMIT_BUDGET_US,
+            over_budget=self.settings.RATE_LIMIT_OVER_BUDGET,
+        )
+        # user_id -> newest tokens for that user's sessions; see get_valid_token
+        self._tokens: Dict[str, Dict[str, Any]] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.refreshes_coalesced = 0
+        self.refreshes_skipped = 0  # another worker had already refreshed
+        self.proactive_refreshes = 0
         logger.info("AuthService initialized")
 
-    def create_session(self, user_id: str, access_token: str, refresh_token: str) -> str:
-        expires_at = int(time.time()) + self.settings.SESSION_MAX_AGE
+    async def create_session(self, user_id: str, access_token: str, refresh_token: str,
+                             expires_in: Optional[int] = None) -> str:
+        """Store a new session and return its opaque ID for the cookie."""
+        expires_at = int(time.time()) + (expires_in or self.settings.SESSION_MAX_AGE)
         session_data = SessionData(
             user_id=user_id,
             access_token=access_token,
             refresh_token=refresh_token,
             expires_at=expires_at
         )
-        return self.serializer.dumps(session_data.dict())
+        return await self.sessions.create(session_data)
 
-    def get_session(self, session_token: str) -> Optional[SessionData]:
-        try:
-            data = self.serializer.loads(session_token, max_age=self.settings.SESSION_MAX_AGE)
-            return SessionData(**data)
-        except:
-            return None
+    async def get_session(self, session_id: str) -> Optional[SessionData]:
+        return await self.sessions.get(session_id)
 
     async def get_authorization_url(self, state: Optional[str] = None) -> str:
         logger.info("Generating authorization URL", extra={"state": state})
@@ -210,42 +176,25 @@ class AuthService:
             "client_secret": self.settings.SPOTIFY_CLIENT_SECRET,
         }
 
-        for attempt in range(self.settings.HTTP_RETRIES):
-            try:
-                logger.debug(f"Token exchange attempt {attempt + 1}")
-                response = await self.client.post(
-                    self.settings.SPOTIFY_TOKEN_URL,
-                    data=data,
-                    headers={"Content-Type": "application/x-www-form-urlencoded"},
-                )
-                response.raise_for_status()
-                token_data = response.json()
-                logger.info("Token exchange successful")
-                return TokenResponse(**token_data)
-            except httpx.HTTPStatusError as e:
-                logger.error("Token exchange failed", extra={
-                    "status_code": e.response.status_code,
-                    "response": e.response.text,
-                    "attempt": attempt + 1
-                })
-                if e.response.status_code == 400:
-                    raise HTTPException(status_code=400, detail="Invalid authorization code")
-                if attempt == self.settings.HTTP_RETRIES - 1:
-                    raise HTTPException(status_code=500, detail="Failed to exchange code for token")
-                await self._backoff(attempt)
-            except httpx.RequestError as e:
-                logger.error("Network error during token exchange", extra={
-                    "error": str(e),
-                    "attempt": attempt + 1
-                })
-                if attempt == self.settings.HTTP_RETRIES - 1:
-                    raise HTTPException(status_code=500, detail="Network error during token exchange")
-                await self._backoff(attempt)
-
-    async def _backoff(self, attempt: int):
-        delay = self.settings.HTTP_BACKOFF_FACTOR * (2 ** attempt)
-        logger.warning(f"Request failed, retrying in {delay} seconds...")
-        await asyncio.sleep(delay)
+        # Retries, Retry-After and the circuit breaker live in spotify_client
+        try:
+            response = await spotify_client.token_request(data)
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            logger.error("Token exchange failed", extra={
+                "status_code": e.response.status_code,
+                "response": e.response.text,
+            })
+            if e.response.status_code == 400:
+                raise HTTPException(status_code=400, detail="Invalid authorization code")
+            raise HTTPException(status_code=500, detail="Failed to exchange code for token")
+        except CircuitOpen as e:
+            raise upstream_unavailable(e)
+        except httpx.RequestError as e:
+            logger.error("Network error during token exchange", extra={"error": str(e)})
+            raise HTTPException(status_code=500, detail="Network error during token exchange")
+        logger.info("Token exchange successful")
+        return TokenResponse(**response.json())
 
     async def refresh_token(self, refresh_token: str) -> TokenResponse:
         logger.info("Refreshing access token")
@@ -256,56 +205,147 @@ class AuthService:
             "client_secret": self.settings.SPOTIFY_CLIENT_SECRET,
         }
 
-        for attempt in range(self.settings.HTTP_RETRIES):
-            try:
-                logger.debug(f"Token refresh attempt {attempt + 1}")
-                response = await self.client.post(
-                    self.settings.SPOTIFY_TOKEN_URL,
-                    data=data,
-                    headers={"Content-Type": "application/x-www-form-urlencoded"},
-                )
-                response.raise_for_status()
-                token_data = response.json()
-                logger.info("Token refresh successful")
-                return TokenResponse(**token_data)
-            except httpx.HTTPStatusError as e:
-                logger.error("Token refresh failed", extra={
-                    "status_code": e.response.status_code,
-                    "response": e.response.text,
-                    "attempt": attempt + 1
-                })
-                if e.response.status_code == 400:
-                    raise HTTPException(status_code=401, detail="Invalid refresh token")
-                if attempt == self.settings.HTTP_RETRIES - 1:
-                    raise HTTPException(status_code=500, detail="Failed to refresh token")
-                await self._backoff(attempt)
-            except httpx.RequestError as e:
-                logger.error("Network error during token refresh", extra={
-                    "error": str(e),
-                    "attempt": attempt + 1
-                })
-                if attempt == self.settings.HTTP_RETRIES - 1:
-                    raise HTTPException(status_code=500, detail="Network error during token refresh")
-                await self._backoff(attempt)
-
-    async def get_valid_token(self, session: SessionData) -> str:
-        if time.time() > session.expires_at:
+        try:
+            response = await spotify_client.token_request(data)
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            logger.error("Token refresh failed", extra={
+                "status_code": e.response.status_code,
+                "response": e.response.text,
+            })
+            if e.response.status_code == 400:
+                raise HTTPException(status_code=401, detail="Invalid refresh token")
+            raise HTTPException(status_code=500, detail="Failed to refresh token")
+        except CircuitOpen as e:
+            raise upstream_unavailable(e)
+        except httpx.RequestError as e:
+            logger.error("Network error during token refresh", extra={"error": str(e)})
+            raise HTTPException(status_code=500, detail="Network error during token refresh")
+        logger.info("Token refresh successful")
+        return TokenResponse(**response.json())
+
+    def _remember(self, session_id: str, session: SessionData) -> Dict[str, Any]:
+        entry = self._tokens.get(session.user_id)
+        if entry is None:
+            entry = {
+                "access_token": session.access_token,
+                "refresh_token": session.refresh_token,
+                "expires_at": session.expires_at,
+                "session_ids": set(),
+            }
+            self._tokens[session.user_id] = entry
+        elif session.access_token != entry["access_token"] and session.expires_at > entry["expires_at"]:
+            # A newer login (or a refresh by another worker). The earlier
+            # sessions stay attached so later refreshes still update them.
+            entry["access_token"] = session.access_token
+            entry["refresh_token"] = session.refresh_token
+            entry["expires_at"] = session.expires_at
+        entry["session_ids"].add(session_id)
+        entry["last_used"] = time.time()
+        return entry
+
+    async def _refresh_user(self, user_id: str) -> Dict[str, Any]:
+        """Refresh a user's tokens; concurrent callers share one refresh."""
+        task = self._refreshing.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._do_refresh(user_id))
+            self._refreshing[user_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(user_id, None))
+        else:
+            self.refreshes_coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _do_refresh(self, user_id: str) -> Dict[str, Any]:
+        entry = self._tokens[user_id]
+        # With a shared SESSION_BACKEND another worker may have refreshed already
+        if await self._adopt_stored_tokens(entry):
+            self.refreshes_skipped += 1
+            return entry
+        try:
+            with timed("token_refresh"):
+                new_tokens = await self.refresh_token(entry["refresh_token"])
+        except HTTPException as e:
+            # Lost a race: another worker's refresh rotated our refresh token
+            if e.status_code == 401 and await self._adopt_stored_tokens(entry):
+                self.refreshes_skipped += 1
+                return entry
+            raise
+        entry["access_token"] = new_tokens.access_token
+        entry["expires_at"] = int(time.time()) + new_tokens.expires_in
+        if new_tokens.refresh_token:
+            entry["refresh_token"] = new_tokens.refresh_token
+        self.refreshes += 1
+
+        # Write the new tokens to the user's sessions so every worker sees them
+        for session_id in list(entry["session_ids"]):
+            session = await self.sessions.get(session_id)
+            if session is None:
+                entry["session_ids"].discard(session_id)
+                continue
+            session = session.copy(update={
+                "access_token": entry["access_token"],
+                "refresh_token": entry["refresh_token"],
+                "expires_at": entry["expires_at"],
+            })
+            await self.sessions.save(session_id, session)
+        return entry
+
+    async def _adopt_stored_tokens(self, entry: Dict[str, Any]) -> bool:
+        """Take newer tokens from the shared store; True if no refresh is due."""
+        for session_id in list(entry["session_ids"]):
+            session = await self.sessions.reload(session_id)
+            if session is None:
+                entry["session_ids"].discard(session_id)
+            elif session.expires_at > entry["expires_at"]:
+                entry["access_token"] = session.access_token
+                entry["refresh_token"] = session.refresh_token
+                entry["expires_at"] = session.expires_at
+        return entry["expires_at"] - time.time() > self.settings.TOKEN_REFRESH_MARGIN
+
+    async def get_valid_token(self, session_id: str, session: SessionData) -> str:
+        entry = self._remember(session_id, session)
+        if time.time() > entry["expires_at"]:
             logger.info("Access token expired, refreshing")
-            new_tokens = await self.refresh_token(session.refresh_token)
-            
-            # Update session with new tokens
-            session.access_token = new_tokens.access_token
-            session.expires_at = int(time.time()) + new_tokens.expires_in
-            
-            # Update session cookie
-            session_token = self.create_session(
-                session.user_id,
-                session.access_token,
-                session.refresh_token
-            )
-            
-            return session.access_token, session_token
-        return session.access_token, None
+            entry = await self._refresh_user(session.user_id)
+        return entry["access_token"]
+
+    # ========== Proactive Refresh ==========
+    def start_refresh_scheduler(self):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop_refresh_scheduler(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            # Jittered so workers sharing a session backend don't sweep in lockstep
+            await asyncio.sleep(self.settings.TOKEN_REFRESH_CHECK_INTERVAL * random.uniform(0.75, 1.25))
+            await self.refresh_expiring()
+
+    async def refresh_expiring(self):
+        """Refresh active users' tokens that expire within TOKEN_REFRESH_MARGIN."""
+        now = time.time()
+        due = []
+        for user_id, entry in list(self._tokens.items()):
+            if now - entry["last_used"] > self.settings.SESSION_MAX_AGE:
+                # Session idle past its lifetime; stop keeping it warm
+                del self._tokens[user_id]
+            elif entry["expires_at"] - now <= self.settings.TOKEN_REFRESH_MARGIN:
+                due.append(user_id)
+
+        results = await asyncio.gather(*(self._refresh_user(user_id) for user_id in due), return_exceptions=True)
+        for user_id, result in zip(due, results):
+            if isinstance(result, Exception):
+                logger.error("Background token refresh failed", extra={"user_id": user_id, "error": str(result)})
+            else:
+                self.proactive_refreshes += 1
 
 app = FastAPI(
     title="Mood Music API",
@@ -315,8 +355,14 @@ app = FastAPI(
     redoc_url="/api/redoc",
     openapi_url="/api/openapi.json"
 )
-settings = get_settings()
 auth_service = AuthService()
+library_sync = LibrarySync(
+    LibraryStore(settings.LIBRARY_DB_PATH),
+    concurrency=settings.LIBRARY_SYNC_CONCURRENCY,
+    refresh_interval=settings.LIBRARY_REFRESH_INTERVAL,
+)
+# Rendered /saved-tracks pages and their ETags, keyed by library generation
+saved_tracks_cache = ResultCache(settings.SAVED_TRACKS_CACHE_SIZE, settings.SAVED_TRACKS_CACHE_TTL)
 
 # Add middleware
 app.add_middleware(
@@ -336,10 +382,63 @@ app.add_middleware(
     allow_headers=settings.CORS_HEADERS,
 )
 
+# Outermost, so the timings include the other middleware
+app.add_middleware(MetricsMiddleware, app_name="auth", server_timing=settings.SERVER_TIMING)
+
 # Add rate limiting
 app.state.limiter = auth_service.limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+register_cache("sessions", auth_service.sessions.cache)
+register_cache("saved_tracks", saved_tracks_cache)
+
+
+def _collect_rate_limiter():
+    stats = auth_service.limiter.stats()
+    yield "rate_limit_storage_operations_total", "counter", "Rate-limit storage operations", [
+        ({}, stats["operations"])]
+    yield "rate_limit_storage_over_budget_total", "counter", "Storage operations slower than RATE_LIMIT_BUDGET_US", [
+        ({}, stats["over_budget"])]
+    yield "rate_limit_storage_busy_total", "counter", "Checks given up at the budget; see RATE_LIMIT_OVER_BUDGET", [
+        ({}, stats["busy"])]
+    yield "rate_limit_storage_mean_seconds", "gauge", "Mean rate-limit storage operation time", [
+        ({}, stats["mean_us"] / 1e6)]
+
+
+REGISTRY.collectors.append(_collect_rate_limiter)
+
+@app.on_event("startup")
+async def start_token_refresh():
+    auth_service.start_refresh_scheduler()
+
+@app.on_event("shutdown")
+async def stop_token_refresh():
+    await auth_service.stop_refresh_scheduler()
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await spotify_client.close_client()
+
+@app.on_event("shutdown")
+async def close_library_store():
+    for task in list(_library_syncs):
+        task.cancel()
+    library_sync.store.close()
+
+# Login-time library syncs, referenced until done so they can't be collected
+_library_syncs = set()
+
+def start_library_sync(user_id: str, access_token: str) -> asyncio.Task:
+    task = asyncio.create_task(library_sync.sync(user_id, access_token))
+    _library_syncs.add(task)
+    task.add_done_callback(lambda done: _library_sync_done(done, user_id))
+    return task
+
+def _library_sync_done(task: asyncio.Task, user_id: str):
+    _library_syncs.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Library sync failed", extra={"user_id": user_id, "error": str(task.exception())})
+
 @app.get(
     "/spotify-login",
     summary="Initiate Spotify OAuth flow",
@@ -349,7 +448,7 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
         429: {"description": "Rate limit exceeded"}
     }
 )
-@auth_service.limiter.limit(settings.RATE_LIMIT)
+@auth_service.limiter.limit(settings.RATE_LIMIT_LOGIN)
 async def spotify_login(request: Request):
     state = secrets.token_urlsafe(16)
     auth_url = await auth_service.get_authorization_url(state)
@@ -375,7 +474,7 @@ async def spotify_login(request: Request):
         500: {"description": "Internal server error"}
     }
 )
-@auth_service.limiter.limit(settings.RATE_LIMIT)
+@auth_service.limiter.limit(settings.RATE_LIMIT_CALLBACK)
 async def callback(request: Request, code: str, state: Optional[str] = None):
     try:
         stored_state = request.cookies.get("state")
@@ -388,16 +487,20 @@ async def callback(request: Request, code: str, state: Optional[str] = None):
         user_info = await get_user_info(tokens.access_token)
         
         # Create session
-        session_token = auth_service.create_session(
+        session_id = await auth_service.create_session(
             user_info["id"],
             tokens.access_token,
-            tokens.refresh_token
+            tokens.refresh_token,
+            tokens.expires_in
         )
+
+        # Warm the local library so the first /saved-tracks is served locally
+        start_library_sync(user_info["id"], tokens.access_token)
         
         response = RedirectResponse(url="/")
         response.set_cookie(
             settings.SESSION_COOKIE_NAME,
-            session_token,
+            session_id,
             max_age=settings.SESSION_MAX_AGE,
             httponly=True,
             secure=True,
@@ -411,13 +514,9 @@ async def callback(request: Request, code: str, state: Optional[str] = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 async def get_user_info(access_token: str) -> Dict[str, Any]:
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{settings.SPOTIFY_API_URL}/me",
-            headers={"Authorization": f"Bearer {access_token}"}
-        )
-        response.raise_for_status()
-        return response.json()
+    response = await spotify_client.api_get("/me", access_token)
+    response.raise_for_status()
+    return response.json()
 
 class HealthResponse(BaseModel):
     status: str
@@ -441,10 +540,27 @@ async def health_check():
         timestamp=int(time.time())
     )
 
+@app.get(
+    "/metrics",
+    summary="Prometheus metrics",
+    description="Request counts, latency histograms per stage, upstream status codes and cache hit ratios",
+    response_class=Response,
+)
+async def metrics():
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/"x" matches "x"."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
 @app.get(
     "/saved-tracks",
     summary="Get user's saved tracks",
-    description="Retrieves the user's saved tracks from Spotify",
+    description="Retrieves the user's saved tracks from the local copy of their Spotify library, syncing it first when it is stale",
     responses={
         200: {
             "description": "List of saved tracks",
@@ -462,50 +578,54 @@ async def health_check():
                 }
             }
         },
+        304: {"description": "Page unchanged since the ETag sent in If-None-Match"},
         401: {"description": "Not authenticated or invalid session"},
         429: {"description": "Rate limit exceeded"},
         500: {"description": "Internal server error"}
     }
 )
-@auth_service.limiter.limit(settings.RATE_LIMIT)
+@auth_service.limiter.limit(settings.RATE_LIMIT_SAVED_TRACKS)
 async def get_saved_tracks(
     request: Request,
-    response: Response,
     query_params: TrackQueryParams = Depends()
 ):
     try:
-        session_token = request.cookies.get(settings.SESSION_COOKIE_NAME)
-        if not session_token:
+        session_id = request.cookies.get(settings.SESSION_COOKIE_NAME)
+        if not session_id:
             raise HTTPException(status_code=401, detail="Not authenticated")
 
-        session = auth_service.get_session(session_token)
+        session = await auth_service.get_session(session_id)
         if not session:
             raise HTTPException(status_code=401, detail="Invalid session")
 
-        access_token, new_session_token = await auth_service.get_valid_token(session)
-        
-        if new_session_token:
-            response.set_cookie(
-                settings.SESSION_COOKIE_NAME,
-                new_session_token,
-                max_age=settings.SESSION_MAX_AGE,
-                httponly=True,
-                secure=True,
-                samesite="lax"
-            )
-
-        headers = {"Authorization": f"Bearer {access_token}"}
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.SPOTIFY_API_URL}/me/tracks",
-                params={"limit": query_params.limit, "offset": query_params.offset},
-                headers=headers
+        async def render_page():
+            access_token = await auth_service.get_valid_token(session_id, session)
+            await library_sync.ensure_fresh(session.user_id, access_token)
+            # Tracks are stored pre-encoded in the Track wire format
+            body = await asyncio.to_thread(
+                library_sync.store.page_json, session.user_id, query_params.limit, query_params.offset
             )
-            response.raise_for_status()
-            data = response.json()
-            return {"tracks": [Track(**item["track"]) for item in data["items"]]}
+            page = f'"{hashlib.sha256(body).hexdigest()[:32]}"', body
+            # The sync above may have started a new generation; file the page there too
+            saved_tracks_cache.set(page_key(), page)
+            return page
+
+        def page_key() -> str:
+            # A sync that changes the library moves the user to a new generation
+            generation = library_sync.generation(session.user_id)
+            return f"{session.user_id}:{generation}:{query_params.limit}:{query_params.offset}"
+
+        etag, body = await saved_tracks_cache.get_or_compute(page_key(), render_page)
+
+        # Per-user data: the browser may keep it but must revalidate each time
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Cookie"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
     except HTTPException as e:
         raise e
+    except CircuitOpen as e:
+        raise upstream_unavailable(e)
     except Exception as e:
         logger.error("Error fetching saved tracks", extra={"error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,178 @@
+"""Dynamic micro-batching for model calls.
+
+Concurrent callers submit single items; a background task collects them for
+at most ``max_wait_ms`` or until ``max_batch`` items are queued, runs them
+through one batched call and resolves each caller's future with its own
+result.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv
+
+# ========== Configuration ==========
+load_dotenv()
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+_BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, float("inf"))
+
+
+class MicroBatcher:
+    """Gathers concurrent submissions into batched calls of ``run_batch``.
+
+    ``run_batch`` receives a list of items and must return a sequence of
+    results in the same order. Up to ``max_in_flight`` batches run at once so
+    that every inference worker can be kept busy.
+
+    ``size_of`` weighs items that carry several inputs (e.g. all faces of one
+    image); a batch closes once the total weight reaches ``max_batch``. An
+    item is never split, so one larger than ``max_batch`` forms its own
+    batch.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], Awaitable[Sequence[Any]]],
+                 max_batch: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS,
+                 max_in_flight: int = 1, size_of: Callable[[Any], int] = lambda item: 1):
+        self.run_batch = run_batch
+        self.size_of = size_of
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_in_flight = max(1, max_in_flight)
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._dispatches = set()
+        # Metrics
+        self.batches = 0
+        self.entries = 0
+        self.items = 0
+        self.batch_size_histogram = {bucket: 0 for bucket in _BATCH_SIZE_BUCKETS}
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def start(self):
+        if self._collector is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._collector = asyncio.create_task(self._collect())
+
+    def stop(self):
+        if self._collector is None:
+            return
+        self._collector.cancel()
+        for task in list(self._dispatches):
+            task.cancel()
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+        self._collector = None
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result from the next batch."""
+        if self._collector is None:
+            raise RuntimeError("Batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        carry = None
+        batch = []
+        try:
+            while True:
+                batch = [carry if carry is not None else await self._queue.get()]
+                carry = None
+                size = self.size_of(batch[0][0])
+                deadline = loop.time() + self.max_wait
+                while size < self.max_batch:
+                    if not self._queue.empty():
+                        entry = self._queue.get_nowait()
+                    else:
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            entry = await asyncio.wait_for(self._queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+                    entry_size = self.size_of(entry[0])
+                    if size + entry_size > self.max_batch:
+                        # Doesn't fit; it opens the next batch instead
+                        carry = entry
+                        break
+                    batch.append(entry)
+                    size += entry_size
+
+                await self._slots.acquire()
+                task = asyncio.create_task(self._dispatch(batch))
+                batch = []
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+        finally:
+            # Stopped: entries held here (and not in the queue) would never be answered
+            for _, future, _ in batch + ([carry] if carry is not None else []):
+                if not future.done():
+                    future.cancel()
+
+    async def _dispatch(self, batch):
+        try:
+            # Callers that gave up while queued don't need a forward pass
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                return
+            self._record(batch)
+            try:
+                results = await self.run_batch([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            # Cancelled by stop() mid-batch
+            for _, future, _ in batch:
+                if not future.done():
+                    future.cancel()
+            self._slots.release()
+
+    def _record(self, batch):
+        now = time.perf_counter()
+        size = sum(self.size_of(item) for item, _, _ in batch)
+        self.batches += 1
+        self.entries += len(batch)
+        self.items += size
+        for bucket in _BATCH_SIZE_BUCKETS:
+            if size <= bucket:
+                self.batch_size_histogram[bucket] += 1
+                break
+        for _, _, enqueued_at in batch:
+            wait = now - enqueued_at
+            self.queue_wait_total += wait
+            self.queue_wait_max = max(self.queue_wait_max, wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "entries": self.entries,
+            "items": self.items,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_size_histogram": {
+                f"le_{bucket}": count for bucket, count in self.batch_size_histogram.items()
+            },
+            "queue_wait_ms": {
+                "mean": 1000 * self.queue_wait_total / self.entries if self.entries else 0.0,
+                "max": 1000 * self.queue_wait_max,
+            },
+        }
@@ -0,0 +1,11 @@
+"""Benchmarks and load tests. Run from backend/:
+
+    python -m benchmarks.micro                       # in-process micro-benchmarks
+    python -m benchmarks.load --duration 30          # both apps against local stubs
+    python -m benchmarks.compare old.json new.json   # flag regressions
+
+``micro`` and ``load`` write JSON results (``--output``, default under
+``bench_results/``) tagged with the git commit, so two runs can be compared.
+``stubs`` can also run on its own as a fake Spotify + Gemini server for
+manual testing: ``python -m benchmarks.stubs --port 9100 --latency-ms 80``.
+"""
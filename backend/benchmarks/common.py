@@ -0,0 +1,90 @@
+"""Timing summaries and the JSON result format shared by the suites."""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+RESULTS_DIR = "bench_results"
+
+
+def percentile(sorted_samples: Sequence[float], q: float) -> float:
+    """Linear-interpolated percentile of an already sorted sequence."""
+    if not sorted_samples:
+        return 0.0
+    position = (len(sorted_samples) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * (position - lower)
+
+
+def summarize(samples: Sequence[float], wall_seconds: Optional[float] = None) -> Dict[str, float]:
+    """Latency percentiles in milliseconds plus throughput.
+
+    ``samples`` are per-operation seconds. Throughput is operations over
+    ``wall_seconds`` when given (concurrent runs), else over their sum.
+    """
+    ordered = sorted(samples)
+    total = wall_seconds if wall_seconds is not None else sum(ordered)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 4) if ordered else 0.0,
+        "p50_ms": round(1000 * percentile(ordered, 50), 4),
+        "p95_ms": round(1000 * percentile(ordered, 95), 4),
+        "p99_ms": round(1000 * percentile(ordered, 99), 4),
+        "max_ms": round(1000 * ordered[-1], 4) if ordered else 0.0,
+        "throughput_per_s": round(len(ordered) / total, 2) if total else 0.0,
+    }
+
+
+def time_calls(fn: Callable[[], Any], iterations: int, warmup: int = 3) -> List[float]:
+    """Per-call seconds of ``fn`` over ``iterations`` calls, after a warm-up."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(suite: str, results: Dict[str, Any], config: Dict[str, Any],
+                  output: Optional[str] = None) -> str:
+    """Write one run as JSON and return its path."""
+    commit = git_commit()
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{suite}-{commit or 'nogit'}-{int(time.time())}.json")
+    document = {
+        "suite": suite,
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    return output
+
+
+def print_table(results: Dict[str, Dict[str, Any]]):
+    columns = ("count", "p50_ms", "p95_ms", "p99_ms", "throughput_per_s")
+    width = max((len(name) for name in results), default=10) + 2
+    print("".ljust(width) + "".join(c.rjust(18) for c in columns))
+    for name, summary in results.items():
+        print(name.ljust(width) + "".join(str(summary.get(c, "")).rjust(18) for c in columns))
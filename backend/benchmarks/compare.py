@@ -0,0 +1,62 @@
+"""Compare two result files from the same suite and flag regressions.
+
+    python -m benchmarks.compare bench_results/micro-abc123-*.json bench_results/micro-def456-*.json
+
+A benchmark regresses when a latency percentile grows, or throughput
+drops, by more than ``--threshold`` (default 10%). Exits 1 if any did, so
+it can gate CI. p99 is left out by default (``--metrics`` adds it): for
+microsecond-scale operations it mostly measures scheduler noise.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Tuple
+
+# Metric name -> True when larger is better
+METRICS = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "throughput_per_s": True}
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float,
+            metrics: List[str]) -> List[Tuple[str, str, float, float, float, bool]]:
+    rows = []
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        for metric in metrics:
+            higher_is_better = METRICS[metric]
+            before = old["results"][name].get(metric)
+            after = new["results"][name].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regressed = change < -threshold if higher_is_better else change > threshold
+            rows.append((name, metric, before, after, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+    parser.add_argument("--metrics", default="p50_ms,p95_ms,throughput_per_s", help=f"subset of {list(METRICS)}")
+    args = parser.parse_args()
+    metrics = [m.strip() for m in args.metrics.split(",") if m.strip()]
+    if set(metrics) - set(METRICS):
+        parser.error(f"unknown metrics {sorted(set(metrics) - set(METRICS))}")
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if old["suite"] != new["suite"]:
+        parser.error(f"suites differ: {old['suite']} vs {new['suite']}")
+
+    print(f"{old['suite']}: {old.get('commit')} -> {new.get('commit')}")
+    rows = compare(old, new, args.threshold, metrics)
+    for name, metric, before, after, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:32} {metric:18} {before:>12.3f} {after:>12.3f} {change:>+8.1%}{flag}")
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
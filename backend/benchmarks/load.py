@@ -0,0 +1,308 @@
+"""End-to-end load harness for main.py and auth.py.
+
+Starts the stub server (benchmarks/stubs.py) and both apps under uvicorn,
+each app pointed at the stubs, with databases and logs in a temporary
+directory. It then runs each scenario for ``--duration`` seconds with
+``--concurrency`` closed-loop clients:
+
+- ``analyze``: ``POST /analyze`` with synthetic face images (or
+  ``--images``). ``--image-count`` distinct images set the cache hit rate.
+- ``analyze-async``: ``POST /analyze?async=1`` then a long-poll on the job.
+- ``saved-tracks``: ``GET /saved-tracks`` pages, for ``--users`` users who
+  each logged in through ``/spotify-login`` and ``/callback`` first.
+- ``ai-recommend`` and ``ai-recommend-rerank``: ``POST /ai-recommend``
+  with varied moods, without and with the Gemini re-rank.
+
+Each scenario reports p50/p95/p99 latency, throughput and status counts,
+plus the stub's per-endpoint call counts, and the run is written as JSON.
+Pass ``--main-url``/``--auth-url`` to load apps that are already running.
+"""
+import argparse
+import asyncio
+import http.cookies
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.common import print_table, summarize, write_results
+from benchmarks.synthetic import load_images
+
+SCENARIOS = ("analyze", "analyze-async", "saved-tracks", "ai-recommend", "ai-recommend-rerank")
+MOODS = (
+    "happy and energetic", "calm rainy evening", "sad but hopeful", "angry workout",
+    "relaxed sunday morning", "nostalgic road trip", "focused late night coding", "excited party",
+)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ========== Processes ==========
+def start_server(module: str, port: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def start_stubs(args, port: int, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stubs", "--port", str(port),
+         "--latency-ms", str(args.stub_latency_ms), "--jitter-ms", str(args.stub_jitter_ms),
+         "--llm-latency-ms", str(args.llm_latency_ms), "--error-rate", str(args.stub_error_rate),
+         "--error-status", str(args.stub_error_status), "--library-size", str(args.library_size)],
+        cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_until_up(url: str, timeout: float, process: Optional[subprocess.Popen] = None):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=5) as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"{url}: server exited with {process.returncode}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} not ready after {timeout:.0f}s")
+
+
+def app_env(args, stub_url: str, workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "SPOTIFY_CLIENT_ID": "bench",
+        "SPOTIFY_CLIENT_SECRET": "bench",
+        "SPOTIFY_REDIRECT_URI": "http://127.0.0.1:3000/callback",
+        "SPOTIFY_API_URL": f"{stub_url}/v1",
+        "SPOTIFY_TOKEN_URL": f"{stub_url}/api/token",
+        "LLM_API_URL": f"{stub_url}/llm/generateText",
+        "LLM_STREAM_URL": f"{stub_url}/llm/streamGenerateContent",
+        "GOOGLE_API_KEY": "bench",
+        "LIBRARY_DB_PATH": os.path.join(workdir, "library.db"),
+        "SESSION_DB_PATH": os.path.join(workdir, "sessions.db"),
+        "LOG_FILE": os.path.join(workdir, "auth.log"),
+        "LOG_LEVEL": "WARNING",
+        # The harness measures the service, not the per-IP limits
+        "RATE_LIMIT_LOGIN": "1000000/minute",
+        "RATE_LIMIT_CALLBACK": "1000000/minute",
+        "RATE_LIMIT_SAVED_TRACKS": "1000000/minute",
+    })
+    return env
+
+
+# ========== Load ==========
+async def run_load(request: Callable[[httpx.AsyncClient, int], Awaitable[Tuple[float, str]]],
+                   concurrency: int, duration: float, warmup: float) -> Dict[str, Any]:
+    """Closed-loop clients calling ``request`` until ``duration`` elapses."""
+    samples: List[float] = []
+    statuses: Counter = Counter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def client_loop(worker: int, until: float, record: bool):
+            i = worker
+            while time.monotonic() < until:
+                try:
+                    seconds, status = await request(client, i)
+                except httpx.HTTPError as e:
+                    seconds, status = 0.0, type(e).__name__
+                if record:
+                    samples.append(seconds)
+                    statuses[status] += 1
+                i += concurrency
+
+        if warmup:
+            until = time.monotonic() + warmup
+            await asyncio.gather(*(client_loop(w, until, False) for w in range(concurrency)))
+        started = time.monotonic()
+        await asyncio.gather(*(client_loop(w, started + duration, True) for w in range(concurrency)))
+        wall = time.monotonic() - started
+
+    result = summarize(samples, wall)
+    result["statuses"] = dict(statuses)
+    ok = statuses.get("200", 0) + statuses.get("202", 0)
+    result["error_rate"] = round(1 - ok / len(samples), 4) if samples else 0.0
+    return result
+
+
+def _status(response: httpx.Response) -> str:
+    # main.py reports some failures as 200 with an "error" field
+    if response.status_code == 200 and response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        if isinstance(body, dict) and "error" in body:
+            return "200-error"
+    return str(response.status_code)
+
+
+def _cookie(response: httpx.Response, name: str) -> str:
+    # The apps set Secure cookies, which an http:// client jar won't send back
+    for header in response.headers.get_list("set-cookie"):
+        cookie = http.cookies.SimpleCookie(header)
+        if name in cookie:
+            return cookie[name].value
+    raise RuntimeError(f"{response.request.url.path} did not set {name}")
+
+
+async def login(auth_url: str, user: int) -> str:
+    """Session cookie for user-N through the real OAuth routes."""
+    async with httpx.AsyncClient(base_url=auth_url, timeout=30) as client:
+        response = await client.get("/spotify-login")
+        state = _cookie(response, "state")
+        response = await client.get(
+            "/callback", params={"code": f"user-{user}", "state": state}, headers={"Cookie": f"state={state}"}
+        )
+        return _cookie(response, "session")
+
+
+def scenario(name: str, args, main_url: str, auth_url: str, images: List[bytes],
+             sessions: List[str]) -> Callable[[httpx.AsyncClient, int], Awaitable[Tuple[float, str]]]:
+    async def analyze(client: httpx.AsyncClient, i: int):
+        started = time.perf_counter()
+        response = await client.post(f"{main_url}/analyze", files={"file": ("face.jpg", images[i % len(images)])})
+        return time.perf_counter() - started, _status(response)
+
+    async def analyze_async(client: httpx.AsyncClient, i: int):
+        started = time.perf_counter()
+        response = await client.post(
+            f"{main_url}/analyze", params={"async": 1}, files={"file": ("face.jpg", images[i % len(images)])}
+        )
+        if response.status_code != 202:
+            return time.perf_counter() - started, _status(response)
+        job_url = f"{main_url}/analyze/jobs/{response.json()['job_id']}"
+        while True:
+            job = (await client.get(job_url, params={"wait": 30})).json()
+            if job["status"] in ("done", "failed"):
+                return time.perf_counter() - started, "200" if job["status"] == "done" else "job-failed"
+
+    async def saved_tracks(client: httpx.AsyncClient, i: int):
+        pages = max(1, args.library_size // 50)
+        started = time.perf_counter()
+        response = await client.get(
+            f"{auth_url}/saved-tracks",
+            params={"limit": 50, "offset": 50 * random.randrange(pages)},
+            headers={"Cookie": f"session={sessions[i % len(sessions)]}"},
+        )
+        return time.perf_counter() - started, _status(response)
+
+    def ai_recommend(rerank: bool):
+        async def request(client: httpx.AsyncClient, i: int):
+            started = time.perf_counter()
+            response = await client.post(f"{main_url}/ai-recommend", json={
+                "mood_description": MOODS[i % len(MOODS)], "limit": 5, "rerank": rerank,
+            })
+            return time.perf_counter() - started, _status(response)
+        return request
+
+    return {
+        "analyze": analyze,
+        "analyze-async": analyze_async,
+        "saved-tracks": saved_tracks,
+        "ai-recommend": ai_recommend(False),
+        "ai-recommend-rerank": ai_recommend(True),
+    }[name]
+
+
+async def run(args) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"unknown scenarios {sorted(unknown)}; choose from {SCENARIOS}")
+
+    workdir = tempfile.mkdtemp(prefix="mood-bench-")
+    processes: List[subprocess.Popen] = []
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    main_url, auth_url = args.main_url, args.auth_url
+    try:
+        processes.append(start_stubs(args, args.stub_port, os.path.join(workdir, "stubs.log")))
+        await wait_until_up(f"{stub_url}/stub/stats", 30, processes[-1])
+        if main_url is None or auth_url is None:
+            env = app_env(args, stub_url, workdir)
+            if main_url is None:
+                main_url = f"http://127.0.0.1:{args.main_port}"
+                processes.append(start_server("main:app", args.main_port, env, os.path.join(workdir, "main.log")))
+                # /ready answers 200 once every inference worker is warm
+                await wait_until_up(f"{main_url}/ready", args.startup_timeout, processes[-1])
+            if auth_url is None:
+                auth_url = f"http://127.0.0.1:{args.auth_port}"
+                processes.append(start_server("auth:app", args.auth_port, env, os.path.join(workdir, "auth.log.out")))
+                await wait_until_up(f"{auth_url}/health", args.startup_timeout, processes[-1])
+
+        images = load_images(args.images, args.image_count) if any(s.startswith("analyze") for s in scenarios) else []
+        sessions: List[str] = []
+
+        results: Dict[str, Any] = {}
+        async with httpx.AsyncClient() as client:
+            for name in scenarios:
+                before = Counter((await client.get(f"{stub_url}/stub/stats")).json())
+                if name == "saved-tracks" and not sessions:
+                    # Counted with this scenario, as is the library sync each login starts
+                    sessions = await asyncio.gather(*(login(auth_url, user) for user in range(args.users)))
+                print(f"{name}: {args.concurrency} clients for {args.duration:.0f}s")
+                results[name] = await run_load(
+                    scenario(name, args, main_url, auth_url, images, sessions),
+                    args.concurrency, args.duration, args.warmup,
+                )
+                after = Counter((await client.get(f"{stub_url}/stub/stats")).json())
+                results[name]["upstream_calls"] = dict(after - before)
+        return results, {"workdir": workdir}
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test main.py and auth.py against local Spotify/Gemini stubs")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=20, help="logged-in users for saved-tracks")
+    parser.add_argument("--library-size", type=int, default=500, help="saved tracks per stub user")
+    parser.add_argument("--images", help="directory of photos to use instead of synthetic faces")
+    parser.add_argument("--image-count", type=int, default=256, help="distinct images; fewer means more cache hits")
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--stub-error-status", type=int, default=503)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--main-port", type=int, default=9101)
+    parser.add_argument("--auth-port", type=int, default=9102)
+    parser.add_argument("--main-url", help="use a running main.py instead of starting one")
+    parser.add_argument("--auth-url", help="use a running auth.py instead of starting one")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--keep-workdir", action="store_true", help="keep the databases and server logs")
+    parser.add_argument("--output", help="results JSON path (default: bench_results/load-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    results, info = asyncio.run(run(args))
+    print_table(results)
+    for name, result in results.items():
+        print(f"{name}: statuses {result['statuses']}, upstream {result['upstream_calls']}")
+    if args.keep_workdir:
+        print("server logs and databases:", info["workdir"])
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    print("results:", write_results("load", results, config, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""In-process micro-benchmarks for the hot paths of both apps.
+
+Groups (``--only`` takes a comma-separated subset):
+
+- ``decode``: ``imagecodec.decode_image`` at DECODE_LONG_EDGE.
+- ``detect``: ``inference.detect_faces`` with the configured
+  DETECTION_STRATEGY on decoded images.
+- ``classify``: ``inference.classify_faces`` on one face and on a full
+  BATCH_MAX_SIZE batch (also reported per face).
+- ``session``: signing and verifying the SessionMiddleware cookie, and an
+  opaque session ID lookup through ``SessionStore``.
+- ``tracks``: a 50-track ``/saved-tracks`` body from the stored pre-encoded
+  tracks, against building ``Track`` models and ``jsonable_encoder``.
+- ``emotions``: building an emotion result, and encoding an 8-face
+  ``all_faces`` response with ``jsonable_encoder`` against orjson.
+
+``detect`` and ``classify`` load the models in this process (the same
+``_init_worker`` the inference pool runs), so they need DeepFace or the
+configured ONNX engine installed.
+"""
+import argparse
+import asyncio
+import os
+import queue
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from benchmarks.common import print_table, summarize, time_calls, write_results
+from benchmarks.synthetic import load_images, saved_tracks_page
+
+GROUPS = ("decode", "detect", "classify", "session", "tracks", "emotions")
+
+
+def _cycle(items: List[Any]) -> Callable[[], Any]:
+    position = [0]
+
+    def next_item():
+        item = items[position[0] % len(items)]
+        position[0] += 1
+        return item
+    return next_item
+
+
+def bench_decode(images: List[bytes], iterations: int) -> Dict[str, Any]:
+    from imagecodec import decode_image
+    from inference import DECODE_LONG_EDGE
+
+    next_image = _cycle(images)
+    return {"decode": summarize(time_calls(lambda: decode_image(next_image(), DECODE_LONG_EDGE), iterations))}
+
+
+def _load_models(threads: int):
+    import inference
+    from batching import BATCH_MAX_SIZE
+
+    if inference._engine is None:
+        ready = queue.SimpleQueue()
+        inference._init_worker(threads, BATCH_MAX_SIZE, ready)
+        print("models loaded:", ready.get())
+    return inference
+
+
+def bench_detect(images: List[bytes], iterations: int, threads: int) -> Dict[str, Any]:
+    from imagecodec import decode_image
+
+    inference = _load_models(threads)
+    decoded = [decode_image(image, inference.DECODE_LONG_EDGE) for image in images]
+    next_image = _cycle(decoded)
+    found = sum(1 for img in decoded if inference.detect_faces(img, max_faces=1)[0])
+    result = summarize(time_calls(lambda: inference.detect_faces(next_image(), max_faces=1), iterations))
+    result["face_found_ratio"] = round(found / len(decoded), 3)
+    return {"detect": result}
+
+
+def bench_classify(images: List[bytes], iterations: int, threads: int) -> Dict[str, Any]:
+    from batching import BATCH_MAX_SIZE
+    from imagecodec import decode_image
+
+    inference = _load_models(threads)
+    faces = np.stack([
+        inference.detect_face(decode_image(image, inference.DECODE_LONG_EDGE))[0]
+        for image in images[:BATCH_MAX_SIZE]
+    ])
+    while len(faces) < BATCH_MAX_SIZE:
+        faces = np.concatenate([faces, faces])[:BATCH_MAX_SIZE]
+
+    single = summarize(time_calls(lambda: inference.classify_faces(faces[:1]), iterations))
+    batch_samples = time_calls(lambda: inference.classify_faces(faces), max(1, iterations // 4))
+    batch = summarize(batch_samples)
+    per_face = summarize([s / BATCH_MAX_SIZE for s in batch_samples])
+    return {
+        "classify_1": single,
+        f"classify_{BATCH_MAX_SIZE}": batch,
+        f"classify_{BATCH_MAX_SIZE}_per_face": per_face,
+    }
+
+
+def bench_session(iterations: int) -> Dict[str, Any]:
+    import base64
+    import json
+
+    from starlette.middleware.sessions import SessionMiddleware
+
+    from auth import SessionData, settings
+    from sessions import MemorySessionBackend, SessionStore
+
+    middleware = SessionMiddleware(None, secret_key=settings.SECRET_KEY)
+    payload = {"state": "x" * 22, "redirect": "/recommendations"}
+    cookie = middleware.signer.sign(base64.b64encode(json.dumps(payload).encode()))
+
+    def sign():
+        middleware.signer.sign(base64.b64encode(json.dumps(payload).encode()))
+
+    def verify():
+        json.loads(base64.b64decode(middleware.signer.unsign(cookie, max_age=middleware.max_age)))
+
+    async def lookups() -> List[float]:
+        store = SessionStore(MemorySessionBackend(), SessionData, settings.SESSION_MAX_AGE,
+                             settings.SESSION_CACHE_SIZE, settings.SESSION_CACHE_TTL)
+        session_id = await store.create(SessionData(
+            user_id="user-0", access_token="access-user-0", refresh_token="refresh-user-0",
+            expires_at=int(time.time()) + 3600,
+        ))
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            await store.get(session_id)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    return {
+        "session_sign": summarize(time_calls(sign, iterations)),
+        "session_verify": summarize(time_calls(verify, iterations)),
+        "session_lookup": summarize(asyncio.run(lookups())),
+    }
+
+
+def bench_tracks(iterations: int) -> Dict[str, Any]:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from auth import Track
+    from library import LibraryStore
+
+    store = LibraryStore(":memory:")
+    store.save("user-0", saved_tracks_page(0, 50, 50)["items"], 50, replace=True)
+    page = store.page("user-0", 50, 0)
+
+    def pydantic_render():
+        # /saved-tracks before tracks were stored pre-encoded
+        return JSONResponse(content=jsonable_encoder({"tracks": [Track(**t) for t in page]})).body
+
+    def stored_render():
+        return store.page_json("user-0", 50, 0)
+
+    if pydantic_render() != stored_render():
+        raise AssertionError("page_json differs from the Track response")
+    legacy = summarize(time_calls(pydantic_render, iterations))
+    current = summarize(time_calls(stored_render, iterations))
+    legacy["bytes"] = current["bytes"] = len(stored_render())
+    return {"track_pydantic_page50": legacy, "track_serialize_page50": current}
+
+
+def bench_emotions(iterations: int) -> Dict[str, Any]:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+
+    from inference import group_emotion_result, to_emotion_result
+
+    rng = np.random.default_rng(0)
+    results = [to_emotion_result(p) for p in rng.dirichlet(np.ones(7), 8)]
+    boxes = [(i * 60, 40, 50 + i, 50 + i) for i in range(8)]
+    group = group_emotion_result(results, boxes)
+    return {
+        "emotions_result": summarize(time_calls(lambda: to_emotion_result(rng.dirichlet(np.ones(7))), iterations)),
+        "emotions_jsonable_8faces": summarize(time_calls(lambda: JSONResponse(jsonable_encoder(group)).body, iterations)),
+        "emotions_orjson_8faces": summarize(time_calls(lambda: ORJSONResponse(group).body, iterations)),
+    }
+
+
+def inference_settings() -> Dict[str, Any]:
+    import batching
+    import inference
+
+    return {
+        "EMOTION_ENGINE": inference.EMOTION_ENGINE,
+        "DETECTION_STRATEGY": inference.DETECTION_STRATEGY,
+        "DETECTION_LONG_EDGE": inference.DETECTION_LONG_EDGE,
+        "DECODE_LONG_EDGE": inference.DECODE_LONG_EDGE,
+        "BATCH_MAX_SIZE": batching.BATCH_MAX_SIZE,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for decode, inference, sessions and tracks")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"comma-separated subset of {GROUPS}")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--images", help="directory of photos to use instead of synthetic faces")
+    parser.add_argument("--image-count", type=int, default=16)
+    parser.add_argument("--width", type=int, default=1280, help="synthetic image size")
+    parser.add_argument("--height", type=int, default=960)
+    parser.add_argument("--threads", type=int, default=1, help="model threads, like INFERENCE_THREADS_PER_WORKER")
+    parser.add_argument("--output", help="results JSON path (default: bench_results/micro-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    # auth.py needs OAuth settings and opens its log and library files on import
+    os.environ.setdefault("SPOTIFY_CLIENT_ID", "bench")
+    os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "bench")
+    os.environ.setdefault("SPOTIFY_REDIRECT_URI", "http://127.0.0.1:3000/callback")
+    os.environ.setdefault("LOG_FILE", "")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LIBRARY_DB_PATH", ":memory:")
+
+    groups = [g.strip() for g in args.only.split(",") if g.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups {sorted(unknown)}; choose from {GROUPS}")
+
+    images = load_images(args.images, args.image_count, width=args.width, height=args.height)
+    results: Dict[str, Any] = {}
+    for group in groups:
+        started = time.perf_counter()
+        if group == "decode":
+            results.update(bench_decode(images, args.iterations))
+        elif group == "detect":
+            results.update(bench_detect(images, args.iterations, args.threads))
+        elif group == "classify":
+            results.update(bench_classify(images, args.iterations, args.threads))
+        elif group == "session":
+            results.update(bench_session(args.iterations))
+        elif group == "tracks":
+            results.update(bench_tracks(args.iterations))
+        elif group == "emotions":
+            results.update(bench_emotions(args.iterations))
+        print(f"{group}: {time.perf_counter() - started:.1f}s")
+
+    print_table(results)
+    config = {
+        "groups": groups,
+        "iterations": args.iterations,
+        "images": args.images or "synthetic",
+        "image_count": args.image_count,
+        "image_size": None if args.images else [args.width, args.height],
+        "threads": args.threads,
+        "inference": inference_settings(),
+    }
+    print("results:", write_results("micro", results, config, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Local stand-ins for the Spotify Web API, Spotify accounts and Gemini.
+
+One FastAPI app serves:
+
+- ``POST /api/token``: both grants. The code ``user-N`` yields the access
+  token ``access-user-N``, which ``/v1/me`` maps back to user ``user-N``.
+- ``GET /v1/me``, ``GET /v1/me/tracks`` (a synthetic library of
+  ``--library-size`` tracks) and ``GET /v1/audio-features``.
+- ``POST /llm/generateText`` and ``POST /llm/streamGenerateContent``
+  (SSE, ``--llm-chunks`` chunks spread over the LLM latency).
+
+Every request waits ``--latency-ms`` (plus up to ``--jitter-ms``; LLM calls
+use ``--llm-latency-ms`` instead) and fails with ``--error-status`` at
+``--error-rate``, with a ``Retry-After`` header on 429/503. ``/stub/stats``
+returns per-path call counts.
+
+Point the apps at it with SPOTIFY_API_URL=http://HOST:PORT/v1,
+SPOTIFY_TOKEN_URL=http://HOST:PORT/api/token,
+LLM_API_URL=http://HOST:PORT/llm/generateText and
+LLM_STREAM_URL=http://HOST:PORT/llm/streamGenerateContent.
+"""
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.synthetic import audio_features, saved_tracks_page
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    llm_latency_ms: float = 500.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    retry_after: int = 1
+    library_size: int = 500
+    llm_chunks: int = 8
+
+
+def create_stub_app(config: StubConfig) -> FastAPI:
+    app = FastAPI()
+    calls = Counter()
+
+    def latency(path: str) -> float:
+        base = config.llm_latency_ms if path.startswith("/llm/") else config.latency_ms
+        return (base + random.uniform(0, config.jitter_ms)) / 1000
+
+    @app.middleware("http")
+    async def inject_faults(request: Request, call_next):
+        path = request.url.path
+        if path.startswith("/stub/"):
+            return await call_next(request)
+        calls[path] += 1
+        # Streaming spreads its latency over the chunks instead
+        if not path.endswith("streamGenerateContent"):
+            await asyncio.sleep(latency(path))
+        if config.error_rate and random.random() < config.error_rate:
+            calls[f"{path} {config.error_status}"] += 1
+            headers = {"Retry-After": str(config.retry_after)} if config.error_status in (429, 503) else {}
+            return JSONResponse(status_code=config.error_status, content={"error": "injected"}, headers=headers)
+        return await call_next(request)
+
+    # ========== Spotify accounts ==========
+    @app.post("/api/token")
+    async def token(request: Request):
+        form = await request.form()
+        if form.get("grant_type") == "refresh_token":
+            user = str(form.get("refresh_token", "refresh-user-0"))[len("refresh-"):]
+        else:
+            user = str(form.get("code", "user-0"))
+        return {
+            "access_token": f"access-{user}",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "refresh_token": f"refresh-{user}",
+            "scope": "user-library-read user-read-email",
+        }
+
+    # ========== Spotify Web API ==========
+    def user_of(request: Request) -> str:
+        token = request.headers.get("authorization", "").removeprefix("Bearer ")
+        return token.removeprefix("access-") or "user-0"
+
+    @app.get("/v1/me")
+    async def me(request: Request):
+        user = user_of(request)
+        return {"id": user, "display_name": user, "email": f"{user}@example.com"}
+
+    @app.get("/v1/me/tracks")
+    async def saved_tracks(limit: int = 20, offset: int = 0):
+        return saved_tracks_page(offset, min(limit, 50), config.library_size)
+
+    @app.get("/v1/audio-features")
+    async def features(ids: str = ""):
+        return {"audio_features": [audio_features(track_id) for track_id in ids.split(",") if track_id]}
+
+    # ========== Gemini ==========
+    @app.post("/llm/generateText")
+    async def generate_text(request: Request):
+        prompt = (await request.json()).get("prompt", {}).get("text", "")
+        return {"candidates": [{"output": _completion(prompt)}]}
+
+    @app.post("/llm/streamGenerateContent")
+    async def stream_generate(request: Request):
+        body = await request.json()
+        prompt = body.get("contents", [{}])[0].get("parts", [{}])[0].get("text", "")
+        text = _completion(prompt)
+        step = max(1, len(text) // config.llm_chunks + 1)
+        delay = latency(request.url.path) / config.llm_chunks
+
+        async def events():
+            for start in range(0, len(text), step):
+                await asyncio.sleep(delay)
+                chunk = {"candidates": [{"content": {"parts": [{"text": text[start:start + step]}]}}]}
+                yield f"data: {json.dumps(chunk)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stub/stats")
+    async def stats():
+        return dict(calls)
+
+    return app
+
+
+def _completion(prompt: str) -> str:
+    """The first songs listed in a re-rank prompt, as a numbered list."""
+    songs = [line.split(". ", 1)[-1] for line in prompt.splitlines() if line[:1].isdigit()]
+    return "\n".join(f"{i}. {song}" for i, song in enumerate(songs[:5] or ["Synthetic Song 0"], start=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=500.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--library-size", type=int, default=500)
+    parser.add_argument("--llm-chunks", type=int, default=8)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = StubConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        llm_latency_ms=args.llm_latency_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        library_size=args.library_size,
+        llm_chunks=args.llm_chunks,
+    )
+    uvicorn.run(create_stub_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Deterministic synthetic inputs: face-like JPEGs and Spotify objects.
+
+The faces are drawn shapes (skin-toned oval, eyes, brows, nose, mouth) on a
+noisy background, varied by seed. OpenCV's frontal-face cascade finds most
+of them, so detection and classification run on a real crop rather than the
+whole-image fallback. Use ``--images`` on the suites to benchmark real
+photos instead.
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+SAVED_AT_BASE = 1717200000  # 2024-06-01, the newest synthetic save
+
+
+def face_image(seed: int = 0, width: int = 640, height: int = 480, faces: int = 1,
+               quality: int = 90) -> bytes:
+    """A JPEG with ``faces`` drawn faces, different for every seed."""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(40, 200, (height, width, 3), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (0, 0), 8)
+    slot = width // faces
+    for i in range(faces):
+        size = int(min(slot, height) * rng.uniform(0.45, 0.6))
+        cx = int(slot * i + slot / 2 + rng.uniform(-0.05, 0.05) * slot)
+        cy = int(height / 2 + rng.uniform(-0.05, 0.05) * height)
+        _draw_face(img, cx, cy, size, rng)
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("JPEG encoding failed")
+    return encoded.tobytes()
+
+
+def _draw_face(img: np.ndarray, cx: int, cy: int, size: int, rng: np.random.Generator):
+    skin = tuple(int(v) for v in rng.integers([90, 130, 170], [140, 180, 230]))
+    dark = (40, 40, 50)
+    w, h = int(size * 0.38), int(size * 0.5)
+    cv2.ellipse(img, (cx, cy), (w, h), 0, 0, 360, skin, -1)
+    eye_y = cy - int(h * 0.2)
+    for side in (-1, 1):
+        ex = cx + side * int(w * 0.4)
+        cv2.ellipse(img, (ex, eye_y), (int(w * 0.2), int(h * 0.08)), 0, 0, 360, (235, 235, 235), -1)
+        cv2.circle(img, (ex, eye_y), int(h * 0.06), dark, -1)
+        cv2.line(img, (ex - int(w * 0.22), eye_y - int(h * 0.18)),
+                 (ex + int(w * 0.22), eye_y - int(h * 0.2)), dark, max(2, size // 40))
+    nose = np.array([[cx, eye_y + int(h * 0.1)], [cx - int(w * 0.12), cy + int(h * 0.2)],
+                     [cx + int(w * 0.12), cy + int(h * 0.2)]])
+    cv2.fillConvexPoly(img, nose, tuple(int(c * 0.8) for c in skin))
+    # Mouth curvature varies so the classifier sees different expressions
+    smile = int(rng.uniform(-0.1, 0.15) * h)
+    mouth_y = cy + int(h * 0.45)
+    cv2.ellipse(img, (cx, mouth_y - smile), (int(w * 0.4), max(2, abs(smile))),
+                0, 0 if smile >= 0 else 180, 180 if smile >= 0 else 360, (60, 50, 150), max(3, size // 30))
+
+
+def load_images(image_dir: Optional[str], count: int, faces: int = 1,
+                width: int = 640, height: int = 480) -> List[bytes]:
+    """JPEG/PNG bytes from image_dir (cycled to count), or synthetic faces."""
+    if not image_dir:
+        return [face_image(seed, width, height, faces) for seed in range(count)]
+    paths = sorted(
+        os.path.join(image_dir, name) for name in os.listdir(image_dir)
+        if name.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    if not paths:
+        raise ValueError(f"No .jpg/.jpeg/.png files in {image_dir}")
+    images = []
+    for path in paths[:count]:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return [images[i % len(images)] for i in range(count)]
+
+
+def fake_track(i: int) -> Dict[str, Any]:
+    """A full Spotify track object, shaped like /me/tracks items[].track."""
+    track_id = f"track{i:07d}"
+    artist_id = f"artist{i % 997:05d}"
+    album_id = f"album{i % 4999:06d}"
+    return {
+        "id": track_id,
+        "name": f"Synthetic Song {i}",
+        "uri": f"spotify:track:{track_id}",
+        "href": f"https://api.spotify.com/v1/tracks/{track_id}",
+        "duration_ms": 150000 + (i * 7919) % 150000,
+        "explicit": i % 11 == 0,
+        "popularity": (i * 31) % 100,
+        "preview_url": None,
+        "track_number": 1 + i % 12,
+        "disc_number": 1,
+        "is_local": False,
+        "external_ids": {"isrc": f"XX{i:010d}"},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+        "artists": [{
+            "id": artist_id,
+            "name": f"Synthetic Artist {i % 997}",
+            "type": "artist",
+            "uri": f"spotify:artist:{artist_id}",
+            "external_urls": {"spotify": f"https://open.spotify.com/artist/{artist_id}"},
+        }],
+        "album": {
+            "id": album_id,
+            "name": f"Synthetic Album {i % 4999}",
+            "album_type": "album",
+            "release_date": f"{1970 + i % 55}-01-01",
+            "total_tracks": 12,
+            "images": [
+                {"url": f"https://i.scdn.co/image/{album_id}{size}", "height": size, "width": size}
+                for size in (640, 300, 64)
+            ],
+            "external_urls": {"spotify": f"https://open.spotify.com/album/{album_id}"},
+        },
+        "available_markets": ["US", "GB", "DE", "FR", "SE", "JP", "BR"],
+    }
+
+
+def saved_tracks_page(offset: int, limit: int, total: int) -> Dict[str, Any]:
+    """A /me/tracks page; the newest save is index 0."""
+    items = [
+        {"added_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(SAVED_AT_BASE - 3600 * i)),
+         "track": fake_track(i)}
+        for i in range(offset, min(offset + limit, total))
+    ]
+    return {"items": items, "total": total, "limit": limit, "offset": offset}
+
+
+def audio_features(track_id: str) -> Dict[str, Any]:
+    seed = int(track_id[-7:]) if track_id[-7:].isdigit() else len(track_id)
+    return {
+        "id": track_id,
+        "valence": (seed * 37 % 100) / 100,
+        "energy": (seed * 53 % 100) / 100,
+        "tempo": 60 + seed * 17 % 140,
+    }
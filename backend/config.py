@@ -0,0 +1,92 @@
+"""Application settings, read from the environment and .env."""
+import secrets
+from functools import lru_cache
+from typing import Dict, List
+
+from pydantic import HttpUrl, validator
+
+try:
+    from pydantic_settings import BaseSettings
+except ImportError:  # pydantic v1
+    from pydantic import BaseSettings
+
+
+class HTTPSettings(BaseSettings):
+    """Outbound HTTP settings (spotify_client.py), shared by both apps.
+
+    Needs no OAuth secrets, so the inference service can run without them.
+    """
+    SPOTIFY_TOKEN_URL: str = "https://accounts.spotify.com/api/token"
+    SPOTIFY_API_URL: str = "https://api.spotify.com/v1"
+    HTTP_TIMEOUT: int = 30
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP2: bool = True
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_RETRIES: int = 3  # tries per upstream call, the first included
+    HTTP_BACKOFF_FACTOR: float = 0.5
+    HTTP_DEADLINE: float = 20.0  # seconds for one call, retries and waits included
+    HTTP_HEDGE_READS: bool = True  # resend Web API GETs slower than their p95
+    HTTP_HEDGE_MIN_DELAY: float = 0.05
+    CIRCUIT_FAILURE_THRESHOLD: int = 5  # failures in a row that open a host's circuit
+    CIRCUIT_RESET_TIMEOUT: float = 30.0  # seconds before a probe is let through
+
+    class Config:
+        env_file = ".env"
+        case_sensitive = True
+        extra = "ignore"  # the same .env also holds the auth service's settings
+
+
+class Settings(HTTPSettings):
+    SPOTIFY_CLIENT_ID: str
+    SPOTIFY_CLIENT_SECRET: str
+    SPOTIFY_REDIRECT_URI: HttpUrl
+    SPOTIFY_SCOPES: str = "user-library-read"
+    SPOTIFY_AUTH_URL: str = "https://accounts.spotify.com/authorize"
+    CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://127.0.0.1:3000"]
+    CORS_METHODS: List[str] = ["GET", "POST", "OPTIONS"]
+    CORS_HEADERS: List[str] = ["*"]
+    LOG_LEVEL: str = "INFO"
+    LOG_FILE: str = "auth.log"
+    # Share of records kept per message template, for high-volume events
+    LOG_SAMPLE_RATES: Dict[str, float] = {}
+    SERVER_TIMING: bool = False  # return per-stage timings in a Server-Timing header
+    SECRET_KEY: str = secrets.token_urlsafe(32)
+    SESSION_COOKIE_NAME: str = "session"
+    SESSION_MAX_AGE: int = 1800  # 30 minutes
+    SESSION_BACKEND: str = "memory"  # memory | sqlite | redis
+    SESSION_DB_PATH: str = "sessions.db"
+    SESSION_REDIS_URL: str = "redis://localhost:6379/0"
+    SESSION_CACHE_SIZE: int = 1024
+    SESSION_CACHE_TTL: float = 5.0  # seconds a worker may serve a cached session
+    TOKEN_REFRESH_MARGIN: int = 300  # refresh this many seconds before expiry
+    TOKEN_REFRESH_CHECK_INTERVAL: int = 30
+    RATE_LIMIT_LOGIN: str = "5/minute"
+    RATE_LIMIT_CALLBACK: str = "10/minute"
+    RATE_LIMIT_SAVED_TRACKS: str = "60/minute"
+    # memory:// (per worker), sqlite:///path/ratelimit.db (one host) or redis://host:6379
+    RATE_LIMIT_STORAGE_URI: str = "memory://"
+    RATE_LIMIT_STRATEGY: str = "moving-window"
+    RATE_LIMIT_BUDGET_US: float = 500  # longest wait for the shared storage per check
+    RATE_LIMIT_OVER_BUDGET: str = "allow"  # allow | memory | enforce; see ratelimit.py
+    LIBRARY_DB_PATH: str = "library.db"
+    LIBRARY_SYNC_CONCURRENCY: int = 4
+    LIBRARY_REFRESH_INTERVAL: int = 300  # seconds before /saved-tracks re-syncs
+    SAVED_TRACKS_CACHE_SIZE: int = 4096  # cached /saved-tracks pages (user, limit, offset)
+    SAVED_TRACKS_CACHE_TTL: float = 30.0  # seconds
+
+    @validator('LOG_LEVEL')
+    def validate_log_level(cls, v):
+        valid_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+        if v.upper() not in valid_levels:
+            raise ValueError(f'LOG_LEVEL must be one of {valid_levels}')
+        return v.upper()
+
+@lru_cache()
+def get_settings() -> Settings:
+    return Settings()
+
+@lru_cache()
+def get_http_settings() -> HTTPSettings:
+    return HTTPSettings()
@@ -0,0 +1,88 @@
+"""Emotion classifier engines.
+
+Every engine takes a (N, 48, 48, 1) float32 batch of grayscale faces scaled
+to [0, 1] and returns (N, 7) class probabilities in EMOTION_LABELS order,
+so analysis results keep the same ``emotions`` contract whichever engine
+runs.
+
+- ``deepface``: DeepFace's Keras model on TensorFlow (default).
+- ``onnx``: the same model exported with ``export_onnx.py`` and run with
+  ONNX Runtime, which avoids importing TensorFlow in the worker.
+- ``onnx-int8``: the int8-quantized export.
+"""
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+# ========== Configuration ==========
+load_dotenv()
+EMOTION_ENGINE = os.getenv("EMOTION_ENGINE", "deepface")
+MODELS_DIR = os.getenv("MODELS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models"))
+EMOTION_ONNX_PATH = os.getenv("EMOTION_ONNX_PATH", os.path.join(MODELS_DIR, "emotion.onnx"))
+EMOTION_ONNX_INT8_PATH = os.getenv("EMOTION_ONNX_INT8_PATH", os.path.join(MODELS_DIR, "emotion.int8.onnx"))
+
+ENGINES = ("deepface", "onnx", "onnx-int8")
+
+
+def build_deepface_emotion_model():
+    """The Keras emotion model bundled with DeepFace."""
+    from deepface import DeepFace
+    # deepface >= 0.0.90 namespaces models by task
+    try:
+        model = DeepFace.build_model(model_name="Emotion", task="facial_attribute")
+    except TypeError:
+        model = DeepFace.build_model("Emotion")
+    # Newer deepface versions wrap the Keras model in a client object
+    return getattr(model, "model", model)
+
+
+class DeepFaceEmotionEngine:
+    name = "deepface"
+
+    def __init__(self, threads: int = 1):
+        self.model = build_deepface_emotion_model()
+
+    def predict(self, faces: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict(faces, verbose=0), dtype=np.float32)
+
+
+class OnnxEmotionEngine:
+    name = "onnx"
+
+    def __init__(self, model_path: str = EMOTION_ONNX_PATH, threads: int = 1):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("EMOTION_ENGINE=onnx requires the onnxruntime package") from e
+        if not os.path.exists(model_path):
+            raise RuntimeError(f"ONNX model not found at {model_path}; run export_onnx.py export")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, faces: np.ndarray) -> np.ndarray:
+        faces = np.ascontiguousarray(faces, dtype=np.float32)
+        return self.session.run(None, {self.input_name: faces})[0]
+
+
+class OnnxInt8EmotionEngine(OnnxEmotionEngine):
+    name = "onnx-int8"
+
+    def __init__(self, model_path: str = EMOTION_ONNX_INT8_PATH, threads: int = 1):
+        super().__init__(model_path, threads)
+
+
+def build_engine(name: str = EMOTION_ENGINE, threads: int = 1):
+    if name == "deepface":
+        return DeepFaceEmotionEngine(threads)
+    if name == "onnx":
+        return OnnxEmotionEngine(threads=threads)
+    if name == "onnx-int8":
+        return OnnxInt8EmotionEngine(threads=threads)
+    raise ValueError(f"EMOTION_ENGINE must be one of {ENGINES}, got {name!r}")
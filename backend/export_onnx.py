@@ -0,0 +1,166 @@
+"""Export DeepFace's emotion classifier to ONNX and check parity.
+
+Usage (from backend/):
+
+    python export_onnx.py export                 # models/emotion.onnx
+    python export_onnx.py quantize --calibration-dir photos/
+                                                 # models/emotion.int8.onnx
+    python export_onnx.py parity --engine onnx-int8 --images photos/
+
+Exporting needs tensorflow, deepface and tf2onnx; quantizing and serving
+only need onnxruntime. ``parity`` runs the same preprocessed face crops
+through the DeepFace engine and an ONNX engine. It reports the largest
+per-emotion difference (in percentage points) and the top-1 agreement, and
+exits non-zero when they are outside the given tolerances.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from engines import (
+    EMOTION_ONNX_INT8_PATH,
+    EMOTION_ONNX_PATH,
+    DeepFaceEmotionEngine,
+    build_deepface_emotion_model,
+    build_engine,
+)
+from imagecodec import decode_image
+from inference import FACE_SIZE, preprocess_face
+
+INPUT_NAME = "face"
+
+
+def load_faces(image_dir: Optional[str] = None, count: int = 64) -> np.ndarray:
+    """Preprocessed crops from image_dir, or random faces when none is given.
+
+    Images are expected to be roughly face-cropped already; they are only
+    resized and converted to the classifier input.
+    """
+    faces = []
+    if image_dir:
+        for name in sorted(os.listdir(image_dir)):
+            path = os.path.join(image_dir, name)
+            try:
+                with open(path, "rb") as f:
+                    faces.append(preprocess_face(decode_image(f.read())))
+            except (OSError, ValueError):
+                continue
+            if len(faces) >= count:
+                break
+    if not faces:
+        rng = np.random.default_rng(0)
+        for _ in range(count):
+            img = rng.integers(0, 255, (FACE_SIZE * 2, FACE_SIZE * 2, 3), dtype=np.uint8)
+            faces.append(preprocess_face(cv2.GaussianBlur(img, (5, 5), 0)))
+    return np.stack(faces).astype(np.float32)
+
+
+def export(out_path: str, opset: int):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = build_deepface_emotion_model()
+    spec = (tf.TensorSpec((None, FACE_SIZE, FACE_SIZE, 1), tf.float32, name=INPUT_NAME),)
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=out_path)
+    print(f"Exported {out_path}")
+
+
+def quantize(in_path: str, out_path: str, calibration_dir: Optional[str] = None):
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+
+    if calibration_dir is None:
+        # Weight-only quantization; convolutions stay float
+        quantize_dynamic(in_path, out_path, weight_type=QuantType.QInt8)
+    else:
+        class FaceReader(CalibrationDataReader):
+            def __init__(self, faces):
+                self._batches = iter([{INPUT_NAME: face[np.newaxis]} for face in faces])
+
+            def get_next(self):
+                return next(self._batches, None)
+
+        quantize_static(
+            in_path,
+            out_path,
+            FaceReader(load_faces(calibration_dir, count=256)),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QInt8,
+            weight_type=QuantType.QInt8,
+        )
+    print(f"Quantized {in_path} -> {out_path}")
+
+
+def parity(engine_name: str, image_dir: Optional[str], max_diff: float, min_agreement: float) -> bool:
+    faces = load_faces(image_dir)
+    reference = DeepFaceEmotionEngine()
+    candidate = build_engine(engine_name)
+
+    started = time.perf_counter()
+    expected = reference.predict(faces)
+    reference_s = time.perf_counter() - started
+    started = time.perf_counter()
+    actual = candidate.predict(faces)
+    candidate_s = time.perf_counter() - started
+
+    expected = 100 * expected / expected.sum(axis=1, keepdims=True)
+    actual = 100 * actual / actual.sum(axis=1, keepdims=True)
+    diff = float(np.abs(expected - actual).max())
+    agreement = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+    print(f"faces: {len(faces)}")
+    print(f"max |difference|: {diff:.3f} percentage points (tolerance {max_diff})")
+    print(f"top-1 agreement: {agreement:.1%} (minimum {min_agreement:.0%})")
+    print(f"batch latency: deepface {1000 * reference_s:.1f} ms, {engine_name} {1000 * candidate_s:.1f} ms")
+    return diff <= max_diff and agreement >= min_agreement
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = commands.add_parser("export")
+    export_cmd.add_argument("--out", default=EMOTION_ONNX_PATH)
+    export_cmd.add_argument("--opset", type=int, default=13)
+
+    quantize_cmd = commands.add_parser("quantize")
+    quantize_cmd.add_argument("--model", default=EMOTION_ONNX_PATH)
+    quantize_cmd.add_argument("--out", default=EMOTION_ONNX_INT8_PATH)
+    quantize_cmd.add_argument("--calibration-dir", help="face crops for static quantization")
+
+    parity_cmd = commands.add_parser("parity")
+    parity_cmd.add_argument("--engine", default="onnx", choices=["onnx", "onnx-int8"])
+    parity_cmd.add_argument("--images", help="directory of face crops (random faces if omitted)")
+    parity_cmd.add_argument("--max-diff", type=float, default=None,
+                            help="percentage points (default 0.5 for onnx, 5 for onnx-int8)")
+    parity_cmd.add_argument("--min-agreement", type=float, default=None,
+                            help="top-1 agreement (default 1.0 for onnx, 0.95 for onnx-int8)")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        export(args.out, args.opset)
+    elif args.command == "quantize":
+        quantize(args.model, args.out, args.calibration_dir)
+    else:
+        int8 = args.engine == "onnx-int8"
+        max_diff = args.max_diff if args.max_diff is not None else (5.0 if int8 else 0.5)
+        min_agreement = args.min_agreement if args.min_agreement is not None else (0.95 if int8 else 1.0)
+        if not parity(args.engine, args.images, max_diff, min_agreement):
+            print("Parity check FAILED")
+            return 1
+        print("Parity check passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
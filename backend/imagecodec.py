@@ -0,0 +1,134 @@
+"""Memory-bounded image decoding.
+
+Reads the pixel dimensions and EXIF orientation from the JPEG/PNG header
+without decoding, then lets OpenCV's reduced-resolution modes
+(IMREAD_REDUCED_COLOR_2/4/8) decode straight to a smaller image. For JPEGs
+the reduction happens in the DCT stage, so the full-resolution bitmap is
+never allocated.
+"""
+import struct
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_REDUCED_MODES = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def _exif_orientation(segment: bytes) -> int:
+    # segment is an APP1 payload: b"Exif\0\0" followed by a TIFF structure
+    if not segment.startswith(b"Exif\x00\x00"):
+        return 1
+    tiff = segment[6:]
+    if tiff[:2] == b"II":
+        endian = "<"
+    elif tiff[:2] == b"MM":
+        endian = ">"
+    else:
+        return 1
+    try:
+        (ifd_offset,) = struct.unpack_from(endian + "I", tiff, 4)
+        (entries,) = struct.unpack_from(endian + "H", tiff, ifd_offset)
+        for i in range(entries):
+            tag, _, _ = struct.unpack_from(endian + "HHI", tiff, ifd_offset + 2 + 12 * i)
+            if tag == 0x0112:
+                (value,) = struct.unpack_from(endian + "H", tiff, ifd_offset + 2 + 12 * i + 8)
+                return value if 1 <= value <= 8 else 1
+    except struct.error:
+        pass
+    return 1
+
+
+def _jpeg_header(data: bytes) -> Optional[Tuple[int, int, int]]:
+    orientation = None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, pos + 2)
+        if marker == 0xE1:
+            # APP1 also carries XMP; only the first Exif segment counts
+            segment = data[pos + 4:pos + 2 + length]
+            if orientation is None and segment.startswith(b"Exif\x00\x00"):
+                orientation = _exif_orientation(segment)
+        elif marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack_from(">HH", data, pos + 5)
+            return width, height, orientation or 1
+        elif marker == 0xDA:  # start of scan without a frame header
+            return None
+        pos += 2 + length
+    return None
+
+
+def read_header(data: bytes) -> Optional[Tuple[int, int, int]]:
+    """Return (width, height, exif_orientation) or None if unknown."""
+    if data[:2] == b"\xff\xd8":
+        return _jpeg_header(data)
+    if data[:8] == _PNG_SIGNATURE and len(data) >= 24:
+        width, height = struct.unpack_from(">II", data, 16)
+        return width, height, 1
+    return None
+
+
+def _apply_orientation(img: np.ndarray, orientation: int) -> np.ndarray:
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+
+def decode_with_scale(img_bytes: bytes, target_long_edge: int = 0) -> Tuple[np.ndarray, float]:
+    """Decode to BGR, reduced by 2/4/8 while the long edge stays >= target_long_edge.
+
+    EXIF orientation is applied explicitly so the result is upright no
+    matter which decode mode was used. The second value is the decoded size
+    relative to the original (1, 1/2, 1/4 or 1/8).
+    """
+    header = read_header(img_bytes)
+    scale = 1.0
+    if header is None:
+        # Unknown container: let OpenCV decode and orient it as usual
+        flags, orientation = cv2.IMREAD_COLOR, 1
+    else:
+        width, height, orientation = header
+        flags = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+        if target_long_edge > 0:
+            for factor, mode in _REDUCED_MODES:
+                if max(width, height) // factor >= target_long_edge:
+                    flags = mode | cv2.IMREAD_IGNORE_ORIENTATION
+                    scale = 1.0 / factor
+                    break
+    img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), flags)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return _apply_orientation(img, orientation), scale
+
+
+def decode_image(img_bytes: bytes, target_long_edge: int = 0) -> np.ndarray:
+    return decode_with_scale(img_bytes, target_long_edge)[0]
@@ -0,0 +1,449 @@
+"""Emotion inference in a pool of worker processes.
+
+Face detection and emotion classification are CPU bound and would block the
+uvicorn event loop for hundreds of milliseconds per image. Every worker
+process loads the detector and emotion engine (see engines.py) once in the
+pool initializer and keeps them warm for all the requests it serves; route
+handlers only await the result.
+
+Analysis is split in two stages: face detection runs per image, while the
+48x48 face crops from concurrent requests are classified together through a
+MicroBatcher (see batching.py) in a single forward pass.
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from batching import MicroBatcher
+from engines import EMOTION_ENGINE, build_engine
+from imagecodec import decode_image, decode_with_scale
+from metrics import observe_stage, timed
+
+# ========== Configuration ==========
+load_dotenv()
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+# Threads each worker may use for inference. One thread per worker keeps
+# workers from fighting over cores, so throughput scales with the pool size.
+INFERENCE_THREADS_PER_WORKER = int(os.getenv("INFERENCE_THREADS_PER_WORKER", "1"))
+# Ordered detector tiers, each optionally with its own minimum confidence
+# ("name:threshold"). A tier only runs when the previous ones found no face
+# above their threshold. "opencv" is a Haar cascade whose confidence is the
+# cascade level weight; any other name is a DeepFace detector backend.
+DETECTION_STRATEGY = os.getenv("DETECTION_STRATEGY", "opencv,retinaface")
+# Images are downscaled to this long edge before detection (0 disables)
+DETECTION_LONG_EDGE = int(os.getenv("DETECTION_LONG_EDGE", "640"))
+# Uploads are decoded at a reduced resolution whose long edge stays at or
+# above this (and below twice this); 0 decodes at full resolution.
+DECODE_LONG_EDGE = int(os.getenv("DECODE_LONG_EDGE", "1280"))
+# Upper bound on faces analyzed per image in all-faces mode (largest first)
+MAX_FACES = int(os.getenv("MAX_FACES", "20"))
+DEFAULT_MIN_CONFIDENCE = {"opencv": 4.0, "ssd": 0.8, "retinaface": 0.5}
+
+
+def _parse_tiers(spec: str) -> List[Tuple[str, float]]:
+    tiers = []
+    for part in spec.split(","):
+        name, _, threshold = part.strip().partition(":")
+        if name:
+            tiers.append((name, float(threshold) if threshold else DEFAULT_MIN_CONFIDENCE.get(name, 0.5)))
+    return tiers
+
+
+DETECTION_TIERS = _parse_tiers(DETECTION_STRATEGY)
+if not DETECTION_TIERS:
+    raise ValueError("DETECTION_STRATEGY must name at least one detector")
+
+# Changes whenever a setting that affects results changes, so cached
+# analyses from a different configuration are never served.
+MODEL_FINGERPRINT = (
+    f"emotion-v1:{EMOTION_ENGINE}:{DETECTION_STRATEGY}:{DETECTION_LONG_EDGE}:{DECODE_LONG_EDGE}"
+)
+
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+FACE_SIZE = 48
+
+# Set in each worker process by _init_worker
+DeepFace = None
+_engine = None
+_haar_cascade = None
+
+
+# ========== Worker Process ==========
+def _build_detectors():
+    global _haar_cascade
+    for name, _ in DETECTION_TIERS:
+        if name == "opencv":
+            _haar_cascade = cv2.CascadeClassifier(
+                os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+            )
+            continue
+        try:
+            DeepFace.build_model(model_name=name, task="face_detector")
+        except (TypeError, ValueError):
+            # Older deepface cannot build detectors directly; the warm-up
+            # inference below loads and caches it instead.
+            pass
+
+
+def _warm_up(batch_size: int):
+    dummy = np.random.default_rng(0).integers(0, 255, (224, 224, 3), dtype=np.uint8)
+    face, _ = detect_face(dummy)
+    # Every tier runs once so fallback detectors are warm as well
+    for name, _ in DETECTION_TIERS:
+        _run_detector(name, dummy)
+    # Trace the classifier for both the single-item and the full-batch shape
+    classify_faces(face[np.newaxis])
+    classify_faces(np.repeat(face[np.newaxis], batch_size, axis=0))
+
+
+def _init_worker(threads: int, batch_size: int, ready_queue):
+    global DeepFace, _engine
+    threads = str(threads)
+    os.environ["OMP_NUM_THREADS"] = threads
+    os.environ["TF_NUM_INTRAOP_THREADS"] = threads
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    cv2.setNumThreads(int(threads))
+
+    started = time.perf_counter()
+    # TensorFlow is only imported when a DeepFace model is actually used; an
+    # ONNX engine with the opencv detector keeps workers TensorFlow-free.
+    if EMOTION_ENGINE == "deepface" or any(name != "opencv" for name, _ in DETECTION_TIERS):
+        from deepface import DeepFace as _DeepFace
+        DeepFace = _DeepFace
+    imported = time.perf_counter()
+
+    _engine = build_engine(EMOTION_ENGINE, int(threads))
+    _build_detectors()
+    loaded = time.perf_counter()
+
+    _warm_up(batch_size)
+    warmed = time.perf_counter()
+
+    ready_queue.put({
+        "pid": os.getpid(),
+        "engine": _engine.name,
+        "import_s": round(imported - started, 3),
+        "model_load_s": round(loaded - imported, 3),
+        "warmup_s": round(warmed - loaded, 3),
+    })
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def preprocess_face(face: np.ndarray) -> np.ndarray:
+    """Convert a BGR face crop to the classifier's 48x48x1 input."""
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, (FACE_SIZE, FACE_SIZE), interpolation=cv2.INTER_AREA)
+    return (gray.astype(np.float32) / 255.0)[:, :, np.newaxis]
+
+
+def _downscale(img: np.ndarray, long_edge: int) -> Tuple[np.ndarray, float]:
+    height, width = img.shape[:2]
+    if long_edge <= 0 or max(height, width) <= long_edge:
+        return img, 1.0
+    scale = long_edge / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+
+def _detect_opencv(img: np.ndarray) -> List[Tuple[tuple, float]]:
+    gray = cv2.equalizeHist(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    boxes, _, weights = _haar_cascade.detectMultiScale3(
+        gray, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24), outputRejectLevels=True
+    )
+    return [(tuple(int(v) for v in box), float(weight))
+            for box, weight in zip(boxes, np.ravel(weights))]
+
+
+def _detect_deepface(img: np.ndarray, backend: str) -> List[Tuple[tuple, float]]:
+    faces = DeepFace.extract_faces(
+        img,
+        detector_backend=backend,
+        enforce_detection=False,
+        align=False
+    )
+    # With enforce_detection=False a miss comes back as the whole image
+    # with confidence 0, which every threshold rejects.
+    return [((int(f["facial_area"]["x"]), int(f["facial_area"]["y"]),
+              int(f["facial_area"]["w"]), int(f["facial_area"]["h"])),
+             float(f.get("confidence") or 0.0))
+            for f in faces]
+
+
+def _run_detector(name: str, img: np.ndarray) -> List[Tuple[tuple, float]]:
+    if name == "opencv":
+        return _detect_opencv(img)
+    return _detect_deepface(img, name)
+
+
+def _crop(img: np.ndarray, box: tuple) -> np.ndarray:
+    x, y, w, h = box
+    x, y = max(0, x), max(0, y)
+    crop = img[y:y + h, x:x + w]
+    return crop if crop.size else img
+
+
+def detect_faces(img: np.ndarray, max_faces: int = MAX_FACES) -> Tuple[List[tuple], dict]:
+    """Face boxes in image coordinates, largest first.
+
+    Detector tiers run on a downscaled copy, cheapest first, until one finds
+    faces above its confidence threshold; all faces come from that tier.
+    The second value records which tier matched and per-tier latency.
+    """
+    small, scale = _downscale(img, DETECTION_LONG_EDGE)
+    info = {"tier": None, "latency": {}, "box": None}
+    boxes = []
+    for name, min_confidence in DETECTION_TIERS:
+        started = time.perf_counter()
+        found = [box for box, confidence in _run_detector(name, small)
+                 if confidence >= min_confidence]
+        info["latency"][name] = time.perf_counter() - started
+        if found:
+            boxes = sorted(found, key=lambda b: b[2] * b[3], reverse=True)[:max_faces]
+            info["tier"] = name
+            break
+    # Map the boxes from the detection image back to full resolution
+    return [tuple(int(round(v / scale)) for v in box) for box in boxes], info
+
+
+def detect_face(img: np.ndarray) -> Tuple[np.ndarray, dict]:
+    """Find the most prominent face and return it preprocessed.
+
+    Like DeepFace.analyze with enforce_detection=False, the whole image is
+    used when no face is found. The detection info also carries the face
+    box in image coordinates.
+    """
+    boxes, info = detect_faces(img, max_faces=1)
+    if not boxes:
+        return preprocess_face(img), info
+    info["box"] = boxes[0]
+    return preprocess_face(_crop(img, boxes[0])), info
+
+
+def classify_faces(faces: np.ndarray) -> np.ndarray:
+    """Emotion probabilities for a (N, 48, 48, 1) batch in one forward pass."""
+    return _engine.predict(faces)
+
+
+def to_emotion_result(probabilities: np.ndarray) -> dict:
+    percentages = 100.0 * probabilities / max(float(probabilities.sum()), 1e-12)
+    emotions = dict(zip(EMOTION_LABELS, percentages.tolist()))
+    return {
+        "dominant_emotion": EMOTION_LABELS[int(np.argmax(percentages))],
+        "emotions": emotions
+    }
+
+
+def group_emotion_result(results: List[dict], boxes: List[tuple]) -> dict:
+    """Per-face results plus a face-area-weighted group emotion."""
+    areas = np.array([max(1, w * h) for _, _, w, h in boxes], dtype=np.float64)
+    vectors = np.array([[r["emotions"][label] for label in EMOTION_LABELS] for r in results])
+    group = (areas / areas.sum()) @ vectors
+    return {
+        "dominant_emotion": EMOTION_LABELS[int(np.argmax(group))],
+        "emotions": dict(zip(EMOTION_LABELS, group.tolist())),
+        "faces": [
+            {"box": list(box), "dominant_emotion": r["dominant_emotion"], "emotions": r["emotions"]}
+            for box, r in zip(boxes, results)
+        ],
+    }
+
+
+def analyze_emotion(img) -> dict:
+    """Detect and classify a single image in the current process."""
+    face, _ = detect_face(img)
+    return to_emotion_result(classify_faces(face[np.newaxis])[0])
+
+
+def _detect_image(img_bytes: bytes) -> Tuple[np.ndarray, dict]:
+    started = time.perf_counter()
+    img = decode_image(img_bytes, DECODE_LONG_EDGE)
+    decoded = time.perf_counter() - started
+    face, info = detect_face(img)
+    info["decode"] = decoded
+    return face, info
+
+
+def _detect_image_faces(img_bytes: bytes) -> Tuple[np.ndarray, List[tuple], dict]:
+    started = time.perf_counter()
+    img, scale = decode_with_scale(img_bytes, DECODE_LONG_EDGE)
+    decoded = time.perf_counter() - started
+    boxes, info = detect_faces(img)
+    info["decode"] = decoded
+    if not boxes:
+        boxes = [(0, 0, img.shape[1], img.shape[0])]
+    faces = np.stack([preprocess_face(_crop(img, box)) for box in boxes])
+    # Report boxes in the coordinates of the uploaded image
+    return faces, [tuple(int(round(v / scale)) for v in box) for box in boxes], info
+
+
+def _crop_image(img_bytes: bytes, box: tuple) -> np.ndarray:
+    return preprocess_face(_crop(decode_image(img_bytes, DECODE_LONG_EDGE), box))
+
+
+# ========== Pool ==========
+class InferencePool:
+    """Process pool that runs emotion analysis away from the event loop."""
+
+    def __init__(self, workers: int = INFERENCE_WORKERS,
+                 threads_per_worker: int = INFERENCE_THREADS_PER_WORKER):
+        self.workers = max(1, workers)
+        self.threads_per_worker = max(1, threads_per_worker)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._ready_queue = None
+        self._startup_futures = []
+        self.worker_timings: List[dict] = []
+        self.detections = 0
+        self.tier_stats: Dict[str, dict] = {
+            name: {"attempts": 0, "hits": 0, "latency_total": 0.0} for name, _ in DETECTION_TIERS
+        }
+        # Batch items are (k, 48, 48, 1) stacks of faces from one image. One
+        # batch per worker may be in flight, so detection of the next images
+        # overlaps with classification of the current batch.
+        self.batcher = MicroBatcher(self._classify, max_in_flight=self.workers, size_of=len)
+
+    def start(self):
+        if self._executor is not None:
+            return
+        # TensorFlow is not fork-safe, so workers are always spawned
+        ctx = multiprocessing.get_context("spawn")
+        self._ready_queue = ctx.Queue()
+        self.worker_timings = []
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, self.batcher.max_batch, self._ready_queue),
+        )
+        # Workers are spawned lazily; submit one task per worker so every
+        # process is started and warming its models before traffic arrives.
+        self._startup_futures = [self._executor.submit(_ping) for _ in range(self.workers)]
+        self.batcher.start()
+
+    def readiness(self) -> dict:
+        """Report whether every worker has loaded and warmed its models."""
+        while self._ready_queue is not None and len(self.worker_timings) < self.workers:
+            try:
+                self.worker_timings.append(self._ready_queue.get_nowait())
+            except queue.Empty:
+                break
+        status = {
+            "ready": self._executor is not None and len(self.worker_timings) >= self.workers,
+            "workers": self.workers,
+            "warm_workers": len(self.worker_timings),
+            "timings": self.worker_timings,
+        }
+        for future in self._startup_futures:
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                status["ready"] = False
+                status["error"] = str(future.exception())
+                break
+        return status
+
+    def shutdown(self):
+        if self._executor is None:
+            return
+        self.batcher.stop()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+        self._ready_queue.close()
+        self._ready_queue = None
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            raise RuntimeError("Inference pool is not running")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _classify(self, groups: List[np.ndarray]) -> List[List[dict]]:
+        # Faces of every image in the batch go through one forward pass
+        with timed("classify_batch"):
+            probabilities = await self._run(classify_faces, np.concatenate(groups))
+        results = [to_emotion_result(p) for p in probabilities]
+        grouped, start = [], 0
+        for group in groups:
+            grouped.append(results[start:start + len(group)])
+            start += len(group)
+        return grouped
+
+    async def _classify_one(self, face: np.ndarray) -> dict:
+        # Includes the wait for batch-mates; classify_batch is the forward pass
+        with timed("classify"):
+            return (await self.batcher.submit(face[np.newaxis]))[0]
+
+    async def analyze(self, img_bytes: bytes) -> dict:
+        """Detect the face in a worker, then classify it in a shared batch."""
+        face, detection = await self._run(_detect_image, img_bytes)
+        self._record_detection(detection)
+        return await self._classify_one(face)
+
+    async def analyze_faces(self, img_bytes: bytes) -> dict:
+        """Analyze every detected face (up to MAX_FACES) in one batched call."""
+        faces, boxes, detection = await self._run(_detect_image_faces, img_bytes)
+        self._record_detection(detection)
+        with timed("classify"):
+            results = await self.batcher.submit(faces)
+        return group_emotion_result(results, boxes)
+
+    async def analyze_frame(self, img_bytes: bytes, box: Optional[tuple] = None) -> Tuple[dict, Optional[tuple]]:
+        """Like analyze, but skips detection when a face box is supplied.
+
+        Returns the result and the box that was used, so a video stream can
+        reuse a recent detection for the next frames.
+        """
+        if box is None:
+            face, detection = await self._run(_detect_image, img_bytes)
+            self._record_detection(detection)
+            box = detection["box"]
+        else:
+            face = await self._run(_crop_image, img_bytes, box)
+        return await self._classify_one(face), box
+
+    def _record_detection(self, detection: dict):
+        self.detections += 1
+        if "decode" in detection:
+            observe_stage("decode", detection["decode"])
+        observe_stage("detect", sum(detection["latency"].values()))
+        for name, latency in detection["latency"].items():
+            tier = self.tier_stats[name]
+            tier["attempts"] += 1
+            tier["latency_total"] += latency
+        if detection["tier"] is not None:
+            self.tier_stats[detection["tier"]]["hits"] += 1
+
+    def detection_stats(self) -> dict:
+        tiers = {}
+        for name, tier in self.tier_stats.items():
+            attempts = tier["attempts"]
+            tiers[name] = {
+                "attempts": attempts,
+                "hits": tier["hits"],
+                "hit_rate": tier["hits"] / attempts if attempts else 0.0,
+                "mean_latency_ms": 1000 * tier["latency_total"] / attempts if attempts else 0.0,
+            }
+        matched = sum(tier["hits"] for tier in self.tier_stats.values())
+        return {
+            "strategy": DETECTION_STRATEGY,
+            "long_edge": DETECTION_LONG_EDGE,
+            "images": self.detections,
+            "no_face": self.detections - matched,
+            "tiers": tiers,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "engine": EMOTION_ENGINE,
+            "batching": self.batcher.stats(),
+            "detection": self.detection_stats(),
+        }
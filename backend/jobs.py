@@ -0,0 +1,228 @@
+"""Bounded analysis job queue with admission control.
+
+Every ``/analyze`` upload that misses the cache becomes a job. Synchronous
+requests wait on their job; ``?async=1`` requests get a job ID back at once
+and fetch the result from ``/analyze/jobs/{id}``. At most ``concurrency``
+jobs run at a time, so work beyond what inference can absorb waits here
+instead of piling up on the event loop.
+
+Jobs are ordered by priority (lower first; a client holding a connection
+open outranks a queued async job), then fairly across owners: each owner's
+n-th queued job is served in round n, so one client submitting a burst
+cannot starve the others.
+
+``submit`` sheds load up front: it raises ``QueueFull`` when the queue is at
+``max_queued``, the owner already has ``max_per_owner`` jobs queued, or the
+estimated wait (jobs ahead × mean run time / concurrency) exceeds
+``max_wait``. The caller answers 503 with ``Retry-After``.
+
+A job runs in a copy of the submitter's context, so the stages it records
+still land in that request's ``Server-Timing``.
+"""
+import asyncio
+import contextvars
+import heapq
+import math
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from metrics import observe_stage
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Job:
+    __slots__ = ("id", "owner", "priority", "run", "status", "result", "error",
+                 "created_at", "started_at", "finished_at", "finished", "context")
+
+    def __init__(self, owner: str, priority: int, run: Callable[[], Awaitable[Any]]):
+        self.id = secrets.token_urlsafe(16)
+        self.owner = owner
+        self.priority = priority
+        self.run = run
+        self.status = QUEUED
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.finished = asyncio.Event()
+        # The submitting request's context (metrics.py's stage timings)
+        self.context = contextvars.copy_context()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {"job_id": self.id, "status": self.status}
+        if self.status == DONE:
+            data["result"] = self.result
+        elif self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    def __init__(self, concurrency: int, max_queued: int = 256, max_per_owner: int = 16,
+                 max_wait: float = 10.0, result_ttl: float = 300.0):
+        self.concurrency = max(1, concurrency)
+        self.max_queued = max(1, max_queued)
+        self.max_per_owner = max(1, max_per_owner)
+        self.max_wait = max_wait
+        self.result_ttl = result_ttl
+        # (priority, round, sequence, job)
+        self._heap: List[tuple] = []
+        self._sequence = 0
+        self._round = 0
+        self._next_round: Dict[str, int] = {}
+        self._queued_by_owner: Dict[str, int] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._ready: Optional[asyncio.Semaphore] = None
+        self._workers: List[asyncio.Task] = []
+        self.running = 0
+        # Smoothed run time of one job, for the wait estimate
+        self.mean_run_seconds = 0.0
+        # Metrics
+        self.submitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        if self._workers:
+            return
+        self._ready = asyncio.Semaphore(0)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    def stop(self):
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+
+    # ========== Admission ==========
+    def estimated_wait(self, priority: int = 0) -> float:
+        ahead = sum(1 for entry in self._heap if entry[0] <= priority)
+        return (ahead + self.running) * self.mean_run_seconds / self.concurrency
+
+    def _reject(self, message: str, wait: float):
+        self.rejected += 1
+        raise QueueFull(message, retry_after=max(1, math.ceil(wait)))
+
+    def submit(self, owner: str, run: Callable[[], Awaitable[Any]], priority: int = 0) -> Job:
+        """Queue ``run`` for ``owner`` or raise QueueFull."""
+        if not self._workers:
+            raise RuntimeError("Job queue is not running")
+        self._sweep()
+        wait = self.estimated_wait(priority)
+        if len(self._heap) >= self.max_queued:
+            self._reject("Analysis queue is full", wait)
+        if self._queued_by_owner.get(owner, 0) >= self.max_per_owner:
+            self._reject("Too many queued analyses for this client", wait)
+        if wait > self.max_wait:
+            self._reject(f"Estimated wait {wait:.1f}s exceeds {self.max_wait:.0f}s", wait)
+
+        job = Job(owner, priority, run)
+        job_round = max(self._round, self._next_round.get(owner, 0))
+        self._next_round[owner] = job_round + 1
+        self._queued_by_owner[owner] = self._queued_by_owner.get(owner, 0) + 1
+        self._sequence += 1
+        heapq.heappush(self._heap, (priority, job_round, self._sequence, job))
+        self._jobs[job.id] = job
+        self.submitted += 1
+        self._ready.release()
+        return job
+
+    # ========== Execution ==========
+    def _pop(self) -> Job:
+        _, job_round, _, job = heapq.heappop(self._heap)
+        self._round = max(self._round, job_round)
+        remaining = self._queued_by_owner[job.owner] - 1
+        if remaining:
+            self._queued_by_owner[job.owner] = remaining
+        else:
+            del self._queued_by_owner[job.owner]
+            self._next_round.pop(job.owner, None)
+        return job
+
+    async def _work(self):
+        while True:
+            await self._ready.acquire()
+            job = self._pop()
+            waited = time.time() - job.created_at
+            job.context.run(observe_stage, "queue_wait", waited)
+            if waited > 2 * self.max_wait:
+                # Admitted under a better estimate; the client has likely given up
+                self.expired += 1
+                self._finish(job, FAILED, error="Expired in queue")
+                continue
+
+            job.status = RUNNING
+            job.started_at = time.time()
+            self.running += 1
+            started = time.perf_counter()
+            try:
+                # Workers were started outside any request; run the job in its submitter's context
+                result = await job.context.run(asyncio.ensure_future, job.run())
+                self._finish(job, DONE, result=result)
+                self.completed += 1
+            except asyncio.CancelledError:
+                self._finish(job, FAILED, error="Cancelled")
+                raise
+            except Exception as e:
+                self.failed += 1
+                self._finish(job, FAILED, error=str(e))
+            finally:
+                self.running -= 1
+                elapsed = time.perf_counter() - started
+                self.mean_run_seconds = (
+                    elapsed if not self.mean_run_seconds else 0.8 * self.mean_run_seconds + 0.2 * elapsed
+                )
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.run = None  # drop the closure and the upload bytes it holds
+        job.context = None
+        job.finished_at = time.time()
+        job.finished.set()
+
+    def _sweep(self):
+        cutoff = time.time() - self.result_ttl
+        stale = [job_id for job_id, job in self._jobs.items()
+                 if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in stale:
+            del self._jobs[job_id]
+
+    # ========== Results ==========
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: Optional[float] = None) -> Job:
+        """The job once finished, or as it is after ``timeout`` seconds."""
+        try:
+            await asyncio.wait_for(job.finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._heap),
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "max_queued": self.max_queued,
+            "owners_queued": len(self._queued_by_owner),
+            "estimated_wait_s": round(self.estimated_wait(), 3),
+            "mean_run_ms": round(1000 * self.mean_run_seconds, 3),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,393 @@
+"""Local copy of each user's saved-tracks library.
+
+``LibraryStore`` keeps every saved track in SQLite keyed by
+(user_id, track_id), ordered by ``added_at`` like Spotify's own listing, so
+pages are served locally instead of being fetched from ``/me/tracks``.
+
+``LibrarySync`` fills it. A first sync reads page 0 for the library
+``total`` and then fetches the remaining offsets concurrently, bounded by a
+semaphore. Later syncs are incremental: Spotify lists saves newest first,
+so pages are read from offset 0 only until a track saved at or before the
+newest stored ``added_at`` shows up. If the stored count then disagrees with
+Spotify's ``total`` (tracks were unsaved), the library is re-synced in full.
+
+Page 0 is fetched conditionally. Spotify's ``ETag`` for it goes back as
+``If-None-Match``, and a 304 means nothing was saved or unsaved (both change
+page 0, which carries ``total``). Within its ``Cache-Control: max-age`` no
+request is made at all. ``generation(user_id)`` changes whenever a sync
+changes the stored library, so response caches can key on it.
+``LibraryStore.version(user_id)`` is the same idea kept in the database, so
+it is seen by both apps; syncs that change nothing (a 304, or no new saves)
+leave it alone.
+
+Each row also keeps the track as ``/saved-tracks`` serves it (auth.Track's
+fields), already JSON-encoded, so ``page_json`` builds a response body by
+joining stored strings without decoding or re-encoding a track.
+"""
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import spotify_client
+from metrics import timed
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    _loads = json.loads
+
+PAGE_SIZE = 50  # Spotify's maximum for /me/tracks
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS saved_tracks (
+    user_id TEXT NOT NULL,
+    track_id TEXT NOT NULL,
+    added_at TEXT NOT NULL,
+    track TEXT NOT NULL,
+    public TEXT,
+    PRIMARY KEY (user_id, track_id)
+);
+CREATE INDEX IF NOT EXISTS saved_tracks_by_added
+    ON saved_tracks (user_id, added_at DESC, track_id);
+CREATE TABLE IF NOT EXISTS library_sync (
+    user_id TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL,
+    total INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS audio_features (
+    track_id TEXT PRIMARY KEY,
+    valence REAL,
+    energy REAL,
+    tempo REAL
+);
+"""
+
+
+def _compact(track: Dict[str, Any]) -> Dict[str, Any]:
+    # available_markets is most of a track object's size and never served
+    track = {k: v for k, v in track.items() if k != "available_markets"}
+    if isinstance(track.get("album"), dict):
+        track["album"] = {k: v for k, v in track["album"].items() if k != "available_markets"}
+    return track
+
+
+def _public_json(track: Dict[str, Any]) -> str:
+    # Byte-for-byte what FastAPI's JSONResponse produced for auth.Track
+    return json.dumps(
+        {"name": track.get("name", ""), "artists": track.get("artists", []),
+         "external_urls": track.get("external_urls", {})},
+        ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+    )
+
+
+class LibraryStore:
+    def __init__(self, path: str = "library.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._add_public_column()
+        self._add_version_column()
+
+    def _add_public_column(self):
+        # Libraries stored before the public column existed get it filled once
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(saved_tracks)")}
+        if "public" not in columns:
+            try:
+                self._db.execute("ALTER TABLE saved_tracks ADD COLUMN public TEXT")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):  # another worker added it first
+                    raise
+        rows = self._db.execute("SELECT rowid, track FROM saved_tracks WHERE public IS NULL").fetchall()
+        if rows:
+            self._db.executemany(
+                "UPDATE saved_tracks SET public = ? WHERE rowid = ?",
+                [(_public_json(json.loads(track)), rowid) for rowid, track in rows],
+            )
+
+    def _add_version_column(self):
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(library_sync)")}
+        if "version" not in columns:
+            try:
+                self._db.execute("ALTER TABLE library_sync ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):  # another worker added it first
+                    raise
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def sync_state(self, user_id: str) -> Optional[Tuple[float, int]]:
+        """(synced_at, total) from the last sync, or None if never synced."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT synced_at, total FROM library_sync WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def version(self, user_id: str) -> int:
+        """Bumped by every sync that changed the user's stored tracks."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version FROM library_sync WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def mark_synced(self, user_id: str):
+        """Record a sync that found nothing new."""
+        with self._lock:
+            self._db.execute("UPDATE library_sync SET synced_at = ? WHERE user_id = ?", (time.time(), user_id))
+
+    def latest_added_at(self, user_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MAX(added_at) FROM saved_tracks WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0]
+
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM saved_tracks WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+
+    def page(self, user_id: str, limit: int, offset: int) -> List[Dict[str, Any]]:
+        """Saved tracks newest first, like /me/tracks."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT track FROM saved_tracks WHERE user_id = ? "
+                "ORDER BY added_at DESC, track_id LIMIT ? OFFSET ?",
+                (user_id, limit, offset),
+            ).fetchall()
+        return [json.loads(track) for (track,) in rows]
+
+    def page_json(self, user_id: str, limit: int, offset: int) -> bytes:
+        """The /saved-tracks response body for a page, from the stored JSON."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT public FROM saved_tracks WHERE user_id = ? "
+                "ORDER BY added_at DESC, track_id LIMIT ? OFFSET ?",
+                (user_id, limit, offset),
+            ).fetchall()
+        return ('{"tracks":[' + ",".join(public for (public,) in rows) + "]}").encode()
+
+    def tracks(self, user_id: str, track_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        placeholders = ",".join("?" * len(track_ids))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT track_id, track FROM saved_tracks WHERE user_id = ? AND track_id IN ({placeholders})",
+                (user_id, *track_ids),
+            ).fetchall()
+        return {track_id: json.loads(track) for track_id, track in rows}
+
+    # ========== Audio Features ==========
+    # Shared across users; a row of NULLs marks a track Spotify has no features for
+    def missing_audio_features(self, user_id: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT s.track_id FROM saved_tracks s "
+                "LEFT JOIN audio_features f ON f.track_id = s.track_id "
+                "WHERE s.user_id = ? AND f.track_id IS NULL",
+                (user_id,),
+            ).fetchall()
+        return [track_id for (track_id,) in rows]
+
+    def save_audio_features(self, rows: List[Tuple[str, Optional[float], Optional[float], Optional[float]]]):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO audio_features (track_id, valence, energy, tempo) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def audio_features(self, user_id: str) -> List[Tuple[str, float, float, float]]:
+        """(track_id, valence, energy, tempo) for the user's tracks that have features."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT s.track_id, f.valence, f.energy, f.tempo FROM saved_tracks s "
+                "JOIN audio_features f ON f.track_id = s.track_id "
+                "WHERE s.user_id = ? AND f.valence IS NOT NULL",
+                (user_id,),
+            ).fetchall()
+
+    def save(self, user_id: str, items: List[Dict[str, Any]], total: int, replace: bool = False):
+        """Store /me/tracks items and record the sync.
+
+        With ``replace`` the user's library is swapped for ``items`` in one
+        transaction, so readers never see a half-written full sync.
+        """
+        rows = [
+            (user_id, item["track"]["id"], item["added_at"], json.dumps(_compact(item["track"])),
+             _public_json(item["track"]))
+            for item in items
+            if item.get("track") and item["track"].get("id")
+        ]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if replace:
+                    self._db.execute("DELETE FROM saved_tracks WHERE user_id = ?", (user_id,))
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO saved_tracks (user_id, track_id, added_at, track, public) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                changed = 1 if replace or rows else 0
+                self._db.execute(
+                    "INSERT INTO library_sync (user_id, synced_at, total, version) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET synced_at = excluded.synced_at, "
+                    "total = excluded.total, version = library_sync.version + excluded.version",
+                    (user_id, time.time(), total, changed),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+
+class LibrarySync:
+    def __init__(self, store: LibraryStore, concurrency: int = 4, refresh_interval: float = 300):
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.refresh_interval = refresh_interval
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Page 0 validators per user: (ETag, fresh until)
+        self._validators: Dict[str, Tuple[Optional[str], float]] = {}
+        self._generations: Dict[str, int] = {}
+        # Metrics
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.pages_fetched = 0
+        self.not_modified = 0
+
+    def generation(self, user_id: str) -> int:
+        return self._generations.get(user_id, 0)
+
+    def invalidate(self, user_id: str):
+        """Move the user to a new generation, orphaning cached responses."""
+        self._generations[user_id] = self.generation(user_id) + 1
+
+    async def _fetch_page(self, access_token: str, offset: int) -> Dict[str, Any]:
+        response = await spotify_client.api_get(
+            "/me/tracks", access_token, params={"limit": PAGE_SIZE, "offset": offset}
+        )
+        response.raise_for_status()
+        self.pages_fetched += 1
+        return _loads(response.content)
+
+    async def _fetch_first_page(self, user_id: str, access_token: str,
+                                conditional: bool = True) -> Optional[Dict[str, Any]]:
+        """Page 0, or None when Spotify says it has not changed."""
+        etag = self._validators.get(user_id, (None, 0.0))[0] if conditional else None
+        response = await spotify_client.api_get(
+            "/me/tracks", access_token, params={"limit": PAGE_SIZE, "offset": 0},
+            headers={"If-None-Match": etag} if etag else None,
+        )
+        if response.status_code == 304:
+            self._remember_validators(user_id, response, etag)
+            return None
+        response.raise_for_status()
+        self.pages_fetched += 1
+        self._remember_validators(user_id, response, response.headers.get("etag"))
+        return _loads(response.content)
+
+    def _remember_validators(self, user_id: str, response, etag: Optional[str]):
+        cache_control = response.headers.get("cache-control", "")
+        match = re.search(r"max-age=(\d+)", cache_control)
+        cacheable = match and "no-cache" not in cache_control and "no-store" not in cache_control
+        fresh_for = int(match.group(1)) if cacheable else 0
+        if etag or fresh_for:
+            self._validators[user_id] = (etag, time.time() + fresh_for)
+        else:
+            self._validators.pop(user_id, None)
+
+    async def full_sync(self, user_id: str, access_token: str) -> int:
+        first = await self._fetch_first_page(user_id, access_token, conditional=False)
+        total = first["total"]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(offset: int) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return (await self._fetch_page(access_token, offset))["items"]
+
+        pages = await asyncio.gather(*(fetch(offset) for offset in range(PAGE_SIZE, total, PAGE_SIZE)))
+        items = first["items"] + [item for page in pages for item in page]
+        await asyncio.to_thread(self.store.save, user_id, items, total, True)
+        self.invalidate(user_id)
+        self.full_syncs += 1
+        return total
+
+    async def incremental_sync(self, user_id: str, access_token: str) -> int:
+        latest = await asyncio.to_thread(self.store.latest_added_at, user_id)
+        if latest is None:
+            return await self.full_sync(user_id, access_token)
+
+        if time.time() < self._validators.get(user_id, (None, 0.0))[1]:
+            page = None  # still fresh per Cache-Control; don't ask
+        else:
+            page = await self._fetch_first_page(user_id, access_token)
+        if page is None:
+            self.not_modified += 1
+            await asyncio.to_thread(self.store.mark_synced, user_id)
+            return (await asyncio.to_thread(self.store.sync_state, user_id))[1]
+
+        new_items: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            if offset:
+                page = await self._fetch_page(access_token, offset)
+            total = page["total"]
+            fresh = [item for item in page["items"] if item["added_at"] > latest]
+            new_items.extend(fresh)
+            offset += PAGE_SIZE
+            if len(fresh) < len(page["items"]) or offset >= total:
+                break
+
+        await asyncio.to_thread(self.store.save, user_id, new_items, total)
+        if await asyncio.to_thread(self.store.count, user_id) != total:
+            # Something was unsaved (or saved with an older added_at)
+            return await self.full_sync(user_id, access_token)
+        if new_items:
+            self.invalidate(user_id)
+        self.incremental_syncs += 1
+        return total
+
+    async def sync(self, user_id: str, access_token: str) -> int:
+        """Bring the user's library up to date; concurrent calls share one sync."""
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self.incremental_sync(user_id, access_token))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def ensure_fresh(self, user_id: str, access_token: str):
+        """Sync when the library was never synced or is older than refresh_interval."""
+        state = await asyncio.to_thread(self.store.sync_state, user_id)
+        if state is None or time.time() - state[0] >= self.refresh_interval:
+            with timed("library_sync"):
+                await self.sync(user_id, access_token)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "full_syncs": self.full_syncs,
+            "incremental_syncs": self.incremental_syncs,
+            "pages_fetched": self.pages_fetched,
+            "not_modified": self.not_modified,
+            "syncs_in_flight": len(self._inflight),
+        }
@@ -0,0 +1,143 @@
+"""Gemini calls used to re-rank mood candidates.
+
+``build_prompt`` keeps the prompt inside a token budget by listing the
+nearest candidates first and stopping when the next song would not fit.
+``generate_text`` returns the whole completion; ``stream_text`` yields text
+chunks from the streaming endpoint as they arrive (Server-Sent Events), so
+callers can forward the first songs before the completion is finished.
+``SharedStream`` lets several requests read one such stream.
+"""
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+import spotify_client
+from metrics import timed
+
+# ========== Configuration ==========
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+LLM_API_URL = os.getenv(
+    "LLM_API_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/text-bison-001:generateText"
+)
+LLM_STREAM_URL = os.getenv(
+    "LLM_STREAM_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:streamGenerateContent"
+)
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "1000"))
+LLM_TEMPERATURE = 0.7
+CHARS_PER_TOKEN = 4  # rough estimate for English text
+
+
+class LLMError(Exception):
+    """Non-200 from the LLM; raised so the failure isn't cached."""
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def build_prompt(mood: str, tracks: List[Dict[str, Any]], limit: int,
+                 token_budget: int = LLM_PROMPT_TOKEN_BUDGET) -> Tuple[str, List[Dict[str, Any]]]:
+    """Prompt listing as many of ``tracks`` (best first) as fit the budget.
+
+    Returns the prompt and the tracks it lists.
+    """
+    header = (
+        f"Based on the following mood: '{mood}', "
+        f"select the top {limit} songs from this list that emotionally fit best:\n\n"
+    )
+    footer = f"\n\nOnly return the selected {limit} songs as a list of 'Title - Artist'."
+    remaining = token_budget - estimate_tokens(header) - estimate_tokens(footer)
+
+    song_lines = []
+    for i, track in enumerate(tracks, start=1):
+        line = f"{i}. {track['name']} - {track['artists'][0]['name']}"
+        cost = estimate_tokens(line) + 1
+        # Always list at least `limit` songs, even over budget
+        if cost > remaining and len(song_lines) >= limit:
+            break
+        remaining -= cost
+        song_lines.append(line)
+
+    song_list_text = "\n".join(song_lines)
+    return header + song_list_text + footer, tracks[:len(song_lines)]
+
+
+async def generate_text(prompt: str) -> str:
+    with timed("llm"):
+        response = await spotify_client.request(
+            "POST",
+            LLM_API_URL,
+            params={"key": GOOGLE_API_KEY},
+            json={"prompt": {"text": prompt}, "temperature": LLM_TEMPERATURE}
+        )
+    if response.status_code != 200:
+        raise LLMError(response.text)
+    return response.json().get("candidates", [{}])[0].get("output", "").strip()
+
+
+async def stream_text(prompt: str) -> AsyncIterator[str]:
+    """Completion text chunks, in order, as the model produces them."""
+    request = spotify_client.get_client().build_request(
+        "POST",
+        LLM_STREAM_URL,
+        params={"alt": "sse", "key": GOOGLE_API_KEY},
+        json={
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": LLM_TEMPERATURE},
+        },
+    )
+    # Time to response headers; the body then arrives as it is generated
+    with timed("llm_first_byte"):
+        response = await spotify_client.send(request, stream=True)
+    try:
+        if response.status_code != 200:
+            await response.aread()
+            raise LLMError(response.text)
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            event = json.loads(line[5:])
+            for candidate in event.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
+    finally:
+        await response.aclose()
+
+
+class SharedStream:
+    """Text chunks of one in-flight stream, readable by several followers.
+
+    Each ``follow()`` replays the chunks so far, then yields new ones as
+    they are published, until ``finish()``.
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.finished = False
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: str):
+        self.chunks.append(chunk)
+        self._changed.set()
+
+    def finish(self):
+        self.finished = True
+        self._changed.set()
+
+    async def follow(self) -> AsyncIterator[str]:
+        sent = 0
+        while True:
+            while sent < len(self.chunks):
+                sent += 1
+                yield self.chunks[sent - 1]
+            if self.finished:
+                return
+            self._changed.clear()
+            await self._changed.wait()
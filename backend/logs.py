@@ -0,0 +1,105 @@
+"""Structured JSON logging that stays off the request path.
+
+Loggers only put records on an in-memory queue. A ``QueueListener`` thread
+does the JSON encoding (orjson when installed) and the console and
+rotating-file writes. Pass message arguments %-style
+(``logger.debug("attempt %d", n)``) so nothing is formatted for records
+below the log level, and formatting of the rest also happens on the
+listener thread.
+
+``SamplingFilter`` drops a share of high-volume events before they are
+queued. Rates come from ``LOG_SAMPLE_RATES`` keyed by the message template,
+or per call with ``extra={"sample_rate": 0.1}``.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+from typing import Dict, Optional
+
+try:
+    import orjson
+
+    def _dumps(data) -> str:
+        return orjson.dumps(data, default=str).decode()
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    import json
+
+    def _dumps(data) -> str:
+        return json.dumps(data, default=str)
+
+# Attributes every LogRecord has; anything else came from extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class StructuredLogFormatter(logging.Formatter):
+    def format(self, record):
+        log_data = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'module': record.module,
+            'function': record.funcName,
+            'line': record.lineno,
+        }
+        # Fields passed with extra= are set as record attributes
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                log_data[key] = value
+        if record.exc_info:
+            log_data['exception'] = self.formatException(record.exc_info)
+
+        return _dumps(log_data)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep roughly ``rate`` of the records for each sampled message template."""
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record):
+        rate = getattr(record, "sample_rate", None)
+        if rate is None:
+            rate = self.rates.get(record.msg)
+        if rate is None or rate >= 1:
+            return True
+        return random.random() < rate
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The queue is in-process, so the record can go as-is; the stock
+        # prepare() would format the message here, on the caller's thread
+        return record
+
+
+def setup_logging(name: str, level: str = "INFO", log_file: Optional[str] = None,
+                  sample_rates: Optional[Dict[str, float]] = None) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    formatter = StructuredLogFormatter()
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=10*1024*1024,  # 10MB
+            backupCount=5
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+
+    queue_handler = _EnqueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    logger.addFilter(SamplingFilter(sample_rates))
+    return logger
@@ -1,20 +1,58 @@
 # ========== Imports ==========
+import asyncio
+import hashlib
+import json
 import os
-import cv2
-import numpy as np
-import requests
+import re
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File
+from typing import Dict, List, Optional
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from deepface import DeepFace
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+import spotify_client
+from inference import InferencePool, MODEL_FINGERPRINT
+from jobs import FAILED, JobQueue, QueueFull
+from library import LibraryStore, LibrarySync
+from llm import LLM_API_URL, LLM_STREAM_URL, LLMError, SharedStream, build_prompt, generate_text, stream_text
+from metrics import REGISTRY, MetricsMiddleware, register_cache, timed
+from ranking import FEATURES, MoodRanker, target_from_emotions, target_from_text
+from result_cache import ResultCache
+from streaming import EmotionStream
+from uploads import UploadSizeLimitMiddleware
 
 # ========== Load Environment Variables ==========
 load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+ANALYZE_CACHE_SIZE = int(os.getenv("ANALYZE_CACHE_SIZE", "1024"))
+ANALYZE_CACHE_TTL = float(os.getenv("ANALYZE_CACHE_TTL", "3600"))
+ANALYZE_CACHE_DIR = os.getenv("ANALYZE_CACHE_DIR")  # optional on-disk tier
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "32"))
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+LIBRARY_DB_PATH = os.getenv("LIBRARY_DB_PATH", "library.db")
+LIBRARY_SYNC_CONCURRENCY = int(os.getenv("LIBRARY_SYNC_CONCURRENCY", "4"))
+LIBRARY_REFRESH_INTERVAL = float(os.getenv("LIBRARY_REFRESH_INTERVAL", "300"))
+RANK_CACHE_USERS = int(os.getenv("RANK_CACHE_USERS", "256"))
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR")  # optional on-disk tier
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "0"))  # 0: 4 per inference worker
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "256"))
+JOB_MAX_PER_CLIENT = int(os.getenv("JOB_MAX_PER_CLIENT", "16"))
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "10"))  # seconds; longer estimated waits get 503
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "300"))
+JOB_POLL_TIMEOUT = float(os.getenv("JOB_POLL_TIMEOUT", "30"))  # longest long-poll
+ASYNC_JOB_PRIORITY = 1  # behind requests whose client is holding the connection
 
 # ========== FastAPI Setup ==========
 app = FastAPI()
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES,
+    path_limits={"/analyze/batch": MAX_BATCH_UPLOAD_BYTES},
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -22,99 +60,391 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the timings include the other middleware
+app.add_middleware(MetricsMiddleware, app_name="main", server_timing=SERVER_TIMING)
+
+# DeepFace runs in worker processes; see inference.py (INFERENCE_WORKERS)
+inference_pool = InferencePool()
+# Uploads that miss the cache wait here for inference; see jobs.py
+job_queue = JobQueue(
+    JOB_CONCURRENCY or 4 * inference_pool.workers,
+    max_queued=JOB_QUEUE_SIZE,
+    max_per_owner=JOB_MAX_PER_CLIENT,
+    max_wait=JOB_MAX_WAIT,
+    result_ttl=JOB_RESULT_TTL,
+)
+# Results keyed by a hash of the uploaded bytes; see content_key
+analyze_cache = ResultCache(ANALYZE_CACHE_SIZE, ANALYZE_CACHE_TTL, ANALYZE_CACHE_DIR)
+# Same SQLite library as auth.py; see library.py and ranking.py
+library_store = LibraryStore(LIBRARY_DB_PATH)
+library_sync = LibrarySync(library_store, LIBRARY_SYNC_CONCURRENCY, LIBRARY_REFRESH_INTERVAL)
+mood_ranker = MoodRanker(library_store, LIBRARY_SYNC_CONCURRENCY, RANK_CACHE_USERS)
+# Gemini picks keyed by normalized mood + candidate list; see llm_cache_key
+llm_cache = ResultCache(LLM_CACHE_SIZE, LLM_CACHE_TTL, LLM_CACHE_DIR)
+# Access token -> Spotify user id; tokens live an hour
+user_ids = ResultCache(max_entries=1024, ttl=3600)
+register_cache("analyze", analyze_cache)
+register_cache("llm", llm_cache)
+# llm_cache key -> (SharedStream, task producing the text) for in-flight streams
+llm_streams: Dict[str, tuple] = {}
+register_cache("user_ids", user_ids)
+
+@app.on_event("startup")
+async def start_inference_pool():
+    inference_pool.start()
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_inference_pool():
+    job_queue.stop()
+    inference_pool.shutdown()
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await spotify_client.close_client()
+
+@app.on_event("shutdown")
+async def close_library_store():
+    library_store.close()
 
 # ========== Models ==========
 class MoodInput(BaseModel):
-    mood_description: str
+    mood_description: str = ""
+    # Emotion percentages from /analyze; used instead of mood_description when given
+    emotions: Optional[Dict[str, float]] = None
+    limit: int = Field(3, ge=1, le=50)
+    rerank: bool = False
 
 # ========== Helper Functions ==========
-def analyze_emotion(img) -> dict:
-    result = DeepFace.analyze(
-        img,
-        actions=['emotion'],
-        detector_backend='retinaface',
-        enforce_detection=False
+def _sha256(data: bytes, salt: str) -> str:
+    digest = hashlib.sha256(data)
+    digest.update(salt.encode())
+    return digest.hexdigest()
+
+async def content_key(img_bytes: bytes, mode: str = "") -> str:
+    salt = MODEL_FINGERPRINT + mode
+    # hashlib releases the GIL, so large uploads are hashed off the event loop
+    if len(img_bytes) > 256 * 1024:
+        return await asyncio.to_thread(_sha256, img_bytes, salt)
+    return _sha256(img_bytes, salt)
+
+async def analysis_key(img_bytes: bytes, all_faces: bool = False) -> str:
+    return await content_key(img_bytes, ":all-faces" if all_faces else "")
+
+async def analyze_bytes(img_bytes: bytes, all_faces: bool = False, key: Optional[str] = None) -> dict:
+    if key is None:
+        key = await analysis_key(img_bytes, all_faces)
+    if all_faces:
+        return await analyze_cache.get_or_compute(key, lambda: inference_pool.analyze_faces(img_bytes))
+    return await analyze_cache.get_or_compute(key, lambda: inference_pool.analyze(img_bytes))
+
+def analysis_response(emotion_data: dict, all_faces: bool) -> dict:
+    if all_faces:
+        return emotion_data
+    return {
+        "dominant_emotion": emotion_data["dominant_emotion"],
+        "emotions": emotion_data["emotions"]
+    }
+
+def client_id(request: Request) -> str:
+    """Fairness key for the job queue: the client address."""
+    return request.client.host if request.client else "unknown"
+
+def queue_full_response(error: QueueFull) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(error)},
+        headers={"Retry-After": str(error.retry_after)},
     )
-    data = result[0]
-    dominant_emotion = data["dominant_emotion"].strip().lower()
-    raw_emotions = data["emotion"]
-    emotions = {k: float(v) for k, v in raw_emotions.items()}
-    return {"dominant_emotion": dominant_emotion, "emotions": emotions}
+
+async def current_user_id(access_token: str) -> str:
+    """Spotify user id for a token, looked up once per token."""
+    user_id = user_ids.get(access_token)
+    if user_id is None:
+        response = await spotify_client.api_get("/me", access_token)
+        response.raise_for_status()
+        user_id = response.json()["id"]
+        user_ids.set(access_token, user_id)
+    return user_id
+
+def normalize_mood(mood: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9']+", mood.lower()))
+
+def llm_cache_key(mood: str, limit: int, track_ids: List[str], model_url: str) -> str:
+    # Salted with the endpoint called: generateText and streaming use different models
+    tracks = hashlib.sha256(",".join(track_ids).encode()).hexdigest()
+    return _sha256(f"{normalize_mood(mood)}|{limit}|{tracks}".encode(), model_url)
+
+def aggregate_emotions(results: List[dict]) -> dict:
+    """Mean emotion distribution and dominant-emotion counts over a set."""
+    analyzed = [r for r in results if "emotions" in r]
+    distribution = {}
+    dominant_counts = {}
+    for result in analyzed:
+        for emotion, score in result["emotions"].items():
+            distribution[emotion] = distribution.get(emotion, 0.0) + score / len(analyzed)
+        dominant = result["dominant_emotion"]
+        dominant_counts[dominant] = dominant_counts.get(dominant, 0) + 1
+    return {
+        "analyzed": len(analyzed),
+        "failed": len(results) - len(analyzed),
+        "dominant_emotion": max(distribution, key=distribution.get) if distribution else None,
+        "emotions": distribution,
+        "dominant_counts": dominant_counts,
+    }
 
 # ========== Routes ==========
 @app.post("/analyze")
-async def analyze(file: UploadFile = File(...)):
+async def analyze(request: Request, file: UploadFile = File(...), all_faces: bool = False,
+                  run_async: bool = Query(False, alias="async")):
+    """
+    Returns the dominant emotion of the most prominent face. With
+    all_faces=true every detected face is returned with its box, and the
+    top-level emotion is the face-area-weighted group mood.
+
+    With async=1 the upload is queued and a 202 returns a job ID; fetch the
+    result from /analyze/jobs/{job_id}. Either way, a saturated queue
+    answers 503 with Retry-After instead of holding the request.
+    """
     try:
-        img_bytes = await file.read()
-        img_array = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+        with timed("upload_read"):
+            img_bytes = await file.read()
+        # Release the spooled multipart copy before waiting on inference
+        await file.close()
+        key = await analysis_key(img_bytes, all_faces)
+        if not run_async and analyze_cache.get(key) is not None:
+            return ORJSONResponse(analysis_response(await analyze_bytes(img_bytes, all_faces, key), all_faces))
+
+        async def run() -> dict:
+            return analysis_response(await analyze_bytes(img_bytes, all_faces, key), all_faces)
 
-        emotion_data = analyze_emotion(img)
-        return {
-            "dominant_emotion": emotion_data["dominant_emotion"],
-            "emotions": emotion_data["emotions"]
-        }
+        job = job_queue.submit(client_id(request), run, priority=ASYNC_JOB_PRIORITY if run_async else 0)
+        if run_async:
+            return JSONResponse(
+                status_code=202,
+                content=dict(job.to_dict(), estimated_wait_s=round(job_queue.estimated_wait(job.priority), 3)),
+                headers={"Location": f"/analyze/jobs/{job.id}"},
+            )
+        await job.finished.wait()
+        if job.status == FAILED:
+            raise RuntimeError(job.error)
+        return ORJSONResponse(job.result)
 
+    except QueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         print("Analyze error:", e)
         return {"error": str(e)}
 
+@app.get("/analyze/jobs/{job_id}")
+async def analyze_job(job_id: str, wait: float = Query(0, ge=0)):
+    """
+    Status of an async analysis: queued, running, done (with "result", as
+    /analyze would have returned it) or failed (with "error"). With wait=N
+    the request is held up to N seconds (at most JOB_POLL_TIMEOUT) for the
+    job to finish. Results are kept for JOB_RESULT_TTL seconds.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if wait:
+        await job_queue.wait(job, min(wait, JOB_POLL_TIMEOUT))
+    return ORJSONResponse(job.to_dict())
+
+@app.post("/analyze/batch")
+async def analyze_batch(files: List[UploadFile] = File(...)):
+    """
+    Analyzes many images from one multipart request. Images are decoded and
+    detected in parallel across the inference workers and their face crops
+    share classification batches. Results keep the upload order; a file that
+    fails reports its error in place.
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_FILES} files per batch")
+
+    async def analyze_one(index: int, file: UploadFile) -> dict:
+        result = {"index": index, "filename": file.filename}
+        try:
+            with timed("upload_read"):
+                img_bytes = await file.read()
+            await file.close()
+            emotion_data = await analyze_bytes(img_bytes)
+            result["dominant_emotion"] = emotion_data["dominant_emotion"]
+            result["emotions"] = emotion_data["emotions"]
+        except Exception as e:
+            print("Analyze error:", file.filename, e)
+            result["error"] = str(e)
+        return result
+
+    results = await asyncio.gather(*(analyze_one(i, f) for i, f in enumerate(files)))
+    return ORJSONResponse({"results": results, "aggregate": aggregate_emotions(results)})
+
+@app.websocket("/analyze/stream")
+async def analyze_stream(websocket: WebSocket):
+    """
+    Live mood tracking: send JPEG frames as binary messages and receive a
+    smoothed emotion vector at a steady rate (STREAM_EMIT_HZ).
+    """
+    await EmotionStream(websocket, inference_pool).run()
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until every inference worker is warm."""
+    status = inference_pool.readiness()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/stats")
+async def stats():
+    """Inference pool, batching, job queue, cache, library sync, ranking and upstream metrics."""
+    return {
+        "inference": inference_pool.stats(),
+        "jobs": job_queue.stats(),
+        "analyze_cache": analyze_cache.stats(),
+        "llm_cache": llm_cache.stats(),
+        "library": library_sync.stats(),
+        "ranking": mood_ranker.stats(),
+        "upstream": spotify_client.get_upstream().stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: requests, per-stage latency, upstream statuses, caches."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# TEMP: Replace with your real token from https://developer.spotify.com/console/get-current-user-saved-tracks/
+TEMP_ACCESS_TOKEN = "1POdFZRZbvb...qqillRxMr2z"
+
+async def rank_for_mood(data: MoodInput, access_token: str, count: int):
+    """Target point and the `count` saved tracks nearest to it."""
+    # Make sure the local copy of the library is current
+    user_id = await current_user_id(access_token)
+    await library_sync.ensure_fresh(user_id, access_token)
+
+    # Rank every saved track against the mood
+    if data.emotions:
+        target = target_from_emotions(data.emotions)
+    else:
+        target = target_from_text(data.mood_description)
+    tracks = await mood_ranker.recommend(user_id, access_token, target, count)
+    return target, tracks
+
+def mood_text(data: MoodInput) -> str:
+    mood = data.mood_description.strip()
+    if data.emotions:
+        mood = mood or max(data.emotions, key=data.emotions.get)
+    return mood
+
+def rerank_prompt(data: MoodInput, tracks: List[dict], model_url: str):
+    """Token-budgeted prompt and its cache key (normalized mood + listed tracks + model)."""
+    mood = mood_text(data)
+    prompt, listed = build_prompt(mood, tracks, data.limit)
+    return prompt, llm_cache_key(mood, data.limit, [track["id"] for track in listed], model_url)
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.post("/ai-recommend")
 async def ai_recommend(data: MoodInput):
     """
-    Accepts mood_description, fetches user's saved Spotify songs,
-    and asks Gemini which ones match the mood best.
+    Ranks the user's whole saved library against a mood, given either as
+    an emotions vector (from /analyze) or a mood_description, using Spotify
+    audio features locally. With rerank=true Gemini picks the final songs
+    from the top RERANK_CANDIDATES only.
     """
-
-    # TEMP: Replace with your real token from https://developer.spotify.com/console/get-current-user-saved-tracks/
-    access_token = "1POdFZRZbvb...qqillRxMr2z"
+    access_token = TEMP_ACCESS_TOKEN
 
     try:
-        # Step 1: Get user’s saved tracks
-        headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(
-            "https://api.spotify.com/v1/me/tracks?limit=10",
-            headers=headers
-        )
-
-        if response.status_code != 200:
-            return {"error": "Failed to fetch Spotify tracks", "details": response.text}
-
-        data_json = response.json()
-        items = data_json.get("items", [])
-        if not items:
-            return {"error": "No saved tracks found in user's library."}
-
-        # Step 2: Format song list for Gemini
-        song_lines = []
-        for i, item in enumerate(items, start=1):
-            track = item["track"]
-            name = track["name"]
-            artist = track["artists"][0]["name"]
-            song_lines.append(f"{i}. {name} - {artist}")
-        
-        song_list_text = "\n".join(song_lines)
-        mood = data.mood_description.strip()
-
-        # Step 3: Send to Gemini
-        gemini_prompt = (
-            f"Based on the following mood: '{mood}', "
-            f"select the top 3 songs from this list that emotionally fit best:\n\n"
-            f"{song_list_text}\n\n"
-            f"Only return the selected 3 songs as a list of 'Title - Artist'."
-        )
-
-        gemini_response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/text-bison-001:generateText?key={GOOGLE_API_KEY}",
-            headers={"Content-Type": "application/json"},
-            json={"prompt": {"text": gemini_prompt}, "temperature": 0.7}
-        )
-
-        if gemini_response.status_code != 200:
-            return {"error": "Gemini API failed", "details": gemini_response.text}
-
-        output = gemini_response.json().get("candidates", [{}])[0].get("output", "").strip()
-        return {"suggested_songs": output}
+        count = max(data.limit, RERANK_CANDIDATES) if data.rerank else data.limit
+        target, tracks = await rank_for_mood(data, access_token, count)
+        if not tracks:
+            return {"error": "No saved tracks with audio features found in user's library."}
+
+        result = {"target": dict(zip(FEATURES, target.round(3).tolist())), "tracks": tracks[:data.limit]}
+        if not data.rerank:
+            result["suggested_songs"] = "\n".join(
+                f"{i}. {track['name']} - {track['artists'][0]['name']}"
+                for i, track in enumerate(tracks[:data.limit], start=1)
+            )
+            return result
+
+        # Optionally let Gemini re-rank the nearest candidates; the same
+        # mood against the same candidates reuses the earlier answer
+        prompt, key = rerank_prompt(data, tracks, LLM_API_URL)
+        try:
+            result["suggested_songs"] = await llm_cache.get_or_compute(key, lambda: generate_text(prompt))
+        except LLMError as e:
+            return {"error": "Gemini API failed", "details": str(e)}
+        return result
 
     except Exception as e:
         return {"error": str(e)}
+
+@app.post("/ai-recommend/stream")
+async def ai_recommend_stream(data: MoodInput):
+    """
+    Server-Sent Events variant of /ai-recommend with rerank=true. Emits a
+    `candidates` event with the locally ranked tracks right away, `text`
+    events as Gemini's answer arrives, then `done` (or `error`).
+    """
+    access_token = TEMP_ACCESS_TOKEN
+
+    async def events():
+        try:
+            target, tracks = await rank_for_mood(data, access_token, max(data.limit, RERANK_CANDIDATES))
+            if not tracks:
+                yield sse_event("error", {"error": "No saved tracks with audio features found in user's library."})
+                return
+            yield sse_event("candidates", {
+                "target": dict(zip(FEATURES, target.round(3).tolist())),
+                "tracks": tracks[:data.limit],
+            })
+
+            prompt, key = rerank_prompt(data, tracks, LLM_STREAM_URL)
+            cached = await llm_cache.lookup(key)
+            if cached is not None:
+                yield sse_event("text", {"text": cached})
+                yield sse_event("done", {"suggested_songs": cached, "cached": True})
+                return
+
+            # Identical concurrent requests share one upstream stream and each
+            # replay it from the start; the finished text is cached as usual
+            shared = llm_streams.get(key)
+            if shared is None:
+                stream = SharedStream()
+
+                async def produce() -> str:
+                    async for chunk in stream_text(prompt):
+                        stream.publish(chunk)
+                    return "".join(stream.chunks).strip()
+
+                output_task = asyncio.ensure_future(llm_cache.get_or_compute(key, produce))
+                shared = llm_streams[key] = stream, output_task
+
+                def finished(task):
+                    if not task.cancelled():
+                        task.exception()  # followers re-raise it; don't warn if none are left
+                    stream.finish()
+                    llm_streams.pop(key, None)
+                output_task.add_done_callback(finished)
+            stream, output_task = shared
+
+            async for chunk in stream.follow():
+                yield sse_event("text", {"text": chunk})
+            # Shielded: this client leaving must not cancel the others' stream
+            output = await asyncio.shield(output_task)
+            if not stream.chunks and output:
+                # Filled from the disk tier without streaming
+                yield sse_event("text", {"text": output})
+            yield sse_event("done", {"suggested_songs": output, "cached": False})
+        except LLMError as e:
+            yield sse_event("error", {"error": "Gemini API failed", "details": str(e)})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,255 @@
+"""Request and stage metrics in Prometheus text format.
+
+A small in-process registry (no client library needed) holds counters,
+gauges and fixed-bucket histograms. Recording a value is a dict update
+under a lock, cheap enough to leave on in production. ``render`` produces
+the text served on ``/metrics`` by both apps.
+
+Stages (upload read, decode, detection, classification, Spotify calls,
+LLM calls, token refresh, session load, ...) are recorded with ``timed``
+or ``observe_stage`` into ``stage_duration_seconds``. ``MetricsMiddleware``
+counts requests and in-flight requests per app. With ``server_timing`` it
+also returns the current request's stages in a ``Server-Timing`` header.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage timings of the request being handled, for Server-Timing
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield from self._render_value(key, value)
+
+    def _render_value(self, key: tuple, value) -> Iterable[str]:
+        yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts, the overflow bucket, sum
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _render_value(self, key: tuple, value) -> Iterable[str]:
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        cumulative += counts[-1]
+        labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+        yield f"{self.name}_bucket{labels} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}"
+        yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        # Called at scrape time; each returns (name, type, help, [(labels, value)])
+        self.collectors: List[Callable[[], Iterable[tuple]]] = []
+
+    def add(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+stage_seconds = REGISTRY.add(Histogram(
+    "stage_duration_seconds", "Latency of one stage of request handling", ["stage"]))
+http_requests = REGISTRY.add(Counter(
+    "http_requests_total", "Requests handled", ["app", "route", "method", "status"]))
+http_request_seconds = REGISTRY.add(Histogram(
+    "http_request_duration_seconds", "Time to the end of the response", ["app", "route"]))
+http_in_flight = REGISTRY.add(Gauge(
+    "http_requests_in_flight", "Requests currently being handled", ["app"]))
+upstream_responses = REGISTRY.add(Counter(
+    "upstream_responses_total", "Responses from upstream APIs by status code", ["host", "status"]))
+upstream_retries = REGISTRY.add(Counter(
+    "upstream_retries_total", "Upstream requests sent again, by what failed", ["host", "reason"]))
+upstream_hedges = REGISTRY.add(Counter(
+    "upstream_hedges_total", "Duplicate reads sent after the endpoint's p95", ["host"]))
+upstream_hedge_wins = REGISTRY.add(Counter(
+    "upstream_hedge_wins_total", "Duplicate reads that answered first", ["host"]))
+upstream_rejected = REGISTRY.add(Counter(
+    "upstream_rejected_total", "Calls failed fast by an open circuit", ["host"]))
+upstream_circuit_state = REGISTRY.add(Gauge(
+    "upstream_circuit_state", "Circuit breaker per host: 0 closed, 1 half-open, 2 open", ["host"]))
+
+_caches: Dict[str, object] = {}
+
+
+def _collect_caches():
+    stats = {name: cache.stats() for name, cache in _caches.items()}
+    for field, kind, documentation in (
+        ("hits", "counter", "Cache hits (memory and disk)"),
+        ("misses", "counter", "Cache misses"),
+        ("coalesced", "counter", "Lookups that joined an in-flight computation"),
+        ("hit_ratio", "gauge", "Hits over lookups"),
+        ("entries", "gauge", "Entries held in memory"),
+    ):
+        samples = []
+        for name, s in stats.items():
+            value = s["hits"] + s["disk_hits"] if field == "hits" else s[field]
+            samples.append(({"cache": name}, value))
+        suffix = "_total" if kind == "counter" else ""
+        yield f"cache_{field}{suffix}", kind, documentation, samples
+
+
+REGISTRY.collectors.append(_collect_caches)
+
+
+def register_cache(name: str, cache):
+    """Export a ResultCache's hit/miss counters under cache="name"."""
+    _caches[name] = cache
+
+
+def observe_stage(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def record_upstream(host: str, status: int):
+    upstream_responses.inc(host=host, status=status)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware counting requests, in-flight requests and latency."""
+
+    def __init__(self, app, app_name: str, server_timing: bool = False):
+        self.app = app
+        self.app_name = app_name
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    entries = [f"{stage};dur={1000 * seconds:.1f}" for stage, seconds in timings]
+                    entries.append(f"total;dur={1000 * (time.perf_counter() - started):.1f}")
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", ", ".join(entries).encode()))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        http_in_flight.inc(app=self.app_name)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            http_in_flight.dec(app=self.app_name)
+            _request_timings.reset(token)
+            # The route template ("/analyze/jobs/{job_id}"), never the raw path, so
+            # IDs, scanners and CORS preflights can't blow up series cardinality
+            matched = scope.get("route")
+            route = getattr(matched, "path", None) or "unmatched"
+            http_requests.inc(app=self.app_name, route=route, method=scope["method"], status=status)
+            http_request_seconds.observe(time.perf_counter() - started, app=self.app_name, route=route)
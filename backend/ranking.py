@@ -0,0 +1,191 @@
+"""Local mood-to-track ranking over Spotify audio features.
+
+Each track is a point (valence, energy, tempo) with tempo rescaled to
+[0, 1]. A mood, either an ``emotions`` distribution from /analyze or a
+free-text ``mood_description``, becomes a target point in the same space,
+and the user's whole library is ranked by weighted squared distance in one
+vectorized pass with ``argpartition`` for the top k.
+
+Audio features are fetched 100 IDs per /audio-features call and cached in
+the library database, so they are only requested once per track. The
+per-user feature matrix is kept in memory until a sync changes the library
+(``LibraryStore.version``), for the ``max_users`` most recently ranked users.
+"""
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+import spotify_client
+from library import LibraryStore
+from metrics import observe_stage
+
+FEATURES = ("valence", "energy", "tempo")
+AUDIO_FEATURES_BATCH = 100  # Spotify's maximum ids per /audio-features call
+TEMPO_RANGE = (60.0, 200.0)  # BPM mapped onto [0, 1]
+# Relative importance of each feature in the distance
+FEATURE_WEIGHTS = np.array([1.0, 1.0, 0.5], dtype=np.float32)
+
+# (valence, energy, tempo) per emotion, roughly following the valence/arousal circumplex
+EMOTION_TARGETS = {
+    "happy": (0.85, 0.75, 0.60),
+    "surprise": (0.70, 0.80, 0.65),
+    "neutral": (0.50, 0.50, 0.45),
+    "sad": (0.15, 0.25, 0.30),
+    "fear": (0.25, 0.65, 0.55),
+    "angry": (0.20, 0.90, 0.75),
+    "disgust": (0.20, 0.60, 0.50),
+}
+# Moods a face can't show but people type
+MOOD_TARGETS = dict(EMOTION_TARGETS, calm=(0.60, 0.25, 0.30), energetic=(0.75, 0.90, 0.80))
+MOOD_WORDS = {
+    "happy": "happy joy joyful cheerful glad great good excited upbeat sunny fun love",
+    "surprise": "surprised amazed wow",
+    "neutral": "neutral okay ok fine normal meh",
+    "sad": "sad down blue depressed lonely heartbroken melancholy gloomy cry crying upset",
+    "fear": "scared afraid anxious nervous worried stressed tense",
+    "angry": "angry mad furious annoyed frustrated rage",
+    "disgust": "disgusted gross",
+    "calm": "calm relaxed chill peaceful sleepy tired mellow focus focused study",
+    "energetic": "energetic hyped pumped party workout gym dance running",
+}
+_WORD_TO_MOOD = {word: mood for mood, words in MOOD_WORDS.items() for word in words.split()}
+
+
+def _scale_tempo(tempo: np.ndarray) -> np.ndarray:
+    low, high = TEMPO_RANGE
+    return np.clip((tempo - low) / (high - low), 0.0, 1.0)
+
+
+def target_from_emotions(emotions: Dict[str, float]) -> np.ndarray:
+    """Probability-weighted mean of the emotion targets."""
+    weights = np.array([max(float(emotions.get(e, 0.0)), 0.0) for e in EMOTION_TARGETS])
+    if weights.sum() == 0:
+        return np.array(EMOTION_TARGETS["neutral"], dtype=np.float32)
+    points = np.array(list(EMOTION_TARGETS.values()))
+    return (weights @ points / weights.sum()).astype(np.float32)
+
+
+def target_from_text(text: str) -> np.ndarray:
+    """Mean target of the mood words found in text; neutral if none match."""
+    moods = [_WORD_TO_MOOD[w] for w in re.findall(r"[a-z]+", text.lower()) if w in _WORD_TO_MOOD]
+    if not moods:
+        return np.array(MOOD_TARGETS["neutral"], dtype=np.float32)
+    return np.mean([MOOD_TARGETS[m] for m in moods], axis=0).astype(np.float32)
+
+
+def top_k(matrix: np.ndarray, target: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices and distances of the k rows closest to target, nearest first.
+
+    Rows of ``matrix`` are already scaled by sqrt(FEATURE_WEIGHTS).
+    """
+    distances = np.square(matrix - target * np.sqrt(FEATURE_WEIGHTS)).sum(axis=1)
+    k = min(k, len(distances))
+    if k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    candidates = np.argpartition(distances, k - 1)[:k]
+    order = candidates[np.argsort(distances[candidates])]
+    return order, distances[order]
+
+
+class MoodRanker:
+    def __init__(self, store: LibraryStore, concurrency: int = 4, max_users: int = 256):
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.max_users = max(1, max_users)
+        # user_id -> (library version, track ids, weighted feature matrix),
+        # least recently used first
+        self._matrices: "OrderedDict[str, Tuple[int, np.ndarray, np.ndarray]]" = OrderedDict()
+        # (user_id, library version) -> build in progress
+        self._inflight: Dict[Tuple[str, int], asyncio.Task] = {}
+        # Metrics
+        self.feature_requests = 0
+        self.rank_seconds = 0.0
+        self.ranks = 0
+
+    async def _fetch_audio_features(self, access_token: str, track_ids: List[str]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(ids: List[str]):
+            async with semaphore:
+                response = await spotify_client.api_get("/audio-features", access_token, params={"ids": ",".join(ids)})
+                response.raise_for_status()
+                self.feature_requests += 1
+            by_id = {f["id"]: f for f in response.json()["audio_features"] if f}
+            rows = []
+            for track_id in ids:
+                f = by_id.get(track_id)
+                rows.append((track_id, f["valence"], f["energy"], f["tempo"]) if f else (track_id, None, None, None))
+            await asyncio.to_thread(self.store.save_audio_features, rows)
+
+        await asyncio.gather(*(
+            fetch(track_ids[i:i + AUDIO_FEATURES_BATCH])
+            for i in range(0, len(track_ids), AUDIO_FEATURES_BATCH)
+        ))
+
+    def _build_matrix(self, user_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        rows = self.store.audio_features(user_id)
+        ids = np.array([row[0] for row in rows], dtype=object)
+        matrix = np.array([row[1:] for row in rows], dtype=np.float32).reshape(-1, len(FEATURES))
+        matrix[:, 2] = _scale_tempo(matrix[:, 2])
+        return ids, matrix * np.sqrt(FEATURE_WEIGHTS)
+
+    async def matrix(self, user_id: str, access_token: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Track ids and feature matrix for the user's synced library."""
+        version = await asyncio.to_thread(self.store.version, user_id)
+        cached = self._matrices.get(user_id)
+        if cached is not None and cached[0] == version:
+            self._matrices.move_to_end(user_id)
+            return cached[1], cached[2]
+
+        # Concurrent requests for the same library version share one build
+        key = (user_id, version)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(user_id, access_token, version))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id: str, access_token: str, version: int) -> Tuple[np.ndarray, np.ndarray]:
+        missing = await asyncio.to_thread(self.store.missing_audio_features, user_id)
+        if missing:
+            await self._fetch_audio_features(access_token, missing)
+        ids, matrix = await asyncio.to_thread(self._build_matrix, user_id)
+        cached = self._matrices.get(user_id)
+        if cached is None or cached[0] <= version:  # a newer version may have finished first
+            self._matrices[user_id] = (version, ids, matrix)
+            self._matrices.move_to_end(user_id)
+        while len(self._matrices) > self.max_users:
+            self._matrices.popitem(last=False)
+        return ids, matrix
+
+    async def recommend(self, user_id: str, access_token: str, target: np.ndarray, k: int) -> List[Dict[str, Any]]:
+        """The k saved tracks nearest to target, as track objects with a ``distance``."""
+        ids, matrix = await self.matrix(user_id, access_token)
+        started = time.perf_counter()
+        order, distances = top_k(matrix, target, k)
+        elapsed = time.perf_counter() - started
+        self.rank_seconds += elapsed
+        observe_stage("rank", elapsed)
+        self.ranks += 1
+
+        chosen = [ids[i] for i in order]
+        tracks = await asyncio.to_thread(self.store.tracks, user_id, chosen) if chosen else {}
+        return [
+            dict(tracks[track_id], distance=round(float(distance), 4))
+            for track_id, distance in zip(chosen, distances)
+            if track_id in tracks
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._matrices),
+            "tracks": sum(len(ids) for _, ids, _ in self._matrices.values()),
+            "feature_requests": self.feature_requests,
+            "ranks": self.ranks,
+            "mean_rank_ms": round(1000 * self.rank_seconds / self.ranks, 3) if self.ranks else 0.0,
+        }
@@ -0,0 +1,251 @@
+"""Rate limiting shared across uvicorn workers.
+
+slowapi keeps its counters in a ``limits`` storage chosen by URI
+(RATE_LIMIT_STORAGE_URI):
+
+- ``memory://``: per process; N workers allow N times the limit.
+- ``sqlite:///path/ratelimit.db``: a SQLite file shared by the workers on
+  one host (``SQLiteStorage`` below).
+- ``redis://host:6379``: shared across hosts (needs the ``redis`` package).
+
+With the default ``moving-window`` strategy each hit is a timestamped
+entry, and a request is admitted only if fewer than ``limit`` entries fall
+inside the trailing window. SQLite does the count-and-insert inside one
+``BEGIN IMMEDIATE`` transaction and Redis in a Lua script, so concurrent
+workers can't both take the last slot.
+
+``BudgetedLimiter`` keeps the check inside RATE_LIMIT_BUDGET_US.
+``SQLiteStorage`` stops waiting for the database lock once the budget is
+spent and raises ``StorageBusy``; RATE_LIMIT_OVER_BUDGET then decides what
+happens to the request:
+
+- ``allow``: the storage admits it uncounted (fail open).
+- ``memory``: count it in per-worker memory until the shared storage
+  answers in time again.
+- ``enforce``: wait for the storage (up to 5 s); slow checks are only
+  counted.
+
+For Redis, put the budget in the URI (``redis://host:6379?socket_timeout=0.005``)
+and use ``memory``; a Redis timeout is otherwise an error.
+"""
+import sqlite3
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from limits.storage import MovingWindowSupport, Storage
+from slowapi import Limiter
+
+OVER_BUDGET_POLICIES = ("allow", "memory", "enforce")
+ENFORCE_TIMEOUT = 5.0  # seconds to wait for the database lock without a budget
+
+
+class StorageBusy(sqlite3.OperationalError):
+    """The storage could not answer within the budget."""
+
+
+class SQLiteStorage(Storage, MovingWindowSupport):
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, budget_us: Optional[float] = None,
+                 fail_open: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        parsed = urllib.parse.urlparse(uri)
+        self.path = (parsed.netloc + parsed.path) or "ratelimit.db"
+        # Longest wait for the lock, then StorageBusy; None waits ENFORCE_TIMEOUT
+        self.budget = budget_us / 1e6 if budget_us else None
+        # Admit a hit instead of raising StorageBusy
+        self.fail_open = fail_open
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS window_entries (key TEXT NOT NULL, at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS window_entries_by_key ON window_entries (key, at);
+        """)
+        # The schema above may wait the full 5 s at startup; checks wait at most the budget
+        self._db.execute(f"PRAGMA busy_timeout={int(1000 * (self.budget or ENFORCE_TIMEOUT))}")
+        # Metrics
+        self.operations = 0
+        self.operation_seconds = 0.0
+        self.max_operation_seconds = 0.0
+        self.over_budget = 0  # answered, but slower than the budget
+        self.busy = 0  # gave up at the budget
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    @contextmanager
+    def _locked(self):
+        started = time.perf_counter()
+        if not self._lock.acquire(timeout=self.budget or ENFORCE_TIMEOUT):
+            self.busy += 1
+            raise StorageBusy("Rate limit storage busy")
+        answered = False
+        try:
+            yield
+            answered = True
+        finally:
+            self._lock.release()
+            elapsed = time.perf_counter() - started
+            self.operations += 1
+            self.operation_seconds += elapsed
+            self.max_operation_seconds = max(self.max_operation_seconds, elapsed)
+            if answered and self.budget is not None and elapsed > self.budget:
+                self.over_budget += 1
+
+    def _transaction(self, fn, *args):
+        with self._locked():
+            # IMMEDIATE takes the write lock up front, so the read and the
+            # write below are atomic across processes
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                # Another worker held the lock past busy_timeout
+                self.busy += 1
+                raise StorageBusy(str(e)) from e
+            try:
+                result = fn(*args)
+                self._db.execute("COMMIT")
+                return result
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _hit(self, fn, admitted):
+        """Run a counting transaction; ``admitted`` is the answer when failing open."""
+        try:
+            return self._transaction(fn)
+        except StorageBusy:
+            if self.fail_open:
+                return admitted
+            raise
+
+    # ========== Fixed Window ==========
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        def incr():
+            now = time.time()
+            self._db.execute(
+                "INSERT INTO counters (key, count, expires_at) VALUES (?, 0, ?) "
+                "ON CONFLICT(key) DO UPDATE SET count = CASE WHEN expires_at <= ? THEN 0 ELSE count END, "
+                "expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END",
+                (key, now + expiry, now, now),
+            )
+            self._db.execute("UPDATE counters SET count = count + ? WHERE key = ?", (amount, key))
+            return self._db.execute("SELECT count FROM counters WHERE key = ?", (key,)).fetchone()[0]
+        return self._hit(incr, admitted=0)
+
+    def get(self, key: str) -> int:
+        with self._locked():
+            row = self._db.execute(
+                "SELECT count FROM counters WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        with self._locked():
+            row = self._db.execute("SELECT expires_at FROM counters WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            with self._locked():
+                self._db.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        def reset():
+            cleared = self._db.execute("SELECT COUNT(*) FROM counters").fetchone()[0]
+            self._db.execute("DELETE FROM counters")
+            self._db.execute("DELETE FROM window_entries")
+            return cleared
+        return self._transaction(reset)
+
+    def clear(self, key: str) -> None:
+        def clear():
+            self._db.execute("DELETE FROM counters WHERE key = ?", (key,))
+            self._db.execute("DELETE FROM window_entries WHERE key = ?", (key,))
+        self._transaction(clear)
+
+    # ========== Moving Window ==========
+    def acquire_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+
+        def acquire():
+            now = time.time()
+            self._db.execute("DELETE FROM window_entries WHERE key = ? AND at <= ?", (key, now - expiry))
+            (count,) = self._db.execute("SELECT COUNT(*) FROM window_entries WHERE key = ?", (key,)).fetchone()
+            if count + amount > limit:
+                return False
+            self._db.executemany("INSERT INTO window_entries (key, at) VALUES (?, ?)", [(key, now)] * amount)
+            return True
+        return self._hit(acquire, admitted=True)
+
+    def get_moving_window(self, key: str, limit: int, expiry: int) -> Tuple[float, int]:
+        with self._locked():
+            start, count = self._db.execute(
+                "SELECT MIN(at), COUNT(*) FROM window_entries WHERE key = ? AND at > ?",
+                (key, time.time() - expiry),
+            ).fetchone()
+        return (start or time.time()), count
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "operations": self.operations,
+            "mean_us": round(1e6 * self.operation_seconds / self.operations, 1) if self.operations else 0.0,
+            "max_us": round(1e6 * self.max_operation_seconds, 1),
+            "over_budget": self.over_budget,
+            "busy": self.busy,
+        }
+
+
+class BudgetedLimiter(Limiter):
+    """slowapi Limiter whose storage checks stay within ``budget_us``.
+
+    Only slowapi's constructor options are used: the budget and the
+    ``allow`` policy go to the storage (``storage_options``), and ``memory``
+    is slowapi's ``in_memory_fallback_enabled``.
+    """
+
+    def __init__(self, *args, storage_uri: str = "memory://", budget_us: float = 500,
+                 over_budget: str = "allow", **kwargs):
+        if over_budget not in OVER_BUDGET_POLICIES:
+            raise ValueError(f"over_budget must be one of {OVER_BUDGET_POLICIES}")
+        options = dict(kwargs.pop("storage_options", {}))
+        if storage_uri.startswith("sqlite") and over_budget != "enforce":
+            options.update(budget_us=budget_us, fail_open=over_budget == "allow")
+        super().__init__(
+            *args,
+            storage_uri=storage_uri,
+            storage_options=options,
+            in_memory_fallback_enabled=over_budget == "memory",
+            **kwargs,
+        )
+        self.budget_us = budget_us
+        self.over_budget_policy = over_budget
+        # The shared storage, kept even while the memory fallback is in use
+        self.storage = self.limiter.storage
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "storage": type(self.storage).__name__,
+            "strategy": type(self.limiter).__name__,
+            "budget_us": self.budget_us,
+            "over_budget_policy": self.over_budget_policy,
+            "operations": 0,
+            "mean_us": 0.0,
+            "max_us": 0.0,
+            "over_budget": 0,
+            "busy": 0,
+        }
+        if isinstance(self.storage, SQLiteStorage):
+            stats.update(self.storage.stats())
+        return stats
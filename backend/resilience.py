@@ -0,0 +1,266 @@
+"""Retries, circuit breaking and hedged reads for outbound HTTP calls.
+
+``Upstream.call`` sends one logical request (``send`` sends it once) under
+three policies:
+
+- Connection errors, timeouts, 429 and 5xx are retried, up to ``attempts``
+  tries in all. The wait is the response's ``Retry-After`` when it has one,
+  otherwise exponential backoff with full jitter. Every try and wait must
+  fit in the call's ``deadline``: when the next one would not, the last
+  response (or error) is returned at once instead.
+- Each host has a circuit breaker. ``failure_threshold`` failures in a row
+  open it, and calls then raise ``CircuitOpen`` without being sent, so a
+  struggling upstream is not buried in retries. After ``reset_timeout`` a
+  single probe goes through; its success closes the circuit again.
+- Idempotent reads (``hedge=True``) that have not answered within the p95
+  latency of their endpoint are sent a second time, and the first answer
+  wins. That duplicates about one read in twenty.
+
+The response that is finally returned, retryable or not, is the caller's to
+check, as with a bare httpx call.
+"""
+import asyncio
+import email.utils
+import math
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Union
+
+import httpx
+
+from metrics import (upstream_circuit_state, upstream_hedge_wins, upstream_hedges, upstream_rejected,
+                     upstream_retries)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+LATENCY_WINDOW = 200  # recent successful tries kept per endpoint
+MIN_HEDGE_SAMPLES = 20  # below this the p95 means little, so no hedging
+
+
+class CircuitOpen(httpx.RequestError):
+    """The host's circuit is open; the request was not sent."""
+
+    def __init__(self, host: str, retry_after: int):
+        super().__init__(f"{host} is failing; requests resume in {retry_after}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """``Retry-After`` in seconds, from either of its formats."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_failure(status_code: int) -> bool:
+    # What counts against the breaker: the upstream, not the request, is at fault
+    return status_code >= 500 or status_code == 429
+
+
+class CircuitBreaker:
+    def __init__(self, host: str, failure_threshold: int, reset_timeout: float):
+        self.host = host
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def check(self):
+        """Raise CircuitOpen unless a request may be sent now."""
+        if self.state == CLOSED:
+            return
+        waited = time.monotonic() - self.opened_at
+        if self.state == OPEN and waited >= self.reset_timeout:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        raise CircuitOpen(self.host, max(1, math.ceil(self.reset_timeout - waited)))
+
+    def record(self, ok: bool):
+        self._probing = False
+        if ok:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != OPEN:
+                self._set_state(OPEN)
+
+    def abandon(self):
+        # A cancelled probe showed nothing either way; let the next call probe
+        self._probing = False
+
+    def _set_state(self, state: str):
+        self.state = state
+        upstream_circuit_state.set(_STATE_VALUES[state], host=self.host)
+
+
+class Upstream:
+    def __init__(self, attempts: int = 3, backoff_factor: float = 0.5, deadline: float = 20.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 hedge: bool = True, hedge_min_delay: float = 0.05):
+        self.attempts = max(1, attempts)
+        self.backoff_factor = backoff_factor
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # "host/path" -> durations of recent successful tries, for the hedge delay
+        self._latencies: Dict[str, Deque[float]] = {}
+        # Metrics
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(host, self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        samples = self._latencies.get(endpoint)
+        if samples is None or len(samples) < MIN_HEDGE_SAMPLES:
+            return None
+        p95 = sorted(samples)[int(0.95 * (len(samples) - 1))]
+        return max(self.hedge_min_delay, p95)
+
+    async def call(self, send: Callable[[], Awaitable[httpx.Response]], url: Union[str, httpx.URL],
+                   hedge: bool = False, deadline: Optional[float] = None) -> httpx.Response:
+        """``send()``'s response, retried, hedged and circuit-broken per host."""
+        url = httpx.URL(url)
+        host = url.host
+        endpoint = f"{host}{url.path}"
+        breaker = self.breaker(host)
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + (self.deadline if deadline is None else deadline)
+
+        for attempt in range(1, self.attempts + 1):
+            try:
+                breaker.check()
+            except CircuitOpen:
+                self.rejected += 1
+                upstream_rejected.inc(host=host)
+                raise
+            hedge_delay = None
+            if hedge and self.hedge and breaker.state == CLOSED:
+                hedge_delay = self.hedge_delay(endpoint)
+
+            response, error = None, None
+            try:
+                response = await self._send(send, breaker, endpoint, deadline_at, hedge_delay)
+            except httpx.TransportError as e:
+                error = e
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                return response
+
+            wait = self._retry_wait(attempt, response)
+            if attempt == self.attempts or loop.time() + wait >= deadline_at:
+                break
+            reason = str(response.status_code) if response is not None else type(error).__name__
+            self.retries += 1
+            upstream_retries.inc(host=host, reason=reason)
+            if response is not None:
+                await response.aclose()
+            await asyncio.sleep(wait)
+
+        if error is not None:
+            raise error
+        return response
+
+    def _retry_wait(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = retry_after_seconds(response) if response is not None else None
+        if retry_after is not None:
+            # The jitter keeps callers told the same Retry-After from all coming back at once
+            return retry_after + random.uniform(0, self.backoff_factor)
+        return random.uniform(0, self.backoff_factor * 2 ** (attempt - 1))
+
+    async def _send(self, send: Callable[[], Awaitable[httpx.Response]], breaker: CircuitBreaker,
+                    endpoint: str, deadline_at: float, hedge_delay: Optional[float]) -> httpx.Response:
+        """One try: the request, plus a duplicate if it outlasts hedge_delay."""
+        loop = asyncio.get_running_loop()
+        tasks = [asyncio.ensure_future(self._try(send, breaker, endpoint))]
+        pending = set(tasks)
+        done = set()
+        winner = None
+        try:
+            if hedge_delay is not None and loop.time() + hedge_delay < deadline_at:
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+                if pending and breaker.state == CLOSED:
+                    self.hedges += 1
+                    upstream_hedges.inc(host=breaker.host)
+                    tasks.append(asyncio.ensure_future(self._try(send, breaker, endpoint)))
+                    pending.add(tasks[-1])
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        if task is not tasks[0]:
+                            self.hedge_wins += 1
+                            upstream_hedge_wins.inc(host=breaker.host)
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, deadline_at - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    breaker.record(False)
+                    raise httpx.TimeoutException(f"No response from {breaker.host} within the deadline")
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task is not winner and not task.cancelled() and task.exception() is None:
+                    await task.result().aclose()
+
+    async def _try(self, send: Callable[[], Awaitable[httpx.Response]], breaker: CircuitBreaker,
+                   endpoint: str) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await send()
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except httpx.TransportError:
+            breaker.record(False)
+            raise
+        ok = not _is_failure(response.status_code)
+        breaker.record(ok)
+        if ok:
+            samples = self._latencies.get(endpoint)
+            if samples is None:
+                samples = self._latencies[endpoint] = deque(maxlen=LATENCY_WINDOW)
+            samples.append(time.perf_counter() - started)
+        return response
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "rejected": self.rejected,
+            "circuits": {host: breaker.state for host, breaker in self._breakers.items()},
+        }
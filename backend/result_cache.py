@@ -0,0 +1,177 @@
+"""Bounded LRU + TTL cache for JSON-serializable results.
+
+Entries live in an in-memory LRU and, optionally, in a directory on disk so
+they survive restarts. ``get_or_compute`` collapses concurrent misses for
+the same key into a single computation.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600,
+                 disk_dir: Optional[str] = None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.disk_dir = disk_dir or None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+        # Metrics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.compute_seconds = 0.0
+        # Compute time that hits didn't have to spend again
+        self.saved_seconds = 0.0
+
+    # ========== Memory Tier ==========
+    def _entry(self, key: str) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entry(key)
+        return entry[1] if entry is not None else None
+
+    def set(self, key: str, value: Any, expires_at: Optional[float] = None, cost: float = 0.0):
+        """Store value; ``cost`` is how long it took to compute, in seconds."""
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        self._entries[key] = (expires_at, value, cost)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    # ========== Disk Tier ==========
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[tuple]:
+        path = self._disk_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] <= time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry["expires_at"], entry["value"], entry.get("cost", 0.0)
+
+    def _write_disk(self, key: str, value: Any, expires_at: float, cost: float):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"expires_at": expires_at, "value": value, "cost": cost}, f)
+        os.replace(tmp_path, path)
+
+    # ========== Lookup ==========
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for ``key`` or compute and store it.
+
+        Concurrent callers for a key that is being computed share the same
+        in-flight computation. Failed computations are not cached.
+        """
+        entry = self._entry(key)
+        if entry is not None:
+            self.hits += 1
+            self.saved_seconds += entry[2]
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fill(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shield so one caller disconnecting doesn't cancel the others' result
+        return await asyncio.shield(task)
+
+    async def _fill(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        found, value = await self._lookup_disk(key)
+        if found:
+            return value
+        started = time.perf_counter()
+        value = await compute()
+        await self.store(key, value, time.perf_counter() - started)
+        return value
+
+    async def _lookup_disk(self, key: str) -> tuple:
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None:
+                self.disk_hits += 1
+                expires_at, value, cost = entry
+                self.saved_seconds += cost
+                self.set(key, value, expires_at, cost)
+                return True, value
+        return False, None
+
+    async def lookup(self, key: str) -> Optional[Any]:
+        """Cached value from memory or disk, or None. Counted like get_or_compute.
+
+        For callers that produce the value themselves (e.g. while streaming
+        it) and then hand it to ``store``.
+        """
+        entry = self._entry(key)
+        if entry is not None:
+            self.hits += 1
+            self.saved_seconds += entry[2]
+            return entry[1]
+        return (await self._lookup_disk(key))[1]
+
+    async def store(self, key: str, value: Any, cost: float):
+        """Record a computed value (a miss) that took ``cost`` seconds."""
+        self.misses += 1
+        self.compute_seconds += cost
+        expires_at = time.time() + self.ttl
+        self.set(key, value, expires_at, cost)
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._write_disk, key, value, expires_at, cost)
+            except OSError as e:
+                print("Cache write error:", e)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "mean_compute_ms": round(1000 * self.compute_seconds / self.misses, 1) if self.misses else 0.0,
+            "saved_s": round(self.saved_seconds, 3),
+        }
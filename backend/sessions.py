@@ -0,0 +1,174 @@
+"""Server-side session storage.
+
+The session cookie carries only an opaque random ID; the session itself
+lives in a backend shared by every uvicorn worker:
+
+- ``memory``: a dict in the process (single worker only).
+- ``sqlite``: a WAL-mode SQLite file, shared by workers on one host.
+- ``redis``: any Redis-protocol server (Redis, Valkey, KeyDB, or a local
+  stand-in), shared across hosts. Needs the ``redis`` package.
+
+``SessionStore`` keeps a small LRU of decoded sessions in front of the
+backend. Its TTL (SESSION_CACHE_TTL, a few seconds) bounds how long a
+worker can serve a session another worker has since changed. Writes go
+through to the backend and update the local entry.
+"""
+import asyncio
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from metrics import timed
+from result_cache import ResultCache
+
+
+class MemorySessionBackend:
+    def __init__(self):
+        self._sessions: Dict[str, tuple] = {}
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._sessions[session_id]
+            return None
+        return entry[1]
+
+    async def set(self, session_id: str, data: Dict[str, Any], ttl: int):
+        self._sessions[session_id] = (time.time() + ttl, data)
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionBackend:
+    def __init__(self, path: str = "sessions.db"):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, session_id: str, data: Dict[str, Any], ttl: int):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(data), now + ttl),
+            )
+            # Expired rows are swept occasionally rather than on every read
+            if secrets.randbelow(100) == 0:
+                self._db.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def _delete(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, session_id)
+
+    async def set(self, session_id: str, data: Dict[str, Any], ttl: int):
+        await asyncio.to_thread(self._set, session_id, data, ttl)
+
+    async def delete(self, session_id: str):
+        await asyncio.to_thread(self._delete, session_id)
+
+
+class RedisSessionBackend:
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "session:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("SESSION_BACKEND=redis requires the redis package") from e
+        self._redis = redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        data = await self._redis.get(self.prefix + session_id)
+        return json.loads(data) if data else None
+
+    async def set(self, session_id: str, data: Dict[str, Any], ttl: int):
+        await self._redis.set(self.prefix + session_id, json.dumps(data), ex=ttl)
+
+    async def delete(self, session_id: str):
+        await self._redis.delete(self.prefix + session_id)
+
+
+def build_backend(name: str, sqlite_path: str = "sessions.db", redis_url: str = "redis://localhost:6379/0"):
+    if name == "memory":
+        return MemorySessionBackend()
+    if name == "sqlite":
+        return SQLiteSessionBackend(sqlite_path)
+    if name == "redis":
+        return RedisSessionBackend(redis_url)
+    raise ValueError(f"SESSION_BACKEND must be one of ('memory', 'sqlite', 'redis'), got {name!r}")
+
+
+class SessionStore:
+    """Opaque session IDs mapped to ``model`` instances (e.g. SessionData)."""
+
+    def __init__(self, backend, model, max_age: int, cache_size: int = 1024, cache_ttl: float = 5):
+        self.backend = backend
+        self.model = model
+        self.max_age = max_age
+        self.cache = ResultCache(cache_size, cache_ttl)
+
+    async def create(self, session) -> str:
+        session_id = secrets.token_urlsafe(32)
+        await self.save(session_id, session)
+        return session_id
+
+    async def get(self, session_id: str):
+        """The session, or None if unknown or expired.
+
+        Only sessions that exist are cached. Unknown IDs (forged cookies, or a
+        session another worker has only just created) always go to the
+        backend, and cannot push live sessions out of the cache.
+        """
+        session = await self.cache.lookup(session_id)
+        if session is not None:
+            return session
+        started = time.perf_counter()
+        session = await self._load(session_id)
+        if session is not None:
+            await self.cache.store(session_id, session, time.perf_counter() - started)
+        return session
+
+    async def reload(self, session_id: str):
+        """The session as the backend has it now, skipping the local cache."""
+        session = await self._load(session_id)
+        if session is None:
+            self.cache.invalidate(session_id)
+        else:
+            self.cache.set(session_id, session)
+        return session
+
+    async def _load(self, session_id: str):
+        with timed("session_load"):
+            data = await self.backend.get(session_id)
+        return self.model(**data) if data is not None else None
+
+    async def save(self, session_id: str, session):
+        await self.backend.set(session_id, session.dict(), self.max_age)
+        self.cache.set(session_id, session)
+
+    async def delete(self, session_id: str):
+        self.cache.invalidate(session_id)
+        await self.backend.delete(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
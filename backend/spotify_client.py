@@ -0,0 +1,106 @@
+"""Application-lifetime HTTP client for Spotify and the other upstream APIs.
+
+One pooled ``httpx.AsyncClient`` (HTTP/2, keep-alive) is shared by every
+outbound call in auth.py and main.py, so requests reuse warm TCP/TLS
+connections instead of opening a new client per call. Pool limits and
+timeouts come from ``HTTPSettings``; ``close_client`` is registered as a
+shutdown hook by both apps. Every response's status code is counted in
+``upstream_responses_total`` by host.
+
+Calls go through one ``resilience.Upstream`` per process: retries with
+``Retry-After`` and backoff within ``HTTP_DEADLINE``, a circuit breaker per
+host and, for Web API GETs, hedged duplicates after the endpoint's p95.
+"""
+from typing import Any, Dict, Optional
+
+import httpx
+
+from config import HTTPSettings, get_http_settings
+from metrics import record_upstream, timed
+from resilience import Upstream
+
+_client: Optional[httpx.AsyncClient] = None
+_upstream: Optional[Upstream] = None
+
+
+async def _count_response(response: httpx.Response):
+    record_upstream(response.request.url.host, response.status_code)
+
+
+def create_client(settings: HTTPSettings) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=settings.HTTP2,
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+        event_hooks={"response": [_count_response]},
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """The shared client, created on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client(get_http_settings())
+    return _client
+
+
+def create_upstream(settings: HTTPSettings) -> Upstream:
+    return Upstream(
+        attempts=settings.HTTP_RETRIES,
+        backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+        deadline=settings.HTTP_DEADLINE,
+        failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=settings.CIRCUIT_RESET_TIMEOUT,
+        hedge=settings.HTTP_HEDGE_READS,
+        hedge_min_delay=settings.HTTP_HEDGE_MIN_DELAY,
+    )
+
+
+def get_upstream() -> Upstream:
+    """The retry, circuit breaker and hedging policy shared by all calls."""
+    global _upstream
+    if _upstream is None:
+        _upstream = create_upstream(get_http_settings())
+    return _upstream
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def api_get(path: str, access_token: str, params: Optional[Dict[str, Any]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """GET a Spotify Web API path (e.g. "/me/tracks") with a user token."""
+    client = get_client()
+    url = f"{get_http_settings().SPOTIFY_API_URL}{path}"
+    headers = {"Authorization": f"Bearer {access_token}", **(headers or {})}
+    with timed("spotify_api"):
+        return await get_upstream().call(lambda: client.get(url, params=params, headers=headers), url, hedge=True)
+
+
+async def token_request(data: Dict[str, str]) -> httpx.Response:
+    """POST a grant to Spotify's token endpoint."""
+    client = get_client()
+    url = get_http_settings().SPOTIFY_TOKEN_URL
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    with timed("spotify_token"):
+        return await get_upstream().call(lambda: client.post(url, data=data, headers=headers), url)
+
+
+async def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Any other upstream request, e.g. the LLM; retried like the Spotify calls."""
+    client = get_client()
+    return await get_upstream().call(lambda: client.request(method, url, **kwargs), url)
+
+
+async def send(request: httpx.Request, stream: bool = False) -> httpx.Response:
+    """Send a request built with ``get_client().build_request``."""
+    client = get_client()
+    return await get_upstream().call(lambda: client.send(request, stream=stream), request.url)
@@ -0,0 +1,135 @@
+"""Live emotion tracking over a WebSocket.
+
+The client sends JPEG frames as binary messages. Only the newest frame is
+kept: when inference falls behind, older unprocessed frames are dropped, so
+per-client memory and queueing stay bounded no matter how fast frames
+arrive. A face box is reused for a few frames before detection runs again,
+and the server emits an exponentially smoothed emotion vector at a steady
+rate independent of the input frame rate.
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import WebSocket, WebSocketDisconnect
+
+from inference import EMOTION_LABELS, InferencePool
+
+# ========== Configuration ==========
+load_dotenv()
+STREAM_EMIT_HZ = float(os.getenv("STREAM_EMIT_HZ", "10"))
+# Run face detection on every Nth processed frame and reuse the box between
+STREAM_REDETECT_EVERY = int(os.getenv("STREAM_REDETECT_EVERY", "5"))
+# Weight of the newest frame in the exponential moving average
+STREAM_SMOOTHING = float(os.getenv("STREAM_SMOOTHING", "0.4"))
+STREAM_MAX_FRAME_BYTES = int(os.getenv("STREAM_MAX_FRAME_BYTES", str(2 * 1024 * 1024)))
+
+
+class EmotionStream:
+    def __init__(self, websocket: WebSocket, pool: InferencePool,
+                 emit_hz: float = STREAM_EMIT_HZ,
+                 redetect_every: int = STREAM_REDETECT_EVERY,
+                 smoothing: float = STREAM_SMOOTHING):
+        self.websocket = websocket
+        self.pool = pool
+        self.emit_interval = 1.0 / max(emit_hz, 0.1)
+        self.redetect_every = max(1, redetect_every)
+        self.smoothing = min(max(smoothing, 0.0), 1.0)
+
+        self._latest: Optional[bytes] = None
+        self._frame_ready = asyncio.Event()
+        self._box: Optional[tuple] = None
+        self._frames_since_detect = 0
+        self._smoothed: Optional[np.ndarray] = None
+        self._latency = 0.0
+
+        self.frames_received = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+
+    async def run(self):
+        await self.websocket.accept()
+        tasks = [
+            asyncio.create_task(self._receive()),
+            asyncio.create_task(self._process()),
+            asyncio.create_task(self._emit()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    if not isinstance(task.exception(), WebSocketDisconnect):
+                        raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _receive(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            frame = message.get("bytes")
+            if not frame:
+                continue
+            if len(frame) > STREAM_MAX_FRAME_BYTES:
+                await self.websocket.close(code=1009)
+                return
+            self.frames_received += 1
+            if self._latest is not None:
+                # Inference is behind: the newest frame replaces the stale one
+                self.frames_dropped += 1
+            self._latest = frame
+            self._frame_ready.set()
+
+    async def _process(self):
+        while True:
+            await self._frame_ready.wait()
+            self._frame_ready.clear()
+            frame, self._latest = self._latest, None
+
+            box = None
+            if self._box is not None and self._frames_since_detect < self.redetect_every:
+                box = self._box
+            started = time.perf_counter()
+            try:
+                result, used_box = await self.pool.analyze_frame(frame, box)
+            except ValueError:
+                # Undecodable frame; wait for the next one
+                continue
+            self._latency = time.perf_counter() - started
+
+            if box is None:
+                self._box = used_box
+                self._frames_since_detect = 1
+            else:
+                self._frames_since_detect += 1
+
+            vector = np.array([result["emotions"][label] for label in EMOTION_LABELS])
+            if self._smoothed is None:
+                self._smoothed = vector
+            else:
+                self._smoothed = self.smoothing * vector + (1 - self.smoothing) * self._smoothed
+            self.frames_processed += 1
+
+    async def _emit(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            # Skip ticks missed while a send was slow instead of bursting
+            next_tick = max(next_tick + self.emit_interval, loop.time())
+            await asyncio.sleep(next_tick - loop.time())
+            if self._smoothed is None:
+                continue
+            await self.websocket.send_json({
+                "dominant_emotion": EMOTION_LABELS[int(np.argmax(self._smoothed))],
+                "emotions": {label: float(v) for label, v in zip(EMOTION_LABELS, self._smoothed)},
+                "face": list(self._box) if self._box is not None else None,
+                "latency_ms": round(1000 * self._latency, 1),
+                "frames_received": self.frames_received,
+                "frames_processed": self.frames_processed,
+                "frames_dropped": self.frames_dropped,
+            })
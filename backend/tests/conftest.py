@@ -0,0 +1,24 @@
+import os
+import sys
+
+import httpx
+import pytest
+
+# Tests import the backend modules the way the apps do, as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def upstream_transport(monkeypatch):
+    """Point spotify_client at an httpx.MockTransport handler for one test.
+
+    The shared client and resilience policy are swapped through monkeypatch,
+    so the module globals are restored afterwards.
+    """
+    import spotify_client
+
+    def install(handler):
+        monkeypatch.setattr(spotify_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        monkeypatch.setattr(spotify_client, "_upstream", None)
+
+    return install
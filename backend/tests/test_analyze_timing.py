@@ -0,0 +1,49 @@
+import asyncio
+import os
+
+import httpx
+import numpy as np
+
+os.environ.setdefault("SERVER_TIMING", "true")
+os.environ.setdefault("LOG_FILE", "")
+os.environ.setdefault("LIBRARY_DB_PATH", ":memory:")
+
+import inference  # noqa: E402
+import main  # noqa: E402
+
+
+def fake_run(fn, *args):
+    """InferencePool._run without worker processes: canned detection and scores."""
+    async def run():
+        if fn is inference._detect_image:
+            tier = inference.DETECTION_TIERS[0][0]
+            face = np.zeros((48, 48, 1), dtype=np.float32)
+            return face, {"decode": 0.002, "latency": {tier: 0.003}, "tier": tier, "box": (0, 0, 48, 48)}
+        if fn is inference.classify_faces:
+            (faces,) = args
+            return np.tile(np.eye(len(inference.EMOTION_LABELS))[0], (len(faces), 1))
+        raise AssertionError(fn)
+    return run()
+
+
+def test_cache_miss_reports_inference_stages(monkeypatch):
+    monkeypatch.setattr(main.inference_pool, "_run", fake_run)
+    assert main.SERVER_TIMING
+
+    async def run():
+        main.inference_pool.batcher.start()
+        main.job_queue.start()
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post("/analyze", files={"file": ("face.jpg", os.urandom(64))})
+        finally:
+            main.job_queue.stop()
+            main.inference_pool.batcher.stop()
+        return response
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.json()["dominant_emotion"] == inference.EMOTION_LABELS[0]
+    stages = {entry.split(";")[0].strip() for entry in response.headers["server-timing"].split(",")}
+    assert {"upload_read", "queue_wait", "decode", "detect", "classify", "total"} <= stages
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from batching import MicroBatcher
+
+
+class Recorder:
+    """run_batch that records each batch and returns the items doubled."""
+
+    def __init__(self, fail: bool = False):
+        self.batches = []
+        self.fail = fail
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        if self.fail:
+            raise ValueError("model failed")
+        return [item * 2 for item in items]
+
+
+def test_batch_closes_at_max_size():
+    async def run():
+        recorder = Recorder()
+        batcher = MicroBatcher(recorder, max_batch=3, max_wait_ms=1000)
+        batcher.start()
+        results = await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(6))), 0.5)
+        batcher.stop()
+        assert results == [0, 2, 4, 6, 8, 10]
+        assert recorder.batches == [[0, 1, 2], [3, 4, 5]]
+
+    asyncio.run(run())
+
+
+def test_batch_closes_after_max_wait():
+    async def run():
+        loop = asyncio.get_running_loop()
+        recorder = Recorder()
+        batcher = MicroBatcher(recorder, max_batch=16, max_wait_ms=30)
+        batcher.start()
+        started = loop.time()
+        assert await asyncio.gather(batcher.submit(1), batcher.submit(2)) == [2, 4]
+        assert loop.time() - started >= 0.03
+        assert await batcher.submit(3) == 6
+        batcher.stop()
+        assert recorder.batches == [[1, 2], [3]]
+
+    asyncio.run(run())
+
+
+def test_item_that_does_not_fit_opens_the_next_batch():
+    async def run():
+        recorder = Recorder()
+        batcher = MicroBatcher(recorder, max_batch=4, max_wait_ms=20, size_of=lambda item: item)
+        batcher.start()
+        await asyncio.gather(*(batcher.submit(item) for item in (3, 3, 10, 1)))
+        batcher.stop()
+        # 3+3 overflows, so the second 3 is carried; 10 is oversized and goes alone
+        assert recorder.batches == [[3], [3], [10], [1]]
+        assert batcher.stats()["items"] == 17
+
+    asyncio.run(run())
+
+
+def test_batch_failure_reaches_every_caller():
+    async def run():
+        recorder = Recorder(fail=True)
+        batcher = MicroBatcher(recorder, max_batch=4, max_wait_ms=10)
+        batcher.start()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+        assert all(isinstance(r, ValueError) and str(r) == "model failed" for r in results)
+        recorder.fail = False
+        assert await batcher.submit(5) == 10  # the batcher keeps going
+        batcher.stop()
+
+    asyncio.run(run())
+
+
+def test_stop_cancels_in_flight_batched_and_carried_entries():
+    async def run():
+        gate = asyncio.Event()
+
+        async def run_batch(items):
+            await gate.wait()
+            return items
+
+        batcher = MicroBatcher(run_batch, max_batch=4, max_wait_ms=10, size_of=lambda item: item)
+        batcher.start()
+        # 4 fills a batch that waits on the gate and holds the only slot;
+        # 3 then waits for a slot with the second 3 carried behind it
+        submitted = [asyncio.ensure_future(batcher.submit(item)) for item in (4, 3, 3)]
+        await asyncio.sleep(0.05)
+        batcher.stop()
+        results = await asyncio.wait_for(asyncio.gather(*submitted, return_exceptions=True), 1)
+        assert all(isinstance(r, asyncio.CancelledError) for r in results)
+
+    asyncio.run(run())
+
+
+def test_submit_requires_start():
+    batcher = MicroBatcher(Recorder())
+    with pytest.raises(RuntimeError):
+        asyncio.run(batcher.submit(1))
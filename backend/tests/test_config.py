@@ -0,0 +1,29 @@
+import pytest
+
+import spotify_client
+from config import HTTPSettings, Settings, get_http_settings
+
+OAUTH_FIELDS = ("SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET", "SPOTIFY_REDIRECT_URI")
+
+
+def test_http_settings_need_no_oauth_secrets(monkeypatch):
+    for name in OAUTH_FIELDS:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("HTTP_RETRIES", "2")
+
+    assert HTTPSettings(_env_file=None).HTTP_RETRIES == 2
+    with pytest.raises(Exception):
+        Settings(_env_file=None)
+
+
+def test_upstream_is_built_without_oauth_secrets(monkeypatch):
+    # The inference service calls the LLM without the auth service's secrets
+    for name in OAUTH_FIELDS:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("HTTP_DEADLINE", "7.5")
+    monkeypatch.setattr(spotify_client, "_upstream", None)
+    get_http_settings.cache_clear()
+    try:
+        assert spotify_client.get_upstream().deadline == 7.5
+    finally:
+        get_http_settings.cache_clear()
@@ -0,0 +1,58 @@
+import struct
+
+import cv2
+import numpy as np
+
+from imagecodec import decode_with_scale, read_header
+
+
+def _app1(payload: bytes) -> bytes:
+    return b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+
+def _exif(orientation: int) -> bytes:
+    # Little-endian TIFF with one IFD entry: Orientation (0x0112), SHORT
+    ifd = struct.pack("<H", 1) + struct.pack("<HHIHH", 0x0112, 3, 1, orientation, 0) + struct.pack("<I", 0)
+    return b"Exif\x00\x00" + b"II*\x00" + struct.pack("<I", 8) + ifd
+
+
+def _xmp() -> bytes:
+    return b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta xmlns:x='adobe:ns:meta/'/>"
+
+
+def _jpeg(width: int = 64, height: int = 32, segments=()) -> bytes:
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    img[:, : width // 2] = 255
+    ok, encoded = cv2.imencode(".jpg", img)
+    assert ok
+    data = encoded.tobytes()
+    return data[:2] + b"".join(segments) + data[2:]
+
+
+def test_header_without_exif():
+    assert read_header(_jpeg()) == (64, 32, 1)
+
+
+def test_exif_orientation():
+    assert read_header(_jpeg(segments=[_app1(_exif(6))])) == (64, 32, 6)
+
+
+def test_xmp_after_exif_keeps_orientation():
+    data = _jpeg(segments=[_app1(_exif(6)), _app1(_xmp())])
+    assert read_header(data) == (64, 32, 6)
+
+
+def test_xmp_before_exif_keeps_orientation():
+    data = _jpeg(segments=[_app1(_xmp()), _app1(_exif(8))])
+    assert read_header(data) == (64, 32, 8)
+
+
+def test_first_exif_segment_wins():
+    data = _jpeg(segments=[_app1(_exif(6)), _app1(_exif(1))])
+    assert read_header(data) == (64, 32, 6)
+
+
+def test_decode_applies_orientation_with_xmp():
+    img, scale = decode_with_scale(_jpeg(segments=[_app1(_exif(6)), _app1(_xmp())]))
+    assert scale == 1.0
+    assert img.shape[:2] == (64, 32)  # rotated upright
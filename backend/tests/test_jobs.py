@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from jobs import DONE, JobQueue, QueueFull
+
+
+async def _blocked_queue(**kwargs):
+    """A one-worker queue busy with a job that runs until ``gate`` is set."""
+    queue = JobQueue(concurrency=1, **kwargs)
+    queue.start()
+    gate = asyncio.Event()
+    queue.submit("gate", gate.wait)
+    await asyncio.sleep(0)  # the worker picks the gate job up
+    assert queue.running == 1
+    return queue, gate
+
+
+def test_owners_are_served_round_robin():
+    async def run():
+        queue, gate = await _blocked_queue()
+        order = []
+
+        def job(name):
+            async def run_job():
+                order.append(name)
+                return name
+            return run_job
+
+        jobs = [queue.submit(owner, job(name))
+                for owner, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("b", "b2"), ("c", "c1")]]
+        urgent = queue.submit("d", job("d1"), priority=-1)
+        gate.set()
+        for queued in jobs + [urgent]:
+            await queue.wait(queued, timeout=1)
+        queue.stop()
+        assert order == ["d1", "a1", "b1", "c1", "a2", "b2", "a3"]
+        assert all(queued.status == DONE for queued in jobs)
+
+    asyncio.run(run())
+
+
+def test_owner_over_its_limit_is_rejected():
+    async def run():
+        queue, gate = await _blocked_queue(max_per_owner=2, max_wait=100)
+        queue.submit("a", gate.wait)
+        queue.submit("a", gate.wait)
+        with pytest.raises(QueueFull) as raised:
+            queue.submit("a", gate.wait)
+        assert "this client" in str(raised.value)
+        queue.submit("b", gate.wait)  # other owners are unaffected
+        assert queue.stats()["rejected"] == 1
+        gate.set()
+        queue.stop()
+
+    asyncio.run(run())
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def run():
+        queue, gate = await _blocked_queue(max_queued=3, max_wait=100)
+        queue.mean_run_seconds = 2.0
+        for owner in "abc":
+            queue.submit(owner, gate.wait)
+        with pytest.raises(QueueFull) as raised:
+            queue.submit("d", gate.wait)
+        assert str(raised.value) == "Analysis queue is full"
+        # 3 queued + 1 running, 2s each, one worker
+        assert raised.value.retry_after == 8
+        gate.set()
+        queue.stop()
+
+    asyncio.run(run())
+
+
+def test_long_estimated_wait_is_rejected():
+    async def run():
+        queue, gate = await _blocked_queue(max_wait=1)
+        queue.mean_run_seconds = 1.5
+        with pytest.raises(QueueFull) as raised:
+            queue.submit("a", gate.wait)
+        assert raised.value.retry_after == 2
+        gate.set()
+        queue.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,32 @@
+import asyncio
+import os
+
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "test")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "test")
+os.environ.setdefault("SPOTIFY_REDIRECT_URI", "http://127.0.0.1:3000/callback")
+os.environ.setdefault("LOG_FILE", "")
+os.environ.setdefault("LIBRARY_DB_PATH", ":memory:")
+
+import auth  # noqa: E402
+
+
+def test_login_syncs_are_tracked_and_failures_logged(monkeypatch, caplog):
+    async def failing_sync(user_id, access_token):
+        await asyncio.sleep(0)
+        raise RuntimeError("spotify down")
+
+    monkeypatch.setattr(auth.library_sync, "sync", failing_sync)
+
+    async def run():
+        task = auth.start_library_sync("u1", "token")
+        assert task in auth._library_syncs
+        await asyncio.wait([task])
+        await asyncio.sleep(0)  # let the done-callback run
+        assert task not in auth._library_syncs
+
+    auth.logger.addHandler(caplog.handler)
+    try:
+        asyncio.run(run())
+    finally:
+        auth.logger.removeHandler(caplog.handler)
+    assert any(r.getMessage() == "Library sync failed" and r.error == "spotify down" for r in caplog.records)
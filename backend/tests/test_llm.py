@@ -0,0 +1,32 @@
+import asyncio
+
+from llm import SharedStream, build_prompt
+
+
+def test_shared_stream_replays_to_late_followers():
+    async def run():
+        stream = SharedStream()
+
+        async def collect():
+            return [chunk async for chunk in stream.follow()]
+
+        early = asyncio.ensure_future(collect())
+        stream.publish("a")
+        await asyncio.sleep(0)
+        late = asyncio.ensure_future(collect())
+        stream.publish("b")
+        await asyncio.sleep(0)
+        stream.publish("c")
+        stream.finish()
+        assert await early == ["a", "b", "c"]
+        assert await late == ["a", "b", "c"]
+        assert [chunk async for chunk in stream.follow()] == ["a", "b", "c"]
+
+    asyncio.run(run())
+
+
+def test_build_prompt_lists_at_least_limit_songs():
+    tracks = [{"name": f"Song {i}", "artists": [{"name": "Artist"}]} for i in range(50)]
+    prompt, listed = build_prompt("calm", tracks, limit=5, token_budget=10)
+    assert len(listed) == 5
+    assert "5. Song 4 - Artist" in prompt
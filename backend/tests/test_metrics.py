@@ -0,0 +1,34 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+
+from metrics import REGISTRY, MetricsMiddleware
+
+
+def _routes(app_name: str):
+    prefix = f'http_requests_total{{app="{app_name}",route="'
+    return {line[len(prefix):].split('"', 1)[0] for line in REGISTRY.render().splitlines() if line.startswith(prefix)}
+
+
+def test_routes_are_labelled_by_template():
+    app = FastAPI()
+
+    @app.get("/jobs/{job_id}")
+    async def job(job_id: str):
+        return {"id": job_id}
+
+    app.add_middleware(CORSMiddleware, allow_origins=["http://x"], allow_methods=["GET"])
+    app.add_middleware(MetricsMiddleware, app_name="test-routes")
+
+    async def requests():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as client:
+            for job_id in ("a", "b", "c"):
+                assert (await client.get(f"/jobs/{job_id}")).status_code == 200
+            await client.get("/nope/1")
+            preflight = {"Origin": "http://x", "Access-Control-Request-Method": "GET"}
+            assert (await client.options("/anything/123", headers=preflight)).status_code == 200
+
+    asyncio.run(requests())
+    assert _routes("test-routes") == {"/jobs/{job_id}", "unmatched"}
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from library import LibraryStore
+from ranking import MoodRanker, top_k
+
+
+class FakeStore:
+    """Library with features already cached for every track."""
+
+    def __init__(self):
+        self.builds = []
+        self.versions = {}
+        self.gate = None
+
+    def version(self, user_id):
+        return self.versions.get(user_id, 1)
+
+    def missing_audio_features(self, user_id):
+        return []
+
+    def audio_features(self, user_id):
+        if self.gate is not None:
+            self.gate.wait()
+        version = self.version(user_id)
+        self.builds.append((user_id, version))
+        return [(f"{user_id}-v{version}", 0.5, 0.5, 120.0)]
+
+
+def test_matrices_are_capped_least_recently_used_first():
+    async def run():
+        store = FakeStore()
+        ranker = MoodRanker(store, max_users=2)
+        await ranker.matrix("a", "token")
+        await ranker.matrix("b", "token")
+        await ranker.matrix("a", "token")  # a is now the most recent
+        await ranker.matrix("c", "token")  # evicts b
+        assert list(ranker._matrices) == ["a", "c"]
+        assert ranker.stats()["users"] == 2
+
+        await ranker.matrix("a", "token")
+        await ranker.matrix("b", "token")
+        assert [user for user, _ in store.builds] == ["a", "b", "c", "b"]
+
+    asyncio.run(run())
+
+
+def test_matrix_is_rebuilt_only_when_the_library_changes():
+    async def run():
+        store = FakeStore()
+        ranker = MoodRanker(store)
+        ids, _ = await ranker.matrix("a", "token")
+        ids, _ = await ranker.matrix("a", "token")
+        assert store.builds == [("a", 1)]
+
+        store.versions["a"] = 2
+        ids, _ = await ranker.matrix("a", "token")
+        assert list(ids) == ["a-v2"]
+        assert store.builds == [("a", 1), ("a", 2)]
+
+    asyncio.run(run())
+
+
+def test_caller_does_not_join_a_build_for_an_older_version():
+    async def run():
+        store = FakeStore()
+        store.gate = threading.Event()
+        ranker = MoodRanker(store)
+        old = asyncio.ensure_future(ranker.matrix("a", "token"))
+        await asyncio.sleep(0.05)  # the v1 build is waiting on the gate
+        store.versions["a"] = 2
+        new = asyncio.ensure_future(ranker.matrix("a", "token"))
+        await asyncio.sleep(0.05)
+        store.gate.set()
+        (new_ids, _), _ = await asyncio.gather(new, old)
+        assert list(new_ids) == ["a-v2"]
+        # The v1 build finishing last does not replace the newer matrix
+        assert ranker._matrices["a"][0] == 2
+
+    asyncio.run(run())
+
+
+def test_version_ignores_syncs_that_change_nothing():
+    store = LibraryStore(":memory:")
+    item = {"added_at": "2024-01-01T00:00:00Z", "track": {"id": "t1", "name": "Song", "artists": []}}
+    assert store.version("u") == 0
+    store.save("u", [item], total=1, replace=True)
+    assert store.version("u") == 1
+
+    store.mark_synced("u")  # 304 / fresh ETag
+    store.save("u", [], total=1)  # incremental sync with no new saves
+    assert store.version("u") == 1
+
+    store.save("u", [dict(item, track={"id": "t2", "name": "Other", "artists": []})], total=2)
+    assert store.version("u") == 2
+    store.close()
+
+
+def test_top_k_nearest_first():
+    matrix = np.array([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0], [0.4, 0.4, 0.4]], dtype=np.float32)
+    order, distances = top_k(matrix, np.zeros(3, dtype=np.float32), 2)
+    assert order.tolist() == [0, 2]
+    assert distances[0] <= distances[1]
@@ -0,0 +1,114 @@
+import asyncio
+import sqlite3
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+
+from ratelimit import BudgetedLimiter, SQLiteStorage
+
+
+def make_app(limiter: BudgetedLimiter) -> FastAPI:
+    app = FastAPI()
+    app.state.limiter = limiter
+    app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+    @app.get("/limited")
+    @limiter.limit("3/minute")
+    async def limited(request: Request):
+        return {"ok": True}
+
+    return app
+
+
+async def hit(app: FastAPI, times: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return [(await client.get("/limited")).status_code for _ in range(times)]
+
+
+def locked_by_another_worker(path):
+    """A connection holding the database's write lock, as a stuck worker would."""
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    return other
+
+
+@pytest.mark.parametrize("strategy", ["fixed-window", "moving-window"])
+def test_slowapi_limiter_on_sqlite_storage(tmp_path, strategy):
+    uri = f"sqlite:///{tmp_path / 'ratelimit.db'}"
+    limiter = BudgetedLimiter(key_func=get_remote_address, storage_uri=uri, strategy=strategy)
+    assert isinstance(limiter.storage, SQLiteStorage)
+
+    statuses = asyncio.run(hit(make_app(limiter), 5))
+
+    assert statuses == [200, 200, 200, 429, 429]
+    stats = limiter.stats()
+    assert stats["operations"] >= 5
+    assert stats["busy"] == 0
+
+
+def test_limit_is_shared_by_limiters_on_one_file(tmp_path):
+    # Two workers, each with its own limiter, share one budget
+    uri = f"sqlite:///{tmp_path / 'ratelimit.db'}"
+    first = make_app(BudgetedLimiter(key_func=get_remote_address, storage_uri=uri))
+    second = make_app(BudgetedLimiter(key_func=get_remote_address, storage_uri=uri))
+
+    assert asyncio.run(hit(first, 2)) == [200, 200]
+    assert asyncio.run(hit(second, 2)) == [200, 429]
+
+
+def test_busy_storage_fails_open_within_budget(tmp_path):
+    path = tmp_path / "ratelimit.db"
+    limiter = BudgetedLimiter(key_func=get_remote_address, storage_uri=f"sqlite:///{path}", budget_us=2000)
+    other = locked_by_another_worker(path)
+    try:
+        statuses = asyncio.run(hit(make_app(limiter), 5))
+    finally:
+        other.rollback()
+        other.close()
+
+    assert statuses == [200] * 5
+    stats = limiter.stats()
+    assert stats["busy"] == 5
+    # Gave up near the budget instead of sqlite3's usual 5 s
+    assert stats["max_us"] < 500_000
+
+
+def test_busy_storage_falls_back_to_memory(tmp_path):
+    path = tmp_path / "ratelimit.db"
+    limiter = BudgetedLimiter(key_func=get_remote_address, storage_uri=f"sqlite:///{path}",
+                              budget_us=2000, over_budget="memory")
+    other = locked_by_another_worker(path)
+    try:
+        statuses = asyncio.run(hit(make_app(limiter), 5))
+    finally:
+        other.rollback()
+        other.close()
+
+    # Still limited, by this worker's own counters
+    assert statuses == [200, 200, 200, 429, 429]
+    assert limiter.stats()["busy"] >= 1
+
+
+def test_enforce_waits_for_the_storage(tmp_path):
+    limiter = BudgetedLimiter(key_func=get_remote_address, storage_uri=f"sqlite:///{tmp_path / 'r.db'}",
+                              over_budget="enforce")
+    assert limiter.storage.budget is None
+    with pytest.raises(ValueError):
+        BudgetedLimiter(key_func=get_remote_address, over_budget="sometimes")
+
+
+def test_fixed_window_counter(tmp_path):
+    storage = SQLiteStorage(f"sqlite:///{tmp_path / 'ratelimit.db'}")
+
+    assert storage.incr("k", 60, amount=2) == 2
+    expiry = storage.get_expiry("k")
+    assert storage.incr("k", 60) == 3
+    assert storage.get("k") == 3
+    assert storage.get_expiry("k") == expiry
+    storage.clear("k")
+    assert storage.get("k") == 0
@@ -0,0 +1,179 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitOpen, Upstream, retry_after_seconds
+
+URL = "https://api.test/v1/me"
+
+
+def _call(upstream: Upstream, handler, **kwargs):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await upstream.call(lambda: client.get(URL), URL, **kwargs)
+    return run()
+
+
+def test_retry_after_is_honoured():
+    calls = []
+
+    def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0.3"})
+        return httpx.Response(200)
+
+    upstream = Upstream(attempts=3, backoff_factor=0.01, deadline=5)
+    response = asyncio.run(_call(upstream, handler))
+    assert response.status_code == 200
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.3
+    assert upstream.stats()["retries"] == 1
+
+
+def test_retry_after_past_deadline_returns_at_once():
+    calls = []
+
+    def handler(request):
+        calls.append(1)
+        return httpx.Response(503, headers={"Retry-After": "30"})
+
+    started = time.monotonic()
+    response = asyncio.run(_call(Upstream(attempts=3, deadline=1), handler))
+    assert response.status_code == 503
+    assert len(calls) == 1
+    assert time.monotonic() - started < 0.5
+
+
+def test_client_errors_are_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(1)
+        return httpx.Response(400)
+
+    assert asyncio.run(_call(Upstream(attempts=3), handler)).status_code == 400
+    assert len(calls) == 1
+
+
+def test_retry_after_http_date():
+    response = httpx.Response(503, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+    assert retry_after_seconds(response) == 0.0
+    assert retry_after_seconds(httpx.Response(503, headers={"Retry-After": "nonsense"})) is None
+
+
+def test_breaker_trips_and_recovers():
+    status = {"code": 503}
+    calls = []
+
+    def handler(request):
+        calls.append(1)
+        return httpx.Response(status["code"])
+
+    upstream = Upstream(attempts=1, failure_threshold=3, reset_timeout=0.2)
+
+    async def run():
+        for _ in range(3):
+            assert (await _call(upstream, handler)).status_code == 503
+        breaker = upstream.breaker("api.test")
+        assert breaker.state == OPEN
+
+        with pytest.raises(CircuitOpen) as raised:
+            await _call(upstream, handler)
+        assert raised.value.retry_after >= 1
+        assert len(calls) == 3  # failed fast, nothing sent
+
+        await asyncio.sleep(0.25)
+        status["code"] = 200
+        assert (await _call(upstream, handler)).status_code == 200
+        assert breaker.state == CLOSED
+        assert upstream.stats()["rejected"] == 1
+
+    asyncio.run(run())
+
+
+def test_failed_probe_reopens_and_only_one_probe_goes_out():
+    async def run():
+        gate = asyncio.Event()  # created inside the loop it's used on
+
+        async def handler(request):
+            await gate.wait()
+            return httpx.Response(503)
+
+        upstream = Upstream(attempts=1, failure_threshold=1, reset_timeout=0.05)
+        gate.set()
+        await _call(upstream, handler)
+        breaker = upstream.breaker("api.test")
+        assert breaker.state == OPEN
+
+        await asyncio.sleep(0.06)
+        gate.clear()
+        probe = asyncio.ensure_future(_call(upstream, handler))
+        await asyncio.sleep(0.01)
+        assert breaker.state == HALF_OPEN
+        with pytest.raises(CircuitOpen):
+            await _call(upstream, handler)
+        gate.set()
+        assert (await probe).status_code == 503
+        assert breaker.state == OPEN
+
+    asyncio.run(run())
+
+
+def test_slow_read_is_hedged_and_loser_cancelled():
+    state = {"calls": 0, "slow": False, "cancelled": 0}
+
+    async def handler(request):
+        state["calls"] += 1
+        if state["slow"] and state["calls"] % 2 == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                state["cancelled"] += 1
+                raise
+        return httpx.Response(200)
+
+    upstream = Upstream(attempts=1, hedge_min_delay=0.01)
+
+    async def run():
+        for _ in range(25):  # enough samples for a p95
+            await _call(upstream, handler, hedge=True)
+        assert upstream.hedge_delay("api.test/v1/me") is not None
+
+        state.update(calls=0, slow=True)
+        started = time.monotonic()
+        assert (await _call(upstream, handler, hedge=True)).status_code == 200
+        assert time.monotonic() - started < 1
+        await asyncio.sleep(0)
+        assert state["calls"] == 2
+        assert state["cancelled"] == 1
+        stats = upstream.stats()
+        assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+    asyncio.run(run())
+
+
+def test_reads_are_not_hedged_without_samples():
+    calls = []
+
+    async def handler(request):
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200)
+
+    upstream = Upstream(attempts=1, hedge_min_delay=0.001)
+    asyncio.run(_call(upstream, handler, hedge=True))
+    assert len(calls) == 1
+
+
+def test_hung_upstream_fails_at_the_deadline():
+    async def handler(request):
+        await asyncio.sleep(5)
+        return httpx.Response(200)
+
+    started = time.monotonic()
+    with pytest.raises(httpx.TimeoutException):
+        asyncio.run(_call(Upstream(attempts=3, backoff_factor=0.01), handler, deadline=0.2))
+    assert time.monotonic() - started < 1
@@ -0,0 +1,47 @@
+import asyncio
+
+from pydantic import BaseModel
+
+from sessions import MemorySessionBackend, SessionStore
+
+
+class Session(BaseModel):
+    user_id: str
+
+
+class CountingBackend(MemorySessionBackend):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    async def get(self, session_id):
+        self.reads += 1
+        return await super().get(session_id)
+
+
+def test_unknown_ids_are_not_cached():
+    async def run():
+        backend = CountingBackend()
+        store = SessionStore(backend, Session, max_age=60, cache_size=2, cache_ttl=60)
+        live = await store.create(Session(user_id="u1"))
+        for i in range(10):
+            assert await store.get(f"forged-{i}") is None
+        assert store.stats()["entries"] == 1
+        reads = backend.reads
+        assert (await store.get(live)).user_id == "u1"
+        assert backend.reads == reads  # still cached despite the forged lookups
+
+    asyncio.run(run())
+
+
+def test_session_created_elsewhere_is_seen_at_once():
+    async def run():
+        backend = CountingBackend()
+        this_worker = SessionStore(backend, Session, max_age=60, cache_ttl=60)
+        other_worker = SessionStore(backend, Session, max_age=60, cache_ttl=60)
+        session_id = "sid"
+        assert await this_worker.get(session_id) is None
+        await other_worker.save(session_id, Session(user_id="u2"))
+        assert (await this_worker.get(session_id)).user_id == "u2"
+
+    asyncio.run(run())
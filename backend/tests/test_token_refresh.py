@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+
+import httpx
+
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "test")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "test")
+os.environ.setdefault("SPOTIFY_REDIRECT_URI", "http://127.0.0.1:3000/callback")
+os.environ.setdefault("LOG_FILE", "")
+os.environ.setdefault("LIBRARY_DB_PATH", ":memory:")
+
+import spotify_client  # noqa: E402
+from auth import AuthService, SessionData  # noqa: E402
+from sessions import MemorySessionBackend, SessionStore  # noqa: E402
+
+
+class RotatingTokenEndpoint:
+    """Spotify's token endpoint, rotating the refresh token on every use."""
+
+    def __init__(self):
+        self.current = "refresh-0"
+        self.refreshes = 0
+        self.rejected = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        form = dict(x.split("=", 1) for x in request.content.decode().split("&"))
+        if form["refresh_token"] != self.current:
+            self.rejected += 1
+            return httpx.Response(400, json={"error": "invalid_grant"})
+        self.refreshes += 1
+        self.current = f"refresh-{self.refreshes}"
+        return httpx.Response(200, json={
+            "access_token": f"access-{self.refreshes}", "token_type": "Bearer",
+            "expires_in": 3600, "refresh_token": self.current, "scope": "user-library-read",
+        })
+
+
+def test_workers_sharing_sessions_refresh_once(upstream_transport):
+    endpoint = RotatingTokenEndpoint()
+    upstream_transport(endpoint)
+
+    async def run():
+        shared = MemorySessionBackend()
+        workers = []
+        for _ in range(3):
+            worker = AuthService()
+            worker.sessions = SessionStore(shared, SessionData, max_age=1800, cache_ttl=60)
+            workers.append(worker)
+
+        expiring = SessionData(user_id="u1", access_token="access-0", refresh_token="refresh-0",
+                               expires_at=int(time.time()) + 60)
+        session_id = await workers[0].sessions.create(expiring)
+        for worker in workers:
+            worker._remember(session_id, await worker.sessions.get(session_id))
+
+        for worker in workers:
+            await worker.refresh_expiring()
+
+        assert endpoint.refreshes == 1
+        assert endpoint.rejected == 0
+        for worker in workers:
+            assert await worker.get_valid_token(session_id, expiring) == "access-1"
+        await spotify_client.close_client()
+
+    asyncio.run(run())
+
+
+def test_refresh_updates_sessions_from_earlier_logins(upstream_transport):
+    endpoint = RotatingTokenEndpoint()
+    upstream_transport(endpoint)
+
+    async def run():
+        worker = AuthService()
+        worker.sessions = SessionStore(MemorySessionBackend(), SessionData, max_age=1800)
+        now = int(time.time())
+        first = SessionData(user_id="u1", access_token="old-access", refresh_token="old-refresh",
+                            expires_at=now + 30)
+        second = SessionData(user_id="u1", access_token="access-0", refresh_token="refresh-0",
+                             expires_at=now + 60)
+        first_id = await worker.sessions.create(first)
+        second_id = await worker.sessions.create(second)
+        # Logged in on a laptop, then on a phone
+        worker._remember(first_id, first)
+        worker._remember(second_id, second)
+
+        await worker.refresh_expiring()
+
+        assert endpoint.refreshes == 1
+        for session_id in (first_id, second_id):
+            session = await worker.sessions.get(session_id)
+            assert session.access_token == "access-1"
+            assert session.refresh_token == "refresh-1"
+        await spotify_client.close_client()
+
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+"""Request body size limiting for upload endpoints.
+
+The limit is enforced while the body streams in: a Content-Length above the
+limit is rejected before any of the body is read, and chunked bodies are cut
+off as soon as the running total passes it, so an oversized upload is never
+spooled in full.
+"""
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+
+
+class UploadSizeLimitMiddleware:
+    """Pure ASGI middleware rejecting request bodies larger than ``max_bytes``.
+
+    ``path_limits`` overrides the limit for specific paths, e.g. batch
+    endpoints that legitimately carry many files.
+    """
+
+    def __init__(self, app, max_bytes: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+        if max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    too_large = int(value) > max_bytes
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    error = UploadTooLarge(max_bytes)
+                    response = JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Raised inside form parsing; FastAPI turns it into a 413
+                    raise UploadTooLarge(max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)